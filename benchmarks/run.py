@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+End to end throughput benchmark of tap-brightpearl against the local API simulator.
+
+Each stream runs alone in its own tap process (full sync, no state) and is reported with:
+records/s, requests/s, peak RSS of the tap process and, from the tap's metrics summary
+(metrics_json_path), the bytes received and the time spent throttled, transforming and writing.
+
+    python benchmarks/run.py                                  # default streams
+    python benchmarks/run.py -s orders -s goods_movement --latency-ms 30 --config '{"max_concurrency": 8}'
+    python benchmarks/run.py --json bench.json --baseline last_release.json --tolerance 0.2
+
+With --baseline the run fails (exit code 1) when a stream is slower than the baseline by more
+than the tolerance, so regressions are caught before a release.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCHMARKS_DIR, "..")
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import simulator  # noqa: E402
+
+DEFAULT_STREAMS = ["brand", "order_status", "product", "goods_movement", "order_search", "orders", "product_price"]
+
+
+def build_catalog(stream_name):
+    with open(simulator.SHIPPED_CATALOG) as catalog_file:
+        catalog = json.load(catalog_file)
+    for stream in catalog["streams"]:
+        stream["metadata"] = [{"breadcrumb": [], "metadata": {"selected": stream["tap_stream_id"] == stream_name}}]
+    return catalog
+
+
+def run_stream(stream_name, port, sim, extra_config, work_dir):
+    config = {
+        "brightpearl-app-ref": "bench",
+        "brightpearl-account-token": "bench",
+        "domain": "127.0.0.1:{}".format(port),
+        "account_id": "bench",
+        "protocol": "http",
+    }
+    config.update(extra_config)
+
+    metrics_path = os.path.join(work_dir, "metrics-{}.json".format(stream_name))
+    config["metrics_json_path"] = metrics_path
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+
+    config_path = os.path.join(work_dir, "config.json")
+    catalog_path = os.path.join(work_dir, "catalog-{}.json".format(stream_name))
+    with open(config_path, "w") as config_file:
+        json.dump(config, config_file)
+    with open(catalog_path, "w") as catalog_file:
+        json.dump(build_catalog(stream_name), catalog_file)
+
+    stats_before = dict(sim.stats)
+    stderr_path = os.path.join(work_dir, "{}.log".format(stream_name))
+    started = time.monotonic()
+    with open(stderr_path, "w") as stderr_file:
+        process = subprocess.Popen(
+            [sys.executable, "-c", "from tap_brightpearl import main; main()",
+             "-c", config_path, "--catalog", catalog_path],
+            stdout=subprocess.PIPE, stderr=stderr_file, cwd=ROOT_DIR,
+            env=dict(os.environ, PYTHONPATH=ROOT_DIR + os.pathsep + os.environ.get("PYTHONPATH", "")))
+
+        records = 0
+        for line in process.stdout:
+            if line.startswith(b'{"type":"RECORD"') or line.startswith(b'{"type": "RECORD"'):
+                records += 1
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.monotonic() - started
+
+    summary = {}
+    if os.path.exists(metrics_path):
+        with open(metrics_path) as metrics_file:
+            summary = json.load(metrics_file)
+    stages = summary.get("streams", {}).get(stream_name, {})
+
+    requests = sim.stats["requests"] - stats_before["requests"]
+    return {
+        "stream": stream_name,
+        "exit_code": process.returncode,
+        "records": records,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(records / elapsed, 1) if elapsed else 0,
+        "requests": requests,
+        "requests_per_second": round(requests / elapsed, 1) if elapsed else 0,
+        "http_429": (sim.stats["throttled"] + sim.stats["injected_errors"]
+                     - stats_before["throttled"] - stats_before["injected_errors"]),
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),
+        "received_mb": round(sum(endpoint["bytes"] for endpoint in summary.get("endpoints", {}).values())
+                             / 1024 / 1024, 2) if summary else None,
+        "throttled_seconds": summary.get("rate_limiter", {}).get("throttled_seconds"),
+        "transform_seconds": stages.get("transform"),
+        "write_seconds": stages.get("write"),
+        "log": stderr_path,
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as baseline_file:
+        baseline = {result["stream"]: result for result in json.load(baseline_file)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["stream"])
+        if previous and previous["records_per_second"] and \
+                result["records_per_second"] < previous["records_per_second"] * (1 - tolerance):
+            regressions.append("{}: {} records/s, baseline {}".format(
+                result["stream"], result["records_per_second"], previous["records_per_second"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-s", "--stream", action="append", help="stream to run, repeatable")
+    parser.add_argument("--config", default="{}", help="extra tap config, JSON")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--row-latency-ms", type=float, default=0.0, help="simulated cost of each search row")
+    parser.add_argument("--quota", type=int, default=1000, help="requests per throttle window")
+    parser.add_argument("--window-ms", type=int, default=10000)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--search-rows", type=int, default=20000)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed records/s drop against the baseline")
+    args = parser.parse_args()
+
+    server, sim = simulator.start(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                  row_latency_ms=args.row_latency_ms, quota=args.quota,
+                                  window_ms=args.window_ms, error_rate=args.error_rate,
+                                  search_rows=args.search_rows, orders=args.orders, products=args.products)
+    port = server.server_address[1]
+    extra_config = json.loads(args.config)
+
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="tap-brightpearl-bench-")
+    header = "{:<22} {:>9} {:>8} {:>10} {:>9} {:>6} {:>9} {:>8} {:>10} {:>10} {:>8}".format(
+        "stream", "records", "seconds", "records/s", "req/s", "429s", "rss MB", "recv MB", "throttled",
+        "transform", "write")
+    print(header)
+    print("-" * len(header))
+    for stream_name in args.stream or DEFAULT_STREAMS:
+        result = run_stream(stream_name, port, sim, extra_config, work_dir)
+        results.append(result)
+        measured = {key: "-" if result[key] is None else result[key]
+                    for key in ("received_mb", "throttled_seconds", "transform_seconds", "write_seconds")}
+        print("{stream:<22} {records:>9} {seconds:>8} {records_per_second:>10} {requests_per_second:>9} "
+              "{http_429:>6} {peak_rss_mb:>9} {received:>8} {throttled:>10} {transform:>10} {write:>8}{failed}".format(
+                  received=measured["received_mb"], throttled=measured["throttled_seconds"],
+                  transform=measured["transform_seconds"], write=measured["write_seconds"],
+                  failed="" if result["exit_code"] == 0 else "  FAILED, see " + result["log"], **result))
+    server.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"config": extra_config, "args": vars(args), "results": results}, json_file, indent=2)
+
+    failed = [result["stream"] for result in results if result["exit_code"] != 0]
+    regressions = compare(results, args.baseline, args.tolerance) if args.baseline else []
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
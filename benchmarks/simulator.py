@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Deterministic local stand-in for the Brightpearl public API.
+
+Serves every endpoint of Stream.resource with generated data shaped after the shipped catalog
+(tap_brightpearl/schemas/schema.json):
+
+  * search endpoints (*-search): metaData/results paging (firstResult, pageSize: default 200,
+    max 500, each row adds --row-latency-ms), the columns
+    parameter and from/to filters on any column ("updatedOn=2020-01-01/")
+  * OPTIONS idsets (order-service/order, product-service/product): getUris of 200 IDs
+  * dependent GETs with idsets ("order-service/order/1-200,305")
+  * other GET endpoints: a short list of objects
+
+Every response carries the brightpearl-requests-remaining / brightpearl-next-throttle-period
+headers of a fixed throttle window; requests above the quota get a 429, and 429s and latency can
+be injected. The same seed always produces the same data.
+
+    python benchmarks/simulator.py --port 8080 --latency-ms 50 --quota 200 --window-ms 60000
+
+GET /__stats returns the request counters.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tap_brightpearl.idset import parse_ranges  # noqa: E402
+from tap_brightpearl.stream import Stream  # noqa: E402
+
+SHIPPED_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                               "tap_brightpearl", "schemas", "schema.json")
+
+BASE_DATE = datetime(2020, 1, 1, 0, 0, 0)
+IDSET_SIZE = 200
+MAX_PAGE_SIZE = 500
+# rows of a search page without pageSize
+DEFAULT_PAGE_SIZE = 200
+DATE_COLUMN = re.compile(r"(On|Date|date|Time)$")
+
+
+def normalize(path):
+    return re.sub("/+", "/", path).strip("/")
+
+
+class Dataset(object):
+    """
+        Generated rows, computed from (stream, id) so nothing but the id lists is kept in memory.
+    """
+
+    def __init__(self, seed=0, search_rows=5000, orders=5000, products=2000, lookup_rows=20):
+        self.seed = seed
+        self.search_rows = search_rows
+        self.orders = orders
+        self.products = products
+        self.lookup_rows = lookup_rows
+
+        with open(SHIPPED_CATALOG) as catalog_file:
+            catalog = json.load(catalog_file)
+        self.streams = {stream["tap_stream_id"]: stream for stream in catalog["streams"]}
+        self._index = {}
+        self._column_values = {}
+        self._lock = threading.Lock()
+
+    def row_count(self, stream_name):
+        resource = Stream.resource.get(stream_name, {})
+        if stream_name in ("order_search", "orders", "order_idset") or \
+                resource.get("depending_on") == "order-service/order":
+            return self.orders
+        if stream_name in ("product", "product_idset") or resource.get("depending_on") == "product-service/product":
+            return self.products
+        if stream_name.endswith("search") or "state_filter" in resource:
+            return self.search_rows
+        return self.lookup_rows
+
+    def columns(self, stream_name):
+        stream = self.streams.get(stream_name)
+        if stream is None:
+            return ["id", "name", "updatedOn"]
+        return list(stream["schema"]["properties"])
+
+    def updated_on(self, stream_name, object_id):
+        # spread over two years, not in ID order, a few rows updated "recently"
+        minutes = (object_id * 7919 + self.seed) % (2 * 365 * 24 * 60)
+        return (BASE_DATE + timedelta(minutes=minutes)).strftime("%Y-%m-%dT%H:%M:%S.000+00:00")
+
+    def value(self, stream_name, column, column_schema, object_id, position):
+        types = column_schema.get("type", ["string"])
+        types = types if isinstance(types, list) else [types]
+        if position == 0:
+            return object_id
+        if DATE_COLUMN.search(column):
+            return self.updated_on(stream_name, object_id + position if column != "updatedOn" else object_id)
+        if "integer" in types:
+            return (object_id * 31 + position) % 1000
+        if "number" in types:
+            return round(((object_id * 17 + position) % 10000) / 100.0, 2)
+        if "boolean" in types:
+            return (object_id + position) % 2 == 0
+        if "object" in types:
+            return {"id": object_id, "value": "{}-{}".format(column, object_id)}
+        if "array" in types:
+            return [object_id, position]
+        return "{}-{}".format(column, object_id)
+
+    def row(self, stream_name, object_id):
+        stream = self.streams.get(stream_name)
+        properties = stream["schema"]["properties"] if stream else {c: {} for c in self.columns(stream_name)}
+        return {column: self.value(stream_name, column, column_schema, object_id, position)
+                for position, (column, column_schema) in enumerate(properties.items())}
+
+    def column_values(self, stream_name, column):
+        key = (stream_name, column)
+        if key not in self._column_values:
+            position = self.columns(stream_name).index(column) if column in self.columns(stream_name) else 1
+            schema = self.streams.get(stream_name, {}).get("schema", {}).get("properties", {}).get(column, {})
+            self._column_values[key] = [
+                (object_id, str(self.value(stream_name, column, schema, object_id, position)))
+                for object_id in range(1, self.row_count(stream_name) + 1)]
+        return self._column_values[key]
+
+    def index(self, stream_name, column=None, value_filter=None):
+        """
+            Sorted IDs of the stream matching a "from/to" filter on a column.
+        """
+        key = (stream_name, column, value_filter)
+        with self._lock:
+            if key not in self._index:
+                ids = range(1, self.row_count(stream_name) + 1)
+                if column and value_filter is not None:
+                    low, _, high = value_filter.partition("/")
+                    ids = [object_id for object_id, value in self.column_values(stream_name, column)
+                           if (not low or value >= low) and (not high or value <= high)]
+                self._index[key] = list(ids)
+            return self._index[key]
+
+
+class Simulator(object):
+    def __init__(self, dataset, latency_ms=0, jitter_ms=0, quota=200, window_ms=60000, error_rate=0.0, seed=0,
+                 row_latency_ms=0):
+        self.dataset = dataset
+        self.latency_ms = latency_ms
+        self.row_latency_ms = row_latency_ms
+        self.jitter_ms = jitter_ms
+        self.quota = quota
+        self.window_ms = window_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        self.window_start = time.monotonic()
+        self.window_used = 0
+        self.stats = {"requests": 0, "throttled": 0, "injected_errors": 0, "bytes": 0}
+        self._lock = threading.Lock()
+
+        self.routes = {}
+        for stream_name, resource in Stream.resource.items():
+            self.routes.setdefault(normalize(resource["url_path"]), []).append(stream_name)
+
+    def take_budget(self):
+        """
+            (status, remaining, next_throttle_period_ms, delay_seconds) of one request in the current window.
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            elapsed_ms = (now - self.window_start) * 1000
+            if elapsed_ms >= self.window_ms:
+                self.window_start = now
+                self.window_used = 0
+                elapsed_ms = 0
+            next_period = int(self.window_ms - elapsed_ms)
+
+            if self.window_used >= self.quota:
+                self.stats["throttled"] += 1
+                return 429, 0, next_period, 0
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.stats["injected_errors"] += 1
+                return 429, self.quota - self.window_used, next_period, 0
+
+            self.window_used += 1
+            delay = self.latency_ms + (self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+            return 200, self.quota - self.window_used, next_period, max(0.0, delay) / 1000
+
+    def route(self, method, path, query):
+        if method == "OPTIONS":
+            stream_name = {"order-service/order": "order_idset",
+                           "product-service/product": "product_idset"}.get(path)
+            if stream_name is None:
+                return 404, {"errors": [{"code": "CMNC-404", "message": "No idset"}]}
+            count = self.dataset.row_count(stream_name)
+            uris = ["/{}/{}-{}".format(path.rsplit("/", 1)[-1], first, min(first + IDSET_SIZE - 1, count))
+                    for first in range(1, count + 1, IDSET_SIZE)]
+            return 200, {"response": {"getUris": uris}}
+
+        if path in self.routes:
+            stream_name = self.routes[path][0]
+            if path.endswith("-search"):
+                return 200, {"response": self.search(stream_name, query)}
+            return 200, {"response": [self.dataset.row(stream_name, object_id)
+                                      for object_id in range(1, self.dataset.row_count(stream_name) + 1)]}
+
+        # dependent GET: <url_path>/<idset>[<url_extension>]
+        for route, stream_names in self.routes.items():
+            if not path.startswith(route + "/"):
+                continue
+            rest = path[len(route) + 1:]
+            values, _, extension = rest.partition("/")
+            if not re.match(r"^[0-9,\-]+$", values):
+                continue
+            for stream_name in stream_names:
+                resource = Stream.resource[stream_name]
+                if "depending_on" in resource and \
+                        normalize(resource.get("url_extension", "")) == normalize(extension):
+                    return 200, {"response": self.dependent(stream_name, values)}
+        return 404, {"errors": [{"code": "CMNC-404", "message": "Unknown path {}".format(path)}]}
+
+    def search(self, stream_name, query):
+        columns = self.dataset.columns(stream_name)
+        value_filter = None
+        filter_column = None
+        for column in columns:
+            if column in query:
+                filter_column, value_filter = column, query[column]
+        ids = self.dataset.index(stream_name, filter_column, value_filter)
+
+        first_result = int(query.get("firstResult", 1))
+        page_size = min(int(query.get("pageSize", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if query.get("lastResult"):
+            page_size = min(page_size, int(query["lastResult"]) - first_result + 1)
+        page = ids[first_result - 1:first_result - 1 + page_size]
+
+        selected = [c for c in query["columns"].split(",") if c in columns] if query.get("columns") else columns
+        results = []
+        for object_id in page:
+            row = self.dataset.row(stream_name, object_id)
+            results.append([row[column] for column in selected])
+
+        last_result = first_result + len(page) - 1
+        return {
+            "metaData": {
+                "resultsAvailable": len(ids),
+                "resultsReturned": len(page),
+                "firstResult": first_result,
+                "lastResult": last_result,
+                "morePagesAvailable": last_result < len(ids),
+                "columns": [{"name": column, "reportDataType": self.report_type(stream_name, column)}
+                            for column in selected],
+            },
+            "results": results,
+        }
+
+    def report_type(self, stream_name, column):
+        schema = self.dataset.streams.get(stream_name, {}).get("schema", {}).get("properties", {}).get(column, {})
+        types = [t for t in schema.get("type", ["string"]) if t != "null"] or ["string"]
+        return {"integer": "INTEGER", "number": "DECIMAL", "boolean": "BOOLEAN"}.get(types[0], "STRING")
+
+    def dependent(self, stream_name, values):
+        count = self.dataset.row_count(stream_name)
+        ids = [object_id for first, last in parse_ranges(values)
+               for object_id in range(first, last + 1) if object_id <= count]
+        predefined = Stream.resource[stream_name].get("schema")
+        if predefined:
+            # key value style: {"<id>": {...}}
+            return {str(object_id): {"id": object_id, "updatedOn": self.dataset.updated_on(stream_name, object_id)}
+                    for object_id in ids}
+        return [self.dataset.row(stream_name, object_id) for object_id in ids]
+
+
+def make_handler(simulator):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            pass
+
+        def send_json(self, status, body, headers=None):
+            payload = json.dumps(body).encode("utf-8")
+            with simulator._lock:
+                simulator.stats["bytes"] += len(payload)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def handle_any(self, method):
+            # the tap may send a body, even with a GET
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+
+            url = urlsplit(self.path)
+            if url.path == "/__stats":
+                self.send_json(200, simulator.stats)
+                return
+
+            # /public-api/<account_id>/<resource>
+            parts = normalize(url.path).split("/", 2)
+            path = parts[2] if len(parts) > 2 else ""
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+            budget = simulator.take_budget()
+            headers = {"brightpearl-requests-remaining": str(budget[1]),
+                       "brightpearl-next-throttle-period": str(budget[2])}
+            if budget[0] == 429:
+                self.send_json(429, {"errors": [{"code": "CMNC-429", "message": "Too many requests"}]}, headers)
+                return
+
+            status, body = simulator.route(method, normalize(path), query)
+            rows = len(body["response"].get("results", [])) if isinstance(body.get("response"), dict) else 0
+            time.sleep(budget[3] + rows * simulator.row_latency_ms / 1000)
+            self.send_json(status, body, headers)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            self.handle_any("GET")
+
+        def do_OPTIONS(self):  # pylint: disable=invalid-name
+            self.handle_any("OPTIONS")
+
+    return Handler
+
+
+def start(port=0, **kwargs):
+    """
+        Start the simulator in a background thread, returns (server, simulator).
+        server.server_address[1] is the port when 0 was given.
+    """
+    dataset_args = {key: kwargs.pop(key) for key in ("search_rows", "orders", "products", "lookup_rows")
+                    if key in kwargs}
+    simulator = Simulator(Dataset(seed=kwargs.get("seed", 0), **dataset_args), **kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(simulator))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, simulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--row-latency-ms", type=float, default=0, help="added latency per search row returned")
+    parser.add_argument("--quota", type=int, default=200, help="requests per throttle window")
+    parser.add_argument("--window-ms", type=int, default=60000, help="throttle window length")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument("--search-rows", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=2000)
+    args = parser.parse_args()
+
+    server, _ = start(port=args.port, seed=args.seed, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                      row_latency_ms=args.row_latency_ms,
+                      quota=args.quota, window_ms=args.window_ms, error_rate=args.error_rate,
+                      search_rows=args.search_rows, orders=args.orders, products=args.products)
+    print("Brightpearl simulator on http://127.0.0.1:{}".format(server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,12 @@ setup(
         "requests==2.24.0",
     ],
     extras_require={
+        'fast': [
+            'orjson',
+        ],
+        'async': [
+            'aiohttp',
+        ],
         'dev': [
             'pylint',
             'ipdb',
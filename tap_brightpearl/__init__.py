@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
 import singer
 import json
+from time import monotonic, perf_counter
 from singer import utils
-from singer import metadata
 from singer import Transformer
 from tap_brightpearl.context import Context
 from tap_brightpearl.stream import Stream
+from tap_brightpearl.async_client import AsyncBrightpearl
 from tap_brightpearl.brightpearl import Brightpearl
+from tap_brightpearl.discovery_cache import DiscoveryCache, load_shipped_schemas
+from tap_brightpearl.fingerprint_store import FingerprintStore
+from tap_brightpearl.idset_index import IdSetIndex
+from tap_brightpearl.instrumentation import Instrumentation, TRANSFORM, WRITE
+from tap_brightpearl.output import SingerWriter
+from tap_brightpearl.parent_ids import SharedParentIds
+from tap_brightpearl.rate_limiter import RateLimiter
+from tap_brightpearl.response_cache import ResponseCache
+from tap_brightpearl.record_pipeline import RecordPipeline
+from tap_brightpearl.scheduler import StreamScheduler, STARTED, RECORD, CHECKPOINT, DONE
+from tap_brightpearl.transform_pool import TransformPool
 
 REQUIRED_CONFIG_KEYS = ["brightpearl-app-ref", "brightpearl-account-token","domain", "account_id"]
 LOGGER = singer.get_logger()
@@ -16,18 +28,73 @@ def initialize_client():
     app_ref = Context.config['brightpearl-app-ref']
     domain = Context.config['domain']
     account_id = Context.config['account_id']
-    Context.session = Brightpearl(domain=domain, account_id=account_id, app_ref=app_ref, account_token=account_token)
+    rate_limiter = RateLimiter(min_requests_remaining=Context.get_int_config("min_requests_remaining", 30),
+                               max_retries=Context.get_int_config("rate_limit_max_retries", 5))
+    # one connection per thread that can be waiting on the API
+    pool_size = Context.get_max_concurrency() * max(1, Context.get_int_config("max_stream_concurrency", 1))
+    Context.session = Brightpearl(domain=domain, account_id=account_id, app_ref=app_ref, account_token=account_token,
+                                  protocol=Context.config.get("protocol", "https"),
+                                  rate_limit_management=rate_limiter,
+                                  pool_size=Context.get_int_config("http_pool_size", max(10, pool_size)),
+                                  connect_timeout=Context.get_int_config("connect_timeout", 10),
+                                  read_timeout=Context.get_int_config("read_timeout", 300),
+                                  max_connection_retries=Context.get_int_config("max_connection_retries", 3))
+
+
+def get_fingerprint_streams():
+    """
+    Streams with change detection: fingerprint_streams (list or comma separated string), by
+    default the small reference streams flagged in Stream.resource.
+    """
+    streams = Context.config.get("fingerprint_streams")
+    if isinstance(streams, str):
+        streams = [stream_id.strip() for stream_id in streams.split(",")]
+    if streams is None:
+        streams = [stream_id for stream_id, resource in Stream.resource.items() if resource.get("fingerprint")]
+    return set(streams)
+
+
+def get_discovery_cache():
+    cache_dir = Context.config.get("discovery_cache_dir")
+    if not cache_dir:
+        return None
+    return DiscoveryCache(cache_dir, Context.config['domain'], Context.config['account_id'],
+                          ttl=Context.get_int_config("discovery_cache_ttl", 86400))
 
 
 def discover():
-    initialize_client()
+    cache = get_discovery_cache()
+    offline = Context.config.get("discovery_offline", False)
+
+    if cache and Context.config.get("discovery_cache_refresh", False):
+        cache.invalidate()
+
+    shipped_schemas = {}
+    if offline:
+        shipped_schemas = load_shipped_schemas()
+    else:
+        initialize_client()
 
     streams = []
-    for schema_name in Stream("").resource:
-        schema_fields = Stream(schema_name).get_schema()
+    for schema_name, resource in Stream.resource.items():
+        schema_fields = cache.get(schema_name, resource) if cache else None
+
+        if schema_fields is None and offline:
+            # any cached columns, whatever their age, then the catalog shipped with the tap
+            schema_fields = cache.get(schema_name, resource, max_age=-1) if cache else None
+            if schema_fields is None:
+                schema_fields = shipped_schemas.get(schema_name)
+            if schema_fields is None:
+                LOGGER.warning('No cached or shipped schema for stream %s, skipping it', schema_name)
+                continue
 
-        for key in schema_fields:
-            break
+        elif schema_fields is None:
+            schema_fields = Stream(schema_name).get_schema()
+            if cache:
+                cache.put(schema_name, resource, schema_fields)
+
+        # first field, none when the stream had no data (CMNC-404)
+        key = next(iter(schema_fields), None)
 
         # create and add catalog entry
         catalog_entry = {
@@ -35,7 +102,7 @@ def discover():
             'tap_stream_id': schema_name,
             'schema': {"properties": schema_fields, "type": "object"},
             'metadata':[{"breadcrumb": [],"metadata": {"selected": False}}],
-            'key_properties': [key],
+            'key_properties': [key] if key else [],
             'replication_key': key,
             'replication_method': "FULL_TABLE"
         }
@@ -45,54 +112,210 @@ def discover():
 
 def sync():
     initialize_client()
+    if Context.config.get("dependent_http_engine", "threads") == "asyncio":
+        Context.async_session = AsyncBrightpearl(Context.session, max_in_flight=Context.session.pool_size)
+
+    writer = SingerWriter(buffer_records=Context.get_int_config("output_buffer_records", 1000),
+                          batch_dir=Context.config.get("batch_dir"),
+                          batch_max_records=Context.get_int_config("batch_max_records", 100000))
+
+    # lookup streams only emit the rows new or changed since the previous run
+    fingerprints = FingerprintStore(Context.config["fingerprint_db"]) if Context.config.get("fingerprint_db") else None
+    emit_deletes = bool(fingerprints) and bool(Context.config.get("fingerprint_deletes"))
+    fingerprinted = set()
+    fingerprint_streams = get_fingerprint_streams()
+    # idset streams only emit the ranges of IDs added or deleted since the previous run
+    if Context.config.get("idset_snapshot_dir"):
+        Context.idset_index = IdSetIndex(Context.config["idset_snapshot_dir"])
+    idset_schemas = {}
 
     # Emit all schemas first so we have them for child streams
     for stream in Context.catalog["streams"]:
         if Context.is_selected(stream["tap_stream_id"]):
+            schema = stream["schema"]
+            if Context.idset_index and Stream.resource.get(stream["tap_stream_id"], {}).get("method") == "options":
+                schema = dict(schema, properties=dict(schema.get("properties", {}),
+                                                      change={"type": ["null", "string"]}))
+                idset_schemas[stream["tap_stream_id"]] = schema
+            elif fingerprints and stream["tap_stream_id"] in fingerprint_streams:
+                fingerprinted.add(stream["tap_stream_id"])
+                if emit_deletes:
+                    schema = dict(schema, properties=dict(schema.get("properties", {}),
+                                                          _sdc_deleted_at={"type": ["null", "string"],
+                                                                           "format": "date-time"}))
 
-            singer.write_schema(stream["tap_stream_id"],
-                                stream["schema"],
+            writer.write_schema(stream["tap_stream_id"],
+                                schema,
                                 stream["key_properties"],
                                 bookmark_properties=stream["replication_key"])
             Context.counts[stream["tap_stream_id"]] = 0
 
 
-    # # Loop over streams in catalog
+    selected_stream_ids = []
     for catalog_entry in Context.catalog['streams']:
         stream_id = catalog_entry['tap_stream_id']
         Context.stream_objects[stream_id] = Stream(stream_id)
-        stream = Context.stream_objects[stream_id]
 
         if not Context.is_selected(stream_id):
             LOGGER.info('Skipping stream: %s', stream_id)
             continue
+        selected_stream_ids.append(stream_id)
 
-        LOGGER.info('Syncing stream: %s', stream_id)
+    if not Context.state.get('bookmarks'):
+        Context.state['bookmarks'] = {}
 
-        if not Context.state.get('bookmarks'):
-            Context.state['bookmarks'] = {}
-        Context.state['bookmarks']['currently_sync_stream'] = stream_id
+    # dependent streams on the same parent read it once
+    Context.parent_ids = SharedParentIds(Stream.parent_groups(selected_stream_ids),
+                                         max_rows=Context.get_int_config("shared_parent_max_rows", 100000))
+    if Context.config.get("dependent_cache_path"):
+        Context.response_cache = ResponseCache(Context.config["dependent_cache_path"],
+                                               max_entries=Context.get_int_config("dependent_cache_max_entries", 1000000),
+                                               max_age_days=Context.get_int_config("dependent_cache_max_age_days", 30))
 
-        with Transformer() as transformer:
-            for rec in stream.sync():
-                extraction_time = singer.utils.now()
+    # an interrupted stream resumes first
+    priority = Context.config.get("stream_priority") or []
+    if isinstance(priority, str):
+        priority = [stream_id.strip() for stream_id in priority.split(",")]
+    if Context.state['bookmarks'].get('currently_sync_stream'):
+        priority = [Context.state['bookmarks']['currently_sync_stream']] + priority
 
-                record_schema = catalog_entry['schema']
-                record_metadata = metadata.to_map(catalog_entry['metadata'])
-                rec = transformer.transform(rec, record_schema, record_metadata)
-                singer.write_record(stream_id,
-                                    rec,
-                                    time_extracted=extraction_time)
-                Context.counts[stream_id] += 1
+    scheduler = StreamScheduler(selected_stream_ids,
+                                max_streams=Context.get_int_config("max_stream_concurrency", 1),
+                                priority=priority)
 
-        Context.state['bookmarks'].pop('currently_sync_stream')
-        singer.write_state(Context.state)
+    checkpoint_records = Context.get_int_config("checkpoint_interval_records", 10000)
+    checkpoint_seconds = Context.get_int_config("checkpoint_interval_seconds", 60)
+    records_since_state = 0
+    state_written_at = monotonic()
+
+    catalog_entries = {}
+    for stream_id in selected_stream_ids:
+        catalog_entry = Context.get_catalog_entry(stream_id)
+        if stream_id in idset_schemas:
+            catalog_entry = dict(catalog_entry, schema=idset_schemas[stream_id])
+        catalog_entries[stream_id] = catalog_entry
+
+    pipelines = {}
+    stage_seconds = {}
+    key_properties = {}
+    # fingerprinted streams need the transformed records here
+    pooled = [stream_id for stream_id in selected_stream_ids if stream_id not in fingerprinted]
+    transform_processes = Context.get_int_config("transform_processes", 0)
+    transform_pool = None
+    with Transformer() as transformer:
+        try:
+            if transform_processes > 0 and pooled:
+                transform_pool = TransformPool(writer, {stream_id: catalog_entries[stream_id] for stream_id in pooled},
+                                               transform_processes,
+                                               batch_records=Context.get_int_config("transform_batch_records", 500),
+                                               batch_timeout=Context.get_int_config("transform_batch_timeout", 600),
+                                               stage_seconds=stage_seconds)
+
+            for stream_id, event, rec in scheduler.run():
+                if event == RECORD and transform_pool is not None and stream_id not in fingerprinted:
+                    transform_pool.add(stream_id, rec, pipelines[stream_id].extraction_time())
+                    Context.counts[stream_id] += 1
+                    records_since_state += 1
+
+                elif event == RECORD:
+                    pipeline = pipelines[stream_id]
+                    started = perf_counter()
+                    rec = pipeline.transform(rec)
+                    transformed = perf_counter()
+                    if stream_id in fingerprinted and not fingerprints.is_changed(
+                            stream_id, [rec.get(key) for key in key_properties[stream_id]], rec):
+                        stage_seconds[stream_id][TRANSFORM] += transformed - started
+                        continue
+                    writer.write_record(stream_id,
+                                        rec,
+                                        time_extracted=pipeline.extraction_time())
+                    stage_seconds[stream_id][TRANSFORM] += transformed - started
+                    stage_seconds[stream_id][WRITE] += perf_counter() - transformed
+                    Context.counts[stream_id] += 1
+                    records_since_state += 1
+
+                elif event == CHECKPOINT:
+                    scheduler.checkpoint(stream_id, rec)
+                    if records_since_state >= checkpoint_records or \
+                            monotonic() - state_written_at >= checkpoint_seconds:
+                        if transform_pool is not None:
+                            transform_pool.flush()
+                        writer.write_state(scheduler.safe_state())
+                        records_since_state = 0
+                        state_written_at = monotonic()
+
+                elif event == STARTED:
+                    LOGGER.info('Syncing stream: %s', stream_id)
+                    pipelines[stream_id] = RecordPipeline(catalog_entries[stream_id], transformer)
+                    stage_seconds[stream_id] = {TRANSFORM: 0.0, WRITE: 0.0}
+                    if stream_id in fingerprinted:
+                        key_properties[stream_id] = Context.get_catalog_entry(stream_id)["key_properties"]
+                        fingerprints.begin(stream_id)
+
+                elif event == DONE:
+                    LOGGER.info('Finished stream: %s', stream_id)
+                    if transform_pool is not None:
+                        transform_pool.flush()
+                    if emit_deletes and stream_id in fingerprinted:
+                        write_deletes(writer, fingerprints, stream_id, key_properties[stream_id])
+                    writer.write_state(scheduler.safe_state())
+                    if stream_id in fingerprinted:
+                        fingerprints.commit(stream_id)
+                    if stream_id in idset_schemas:
+                        Context.idset_index.commit(stream_id)
+                    records_since_state = 0
+                    state_written_at = monotonic()
+        finally:
+            if transform_pool is not None:
+                transform_pool.close()
+            writer.close()
+            if fingerprints:
+                fingerprints.close()
+            if Context.response_cache:
+                Context.response_cache.close()
+                Context.response_cache = None
+            Context.idset_index = None
+            if Context.async_session:
+                Context.async_session.close()
+                Context.async_session = None
+            write_instrumentation(stage_seconds)
 
     LOGGER.info('----------------------')
     for stream_id, stream_count in Context.counts.items():
         LOGGER.info('%s: %d', stream_id, stream_count)
     LOGGER.info('----------------------')
 
+
+def write_deletes(writer, fingerprints, stream_id, key_properties):
+    """
+    A record with only the key properties and _sdc_deleted_at for each row of the previous run
+    missing from this one.
+    """
+    deleted_at = utils.strftime(utils.now())
+    for key in fingerprints.deleted_keys(stream_id):
+        record = dict(zip(key_properties, json.loads(key)))
+        record["_sdc_deleted_at"] = deleted_at
+        writer.write_record(stream_id, record)
+        Context.counts[stream_id] += 1
+
+
+def write_instrumentation(stage_seconds):
+    """
+    Log the measures of the sync as Singer metrics, and write them to metrics_json_path and/or
+    metrics_prometheus_path when configured. Also called when the sync fails.
+    """
+    instrumentation = Context.session.instrumentation
+    for stream_id, stages in stage_seconds.items():
+        for stage, seconds in stages.items():
+            instrumentation.add_time(stage, stream_id, seconds)
+
+    summary = instrumentation.summary(Context.session.rate_limit_management, Context.session.connection_retries)
+    Instrumentation.log_summary(summary)
+    if Context.config.get("metrics_json_path"):
+        Instrumentation.write_json(summary, Context.config["metrics_json_path"])
+    if Context.config.get("metrics_prometheus_path"):
+        Instrumentation.write_prometheus(summary, Context.config["metrics_prometheus_path"])
+
 @utils.handle_top_exception(LOGGER)
 def main():
 
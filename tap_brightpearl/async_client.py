@@ -0,0 +1,146 @@
+import asyncio
+import json
+import threading
+from time import monotonic
+
+import singer
+
+try:
+    import aiohttp
+except ImportError:  # optional, pip install tap-brightpearl[async]
+    aiohttp = None
+
+LOGGER = singer.get_logger()
+
+# longest sleep before checking the throttle budget again
+MAX_THROTTLE_SLEEP = 1.0
+
+
+class _Response(object):
+    """
+        The bits of a requests.Response that Brightpearl.process_response reads.
+    """
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class AsyncBrightpearl(object):
+    """
+        asyncio engine of a Brightpearl client, for the GET batches of the dependent streams
+        only: search pages, idsets and the streams themselves stay on threads.
+
+        One event loop on its own thread sends up to `max_in_flight` requests at the same time
+        over aiohttp: hundreds of requests in flight cost no thread each. The blocking client's
+        rate limiter, instrumentation, timeouts and retries are shared, and responses are
+        processed by it, so errors are the same whatever the engine.
+
+        submit() is called from any thread and returns a concurrent.futures.Future.
+    """
+
+    def __init__(self, client, max_in_flight=100):
+        """
+        :param client: (Brightpearl) - blocking client the settings are taken from
+        :param max_in_flight: (int) - requests sent at the same time, across all the streams
+        """
+        if aiohttp is None:
+            raise ImportError("dependent_http_engine asyncio needs aiohttp: pip install tap-brightpearl[async]")
+        self.client = client
+        self.max_in_flight = max_in_flight
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="brightpearl-asyncio", daemon=True)
+        self._thread.start()
+        self._session, self._semaphore = asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    async def _open(self):
+        connect_timeout, read_timeout = self.client.timeout
+        session = aiohttp.ClientSession(
+            headers=dict(self.client._session.headers),
+            connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+            timeout=aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout))
+        return session, asyncio.Semaphore(self.max_in_flight)
+
+    def submit(self, url_path, firstResult=1, lastResult=None, search_params={}):
+        """
+            Same as Brightpearl.get_data, in the background.
+        :return: (concurrent.futures.Future) - of the "response" of the API
+        """
+        url = self.client.get_url(url_path, firstResult, lastResult, search_params)
+        return asyncio.run_coroutine_threadsafe(self.get_data(url), self.loop)
+
+    async def get_data(self, url):
+        async with self._semaphore:
+            data = await self.make_request(url, "GET")
+        return data["response"]
+
+    async def acquire(self):
+        rate_limiter = self.client.rate_limit_management
+        waited = 0.0
+        while True:
+            wait = rate_limiter.try_acquire(waited)
+            if wait <= 0:
+                return
+            # the budget may be refreshed by another response before then
+            wait = min(wait, MAX_THROTTLE_SLEEP)
+            await asyncio.sleep(wait)
+            waited += wait
+
+    async def make_request(self, url, method):
+        """
+            Send one request, retried the same way as Brightpearl.make_request.
+        """
+        client = self.client
+        rate_limiter = client.rate_limit_management
+        instrumentation = client.instrumentation
+
+        attempt = 0
+        connection_attempt = 0
+        while True:
+            await self.acquire()
+            headers = None
+            started = monotonic()
+            try:
+                async with self._session.request(method, client.get_full_path(url)) as response:
+                    body = await response.read()
+                    status, headers = response.status, response.headers
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as exc:
+                instrumentation.observe_request(url, monotonic() - started)
+                if connection_attempt >= client.max_connection_retries:
+                    raise
+                wait = min(2 ** connection_attempt, rate_limiter.max_backoff)
+                LOGGER.info("%s on %s, retry %d in %ds", type(exc).__name__, url, connection_attempt + 1, wait)
+                connection_attempt += 1
+                client.connection_retries += 1
+                await asyncio.sleep(wait)
+                continue
+            finally:
+                rate_limiter.release(headers)
+            elapsed = monotonic() - started
+            instrumentation.observe_remaining(headers)
+
+            if status == 429 and attempt < rate_limiter.max_retries:
+                instrumentation.observe_request(url, elapsed, status, len(body))
+                rate_limiter.backoff(headers, attempt)
+                attempt += 1
+                continue
+
+            parse_started = monotonic()
+            try:
+                return client.process_response(_Response(status, body))
+            finally:
+                instrumentation.observe_request(url, elapsed, status, len(body), monotonic() - parse_started)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
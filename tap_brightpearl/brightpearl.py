@@ -1,7 +1,16 @@
-from tap_brightpearl.context import Context
+from tap_brightpearl.instrumentation import Instrumentation
+from tap_brightpearl.json_stream import parse_search_response
+from tap_brightpearl.rate_limiter import RateLimiter
+from requests.adapters import HTTPAdapter
+from time import monotonic
 from urllib.parse import urlencode
-import requests, json
-from time import sleep
+import requests, json, time
+import singer
+
+LOGGER = singer.get_logger()
+
+# safe to send again after a connection reset or a read timeout
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
 
 
 class TokenExpiredException(Exception):
@@ -12,18 +21,41 @@ class RateLimitException(Exception):
     pass
 
 
+class ServerErrorException(Exception):
+    pass
+
+
 class Brightpearl(object):
     def __init__(
             self, domain, account_id, app_ref, account_token, protocol="https",
-                  rate_limit_management=None
+                  rate_limit_management=None, pool_size=10, connect_timeout=10, read_timeout=300,
+                  max_connection_retries=3, instrumentation=None
     ):
+        """
+        :param pool_size: (int) - kept-alive connections to the API, at least the number of threads using the client
+        :param connect_timeout: (float) - seconds to open a connection
+        :param read_timeout: (float) - seconds without any byte from the API before giving up on a request
+        :param max_connection_retries: (int) - retries of a GET/OPTIONS after a connection reset or a timeout
+        """
         self.resource_base_path = protocol + "://{domain}/public-api/{account_id}/{resource}"
         self.domain = domain
         self.account_id = account_id
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_connection_retries = max_connection_retries
+        self.pool_size = pool_size
+        self.connection_retries = 0
+
         self._session = requests.Session()
-        self.rate_limit_management = rate_limit_management
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        # shared by every thread using this client
+        self.rate_limit_management = rate_limit_management or RateLimiter()
+        self.instrumentation = instrumentation or Instrumentation()
         self._session.headers = {
             "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
             "brightpearl-account-token": account_token,
             "brightpearl-app-ref": app_ref
         }
@@ -39,29 +71,66 @@ class Brightpearl(object):
         )
 
     def make_request(self, url, method, data=None, stream=False, headers=None):
-        if not data:
-            data = dict()
-
-        if headers:
-            for header_name, header_value in headers.items():
-                self._session.headers.update({header_name: header_value})
-
-        response = self._session.request(
-            method=method, url=self.get_full_path(url), data=json.dumps(data), stream=stream
-        )
-        return self.process_response(response, stream)
-
-    def rate_limiting(self, headers):
         """
-            Method to manage rate limiting
-        :param headers: (dict) - Response headers.
+            Send one request, retried after a 429 (rate limiter) and, for GET/OPTIONS, after a
+            connection reset or a timeout.
+        :param data: (dict) - JSON body, not sent when empty
+        :param headers: (dict) - headers of this request only, the session ones are left untouched
         :return:
         """
-        if 'brightpearl-requests-remaining' in headers:
-            # check if the min_requests_remaining are lesser than requests_remaining
-            if int(headers['brightpearl-requests-remaining']) < 30:
-                sleep(int(headers['brightpearl-next-throttle-period']) / 1000)
-
+        body = json.dumps(data) if data else None
+
+        attempt = 0
+        connection_attempt = 0
+        while True:
+            self.rate_limit_management.acquire()
+            response = None
+            started = monotonic()
+            try:
+                response = self._session.request(
+                    method=method, url=self.get_full_path(url), data=body, headers=headers,
+                    stream=stream, timeout=self.timeout
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as exc:
+                self.instrumentation.observe_request(url, monotonic() - started)
+                if method.upper() not in IDEMPOTENT_METHODS or connection_attempt >= self.max_connection_retries:
+                    raise
+                wait = min(2 ** connection_attempt, self.rate_limit_management.max_backoff)
+                LOGGER.info("%s on %s, retry %d in %ds", type(exc).__name__, url, connection_attempt + 1, wait)
+                connection_attempt += 1
+                self.connection_retries += 1
+                time.sleep(wait)
+                continue
+            finally:
+                self.rate_limit_management.release(response.headers if response is not None else None)
+            elapsed = monotonic() - started
+            self.instrumentation.observe_remaining(response.headers)
+
+            if response.status_code == 429 and attempt < self.rate_limit_management.max_retries:
+                response.close()
+                self.instrumentation.observe_request(url, elapsed, response.status_code, self.received_bytes(response))
+                self.rate_limit_management.backoff(response.headers, attempt)
+                attempt += 1
+                continue
+
+            parse_started = monotonic()
+            try:
+                return self.process_response(response, stream)
+            finally:
+                self.instrumentation.observe_request(url, elapsed, response.status_code,
+                                                     0 if stream else self.received_bytes(response),
+                                                     0.0 if stream else monotonic() - parse_started)
+
+    @staticmethod
+    def received_bytes(response):
+        """
+            Bytes of the body read from the socket (compressed), its decoded length when unknown.
+        """
+        try:
+            return response.raw.tell()
+        except AttributeError:
+            return len(response.content)
 
     def process_response(self, response, stream=False):
         """
@@ -72,7 +141,6 @@ class Brightpearl(object):
         """
         result = dict()
         if response.status_code in [200, 201, 202, 207]:
-            self.rate_limiting(response.headers)
             if not stream:
                 result = response.json()
             else:
@@ -83,24 +151,43 @@ class Brightpearl(object):
             raise RateLimitException("Rate limit {}:{}".format(response.status_code, response))
         else:
             # dealing with common {"errors":[{"code":"CMNC-404","message":"No goods in notes found within range of order IDs and goods in note IDs"}]}
+            if response.status_code >= 500:
+                raise ServerErrorException("Error while fetching {}: {}".format(response.status_code, response.text))
             if "CMNC-404" in response.text:
                 return {"response":[]}
             else:
                 raise ValueError("Error while fetching {}: {}".format(response.status_code, response.text))
         return result
 
-    def get_data(self, url_path, firstResult=1, lastResult=None, method="GET", search_params={}):
-
+    @staticmethod
+    def get_url(url_path, firstResult=1, lastResult=None, search_params={}, page_size=None):
         search_params_result = {'firstResult': firstResult}
         if lastResult:
             search_params_result["lastResult"]=lastResult
+        if page_size:
+            search_params_result["pageSize"] = page_size
 
         search_par = {**search_params, **search_params_result}
 
         url_search_encoded = urlencode(search_par)
-        url = f"/{url_path}?{url_search_encoded}"
+        return f"/{url_path}?{url_search_encoded}"
+
+    def get_data(self, url_path, firstResult=1, lastResult=None, method="GET", search_params={}, stream=False,
+                 page_size=None):
+        """
+            Method to fetch one page of an endpoint.
+        :param stream: (boolean) - parse the rows of a search page as they arrive, "results" is then a generator
+        :param page_size: (int) - rows per search page, the server default when None
+        :return:
+        """
+
+        url = self.get_url(url_path, firstResult, lastResult, search_params, page_size)
 
-        data = Context.session.make_request(url, method, {}, stream=False)
+        data = self.make_request(url, method, stream=stream)
+        if isinstance(data, requests.Response):
+            response = data
+            return parse_search_response(response, on_close=lambda: self.instrumentation.add_bytes(
+                url, self.received_bytes(response)))
         return data["response"]
 
 
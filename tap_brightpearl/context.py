@@ -1,3 +1,4 @@
+import threading
 import singer
 from singer import metadata
 from datetime import datetime, timedelta
@@ -13,6 +14,16 @@ class Context():
     stream_objects = {}
     counts = {}
     session = None
+    # AsyncBrightpearl of the sync when dependent_http_engine is asyncio
+    async_session = None
+    # SharedParentIds of the sync, None outside of it
+    parent_ids = None
+    # ResponseCache of the sync, None when not configured
+    response_cache = None
+    # IdSetIndex of the sync, None when not configured
+    idset_index = None
+    # streams may run in parallel, guard the bookmarks
+    state_lock = threading.RLock()
 
     @classmethod
     def get_catalog_entry(cls, stream_name):
@@ -26,6 +37,28 @@ class Context():
         stream_metadata = metadata.to_map(stream['metadata'])
         return metadata.get(stream_metadata, (), 'selected')
 
+    @classmethod
+    def get_selected_fields(cls, stream_name):
+        """
+        Fields of the stream selected in the catalog, with the same rules as singer's Transformer.
+        None when all of them are.
+        """
+        stream = cls.get_catalog_entry(stream_name)
+        stream_metadata = metadata.to_map(stream['metadata'])
+        properties = list(stream['schema'].get('properties', {}))
+
+        selected_fields = []
+        for field in properties:
+            breadcrumb = ('properties', field)
+            inclusion = metadata.get(stream_metadata, breadcrumb, 'inclusion')
+            selected = metadata.get(stream_metadata, breadcrumb, 'selected')
+            if inclusion == 'automatic' or (selected is not False and inclusion != 'unsupported'):
+                selected_fields.append(field)
+
+        if len(selected_fields) == len(properties):
+            return None
+        return selected_fields
+
     @classmethod
     def get_results_per_page(cls, default_results_per_page):
         results_per_page = default_results_per_page
@@ -43,6 +76,25 @@ class Context():
                         default_results_per_page)
         return results_per_page
 
+    @classmethod
+    def get_int_config(cls, key, default_value):
+        value = default_value
+        try:
+            value = int(cls.config.get(key))
+        except TypeError:
+            # None value or no key
+            pass
+        except ValueError:
+            # non-int value
+            log_msg = ('Failed to parse %s value of "%s" ' +
+                       'as an integer, falling back to default of %d')
+            LOGGER.info(log_msg, key, cls.config[key], default_value)
+        return value
+
+    @classmethod
+    def get_max_concurrency(cls, default_max_concurrency=1):
+        return max(1, cls.get_int_config("max_concurrency", default_max_concurrency))
+
     @classmethod
     def get_bookmark(cls, stream_name):
         return cls.state.get('bookmarks', {}).get(stream_name, {})
@@ -57,7 +109,13 @@ class Context():
             state_value = (datetime.strptime(state_value,DT_FORMAT)-timedelta(days=back_in_days)).strftime(DT_FORMAT)
         return state_value
 
+    @classmethod
+    def clear_checkpoint(cls, stream_name):
+        with cls.state_lock:
+            cls.state.get('bookmarks', {}).get(stream_name, {}).pop('checkpoint', None)
+
     @classmethod
     def set_state_value(cls, stream_name, field, value):
-        cls.state['bookmarks'].update({stream_name:{field:value}})
+        with cls.state_lock:
+            cls.state.setdefault('bookmarks', {}).update({stream_name:{field:value}})
 
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+SHIPPED_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas", "schema.json")
+
+
+class DiscoveryCache(object):
+    """
+        On-disk cache of the discovered stream columns.
+
+        One JSON file per stream, keyed by the account (domain + account_id) and the stream
+        resource definition, so changing a resource in Stream.resource invalidates its entry.
+    """
+
+    def __init__(self, path, domain, account_id, ttl=86400):
+        self.path = os.path.expanduser(path)
+        self.domain = domain
+        self.account_id = account_id
+        self.ttl = ttl
+
+    def key(self, stream_name, resource):
+        raw = json.dumps({"domain": self.domain, "account_id": str(self.account_id),
+                          "stream": stream_name, "resource": resource}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_file(self, stream_name, resource):
+        return os.path.join(self.path, "{}-{}.json".format(stream_name, self.key(stream_name, resource)))
+
+    def get(self, stream_name, resource, max_age=None):
+        """
+            Cached columns of the stream, None when missing or older than max_age (defaults to the ttl).
+        """
+        max_age = self.ttl if max_age is None else max_age
+        try:
+            with open(self.get_file(stream_name, resource)) as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+        if max_age >= 0 and time.time() - entry["created_at"] > max_age:
+            return None
+        return entry["schema"]
+
+    def put(self, stream_name, resource, schema):
+        os.makedirs(self.path, exist_ok=True)
+        file_name = self.get_file(stream_name, resource)
+        tmp_file_name = file_name + ".tmp"
+        with open(tmp_file_name, "w") as cache_file:
+            json.dump({"created_at": time.time(), "stream": stream_name, "schema": schema}, cache_file)
+        os.replace(tmp_file_name, file_name)
+
+    def invalidate(self, stream_name=None):
+        """
+            Remove the cached entries of one stream, or every entry of the cache directory.
+        """
+        if not os.path.isdir(self.path):
+            return
+        for file_name in os.listdir(self.path):
+            if stream_name is not None and not file_name.startswith(stream_name + "-"):
+                continue
+            os.remove(os.path.join(self.path, file_name))
+
+
+def load_shipped_schemas():
+    """
+        Stream columns from the catalog shipped with the tap (schemas/schema.json).
+    """
+    with open(SHIPPED_CATALOG) as catalog_file:
+        catalog = json.load(catalog_file)
+    return {stream["tap_stream_id"]: stream["schema"]["properties"] for stream in catalog["streams"]}
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import sqlite3
+
+import simplejson
+import singer
+
+LOGGER = singer.get_logger()
+
+
+def fingerprint(record):
+    return hashlib.blake2b(simplejson.dumps(record, sort_keys=True, use_decimal=True, default=str).encode("utf-8"),
+                           digest_size=16).hexdigest()
+
+
+class FingerprintStore(object):
+    """
+        Local SQLite store of a hash per primary key of the lookup streams, to only emit the rows
+        that are new or changed since the previous run.
+
+        Changes of a run are kept in memory and only saved by commit(), once every record of the
+        stream was written: a failed run emits the same rows again on the next one.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fingerprints ("
+                                "stream TEXT NOT NULL, key TEXT NOT NULL, hash TEXT NOT NULL, "
+                                "PRIMARY KEY (stream, key))")
+        self.connection.commit()
+
+        self._known = {}
+        self._seen = {}
+        self._changed = {}
+
+    def begin(self, stream_name):
+        self._known[stream_name] = dict(self.connection.execute(
+            "SELECT key, hash FROM fingerprints WHERE stream = ?", (stream_name,)))
+        self._seen[stream_name] = set()
+        self._changed[stream_name] = {}
+
+    def is_changed(self, stream_name, key, record):
+        """
+            True when the record is new or differs from the previous run.
+        :param key: (list) - values of the key properties, deleted_keys() returns them JSON encoded
+        """
+        key = simplejson.dumps(key, use_decimal=True, default=str)
+        record_hash = fingerprint(record)
+        self._seen[stream_name].add(key)
+        if self._known[stream_name].get(key) == record_hash:
+            return False
+        self._changed[stream_name][key] = record_hash
+        return True
+
+    def deleted_keys(self, stream_name):
+        """
+            Keys of the previous run not seen in this one. Only meaningful once the stream was fully read.
+        """
+        return [key for key in self._known[stream_name] if key not in self._seen[stream_name]]
+
+    def commit(self, stream_name):
+        deleted = self.deleted_keys(stream_name)
+        changed = self._changed.pop(stream_name)
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO fingerprints (stream, key, hash) VALUES (?, ?, ?)",
+                                        ((stream_name, key, record_hash) for key, record_hash in changed.items()))
+            self.connection.executemany("DELETE FROM fingerprints WHERE stream = ? AND key = ?",
+                                        ((stream_name, key) for key in deleted))
+        del self._known[stream_name]
+        del self._seen[stream_name]
+        LOGGER.info("Fingerprints of %s: %d new or changed, %d deleted", stream_name, len(changed), len(deleted))
+
+    def close(self):
+        self.connection.close()
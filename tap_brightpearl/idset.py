@@ -0,0 +1,104 @@
+class IdSet(object):
+    """
+        Set of integer IDs, written the way the Brightpearl idset endpoints do: sorted,
+        without duplicates and with consecutive IDs compressed into ranges ("1,3,5-9").
+    """
+
+    def __init__(self, ids=()):
+        self._ids = set()
+        self.update(ids)
+
+    def add(self, object_id):
+        self._ids.add(int(object_id))
+
+    def update(self, ids):
+        for object_id in ids:
+            self.add(object_id)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, object_id):
+        return int(object_id) in self._ids
+
+    def __iter__(self):
+        return iter(sorted(self._ids))
+
+    def ranges(self):
+        """
+            Sorted (first, last) pairs of consecutive IDs.
+        """
+        ranges = []
+        for object_id in sorted(self._ids):
+            if ranges and ranges[-1][1] == object_id - 1:
+                ranges[-1][1] = object_id
+            else:
+                ranges.append([object_id, object_id])
+        return [(first, last) for first, last in ranges]
+
+    def format(self):
+        return format_ranges(self.ranges())
+
+    @classmethod
+    def parse(cls, value):
+        """
+            IdSet from an idset string ("1,3,5-9") or an idset URI ("/order/1,3,5-9").
+        """
+        id_set = cls()
+        for first, last in parse_ranges(value):
+            id_set.update(range(first, last + 1))
+        return id_set
+
+
+def format_ranges(ranges):
+    return ",".join(str(first) if first == last else "{}-{}".format(first, last) for first, last in ranges)
+
+
+def parse_ranges(value):
+    """
+        (first, last) pairs of an idset string ("1,3,5-9") or an idset URI ("/order/1,3,5-9").
+    """
+    value = value.rstrip("/").rsplit("/", 1)[-1]
+    ranges = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            ranges.append((int(first), int(last)))
+        else:
+            ranges.append((int(part), int(part)))
+    return ranges
+
+
+def pack_ids(ids, max_objects=200, max_length=2000):
+    """
+        Split a stream of IDs into idset strings of at most max_objects IDs and max_length
+        characters. Each string is sorted, deduplicated and range compressed, so dense IDs use
+        far less of the URL than the raw comma separated list.
+
+        :param ids: iterable of IDs, in the order the batches should follow
+        :param max_objects: maximum number of objects per request accepted by the API
+        :param max_length: maximum length of the idset part of the URL
+        :return: generator of idset strings
+    """
+    chunk = IdSet()
+    raw_length = 0
+    for object_id in ids:
+        object_id = int(object_id)
+        if object_id in chunk:
+            continue
+
+        id_length = len(str(object_id)) + 1
+        if len(chunk) >= max_objects or (
+                raw_length + id_length > max_length and len(chunk.format()) + id_length > max_length):
+            yield chunk.format()
+            chunk = IdSet()
+            raw_length = 0
+
+        chunk.add(object_id)
+        raw_length += id_length
+
+    if len(chunk):
+        yield chunk.format()
@@ -0,0 +1,223 @@
+import json
+import os
+import re
+import threading
+from time import monotonic
+
+import singer
+from singer import metrics
+
+LOGGER = singer.get_logger()
+
+# seconds, upper bounds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# stages of a record, timed per stream
+TRANSFORM, WRITE = "transform", "write"
+
+_IDSET_SEGMENT = re.compile(r"^[0-9][0-9,\-]*$")
+
+
+def endpoint_name(url):
+    """
+        Endpoint of a request URL, without the query string and with the idsets replaced:
+        "/order-service/order/1,3-9?firstResult=1" -> "order-service/order/{ids}"
+    """
+    path = url.split("?", 1)[0].strip("/")
+    return "/".join("{ids}" if _IDSET_SEGMENT.match(segment) else segment
+                    for segment in path.split("/") if segment)
+
+
+class _Histogram(object):
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"count": self.count, "sum": round(self.sum, 3), "buckets": buckets}
+
+
+class Instrumentation(object):
+    """
+        Counters of a sync, shared by all the threads of the client.
+
+        Per endpoint: latency histogram, bytes received, HTTP statuses and time spent parsing
+        the JSON of whole pages. Per stream: time spent transforming and writing records. Over
+        time: the requests remaining in the throttle window, sampled at most every
+        `remaining_interval` seconds.
+
+        Every request is logged as a Singer http_request_duration timer, the totals are logged
+        as Singer metrics by log_summary() and can be written as JSON or as a Prometheus textfile.
+    """
+
+    def __init__(self, remaining_interval=1.0, max_remaining_samples=3600):
+        self.remaining_interval = remaining_interval
+        self.max_remaining_samples = max_remaining_samples
+        self.started = monotonic()
+
+        self.endpoints = {}
+        self.stages = {}
+        self.remaining = []
+        self.min_remaining = None
+        self._lock = threading.Lock()
+
+    def observe_request(self, url, seconds, status_code=None, received_bytes=0, parse_seconds=0.0):
+        """
+        :param seconds: (float) - until the response was received, whole body included unless streamed
+        :param received_bytes: (int) - bytes read from the socket, compressed
+        """
+        endpoint = endpoint_name(url)
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {"latency": _Histogram(), "bytes": 0, "parse_seconds": 0.0,
+                                                    "statuses": {}}
+            stats["latency"].observe(seconds)
+            stats["bytes"] += received_bytes
+            stats["parse_seconds"] += parse_seconds
+            status = str(status_code or "error")
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+
+        tags = {"endpoint": endpoint, "http_status_code": status_code,
+                "status": "succeeded" if status_code and status_code < 400 else "failed"}
+        metrics.log(LOGGER, metrics.Point("timer", metrics.Metric.http_request_duration, round(seconds, 3), tags))
+
+    def add_bytes(self, url, received_bytes):
+        endpoint = endpoint_name(url)
+        with self._lock:
+            if endpoint in self.endpoints:
+                self.endpoints[endpoint]["bytes"] += received_bytes
+
+    def add_time(self, stage, stream_name, seconds):
+        with self._lock:
+            stages = self.stages.setdefault(stream_name, {})
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def observe_remaining(self, headers):
+        if not headers or 'brightpearl-requests-remaining' not in headers:
+            return
+        remaining = int(headers['brightpearl-requests-remaining'])
+        elapsed = monotonic() - self.started
+        with self._lock:
+            if self.min_remaining is None or remaining < self.min_remaining:
+                self.min_remaining = remaining
+            if not self.remaining or elapsed - self.remaining[-1][0] >= self.remaining_interval:
+                if len(self.remaining) >= self.max_remaining_samples:
+                    # keep the whole run covered with half the resolution
+                    self.remaining = self.remaining[::2]
+                    self.remaining_interval *= 2
+                self.remaining.append((round(elapsed, 3), remaining))
+
+    def summary(self, rate_limiter=None, connection_retries=0):
+        """
+            Everything measured so far.
+        :param rate_limiter: (RateLimiter) - adds its throttle time and retries
+        :return: (dict)
+        """
+        with self._lock:
+            summary = {
+                "seconds": round(monotonic() - self.started, 3),
+                "endpoints": {endpoint: {"latency": stats["latency"].to_dict(), "bytes": stats["bytes"],
+                                         "parse_seconds": round(stats["parse_seconds"], 3),
+                                         "statuses": dict(stats["statuses"])}
+                              for endpoint, stats in self.endpoints.items()},
+                "streams": {stream_name: {stage: round(seconds, 3) for stage, seconds in stages.items()}
+                            for stream_name, stages in self.stages.items()},
+                "requests_remaining": {"min": self.min_remaining, "samples": list(self.remaining)},
+                "connection_retries": connection_retries,
+            }
+        if rate_limiter is not None:
+            summary["rate_limiter"] = rate_limiter.stats()
+        return summary
+
+    @staticmethod
+    def log_summary(summary):
+        """
+            Totals of the run as Singer metrics.
+        """
+        for endpoint, stats in summary["endpoints"].items():
+            tags = {"endpoint": endpoint}
+            metrics.log(LOGGER, metrics.Point("counter", "http_request_count", stats["latency"]["count"], tags))
+            metrics.log(LOGGER, metrics.Point("counter", "http_bytes_received", stats["bytes"], tags))
+            metrics.log(LOGGER, metrics.Point("timer", "parse_duration", stats["parse_seconds"], tags))
+        for stream_name, stages in summary["streams"].items():
+            for stage, seconds in stages.items():
+                metrics.log(LOGGER, metrics.Point("timer", "{}_duration".format(stage), seconds,
+                                                  {"endpoint": stream_name}))
+        rate_limiter = summary.get("rate_limiter", {})
+        if rate_limiter:
+            metrics.log(LOGGER, metrics.Point("timer", "throttle_duration", rate_limiter["throttled_seconds"], {}))
+            metrics.log(LOGGER, metrics.Point("counter", "rate_limit_retries", rate_limiter["retries"], {}))
+        metrics.log(LOGGER, metrics.Point("counter", "connection_retries", summary["connection_retries"], {}))
+
+    @staticmethod
+    def write_json(summary, path):
+        with open(path, "w") as summary_file:
+            json.dump(summary, summary_file, indent=2)
+
+    @staticmethod
+    def write_prometheus(summary, path):
+        """
+            Prometheus textfile (node_exporter textfile collector format) of the summary.
+        """
+        lines = [
+            "# TYPE tap_brightpearl_request_duration_seconds histogram",
+        ]
+        for endpoint, stats in sorted(summary["endpoints"].items()):
+            latency = stats["latency"]
+            for bound, count in latency["buckets"].items():
+                lines.append('tap_brightpearl_request_duration_seconds_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                    endpoint, bound, count))
+            lines.append('tap_brightpearl_request_duration_seconds_sum{{endpoint="{}"}} {}'.format(
+                endpoint, latency["sum"]))
+            lines.append('tap_brightpearl_request_duration_seconds_count{{endpoint="{}"}} {}'.format(
+                endpoint, latency["count"]))
+
+        lines.append("# TYPE tap_brightpearl_received_bytes_total counter")
+        for endpoint, stats in sorted(summary["endpoints"].items()):
+            lines.append('tap_brightpearl_received_bytes_total{{endpoint="{}"}} {}'.format(endpoint, stats["bytes"]))
+
+        lines.append("# TYPE tap_brightpearl_parse_seconds_total counter")
+        for endpoint, stats in sorted(summary["endpoints"].items()):
+            lines.append('tap_brightpearl_parse_seconds_total{{endpoint="{}"}} {}'.format(
+                endpoint, stats["parse_seconds"]))
+
+        lines.append("# TYPE tap_brightpearl_stage_seconds_total counter")
+        for stream_name, stages in sorted(summary["streams"].items()):
+            for stage, seconds in sorted(stages.items()):
+                lines.append('tap_brightpearl_stage_seconds_total{{stream="{}",stage="{}"}} {}'.format(
+                    stream_name, stage, seconds))
+
+        rate_limiter = summary.get("rate_limiter", {})
+        if rate_limiter:
+            lines.append("# TYPE tap_brightpearl_throttled_seconds_total counter")
+            lines.append("tap_brightpearl_throttled_seconds_total {}".format(rate_limiter["throttled_seconds"]))
+            lines.append("# TYPE tap_brightpearl_rate_limit_retries_total counter")
+            lines.append("tap_brightpearl_rate_limit_retries_total {}".format(rate_limiter["retries"]))
+        lines.append("# TYPE tap_brightpearl_connection_retries_total counter")
+        lines.append("tap_brightpearl_connection_retries_total {}".format(summary["connection_retries"]))
+        if summary["requests_remaining"]["min"] is not None:
+            lines.append("# TYPE tap_brightpearl_requests_remaining_min gauge")
+            lines.append("tap_brightpearl_requests_remaining_min {}".format(summary["requests_remaining"]["min"]))
+
+        # written aside then renamed, the collector never reads a partial file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
@@ -0,0 +1,165 @@
+import codecs
+import json
+from itertools import chain
+
+FIELD = "field"
+ROW = "row"
+
+_WHITESPACE = " \t\n\r"
+
+
+class _TextBuffer(object):
+    """
+        Decoded text of a streamed response, filled chunk by chunk and trimmed as it is consumed.
+    """
+
+    def __init__(self, chunks, encoding="utf-8"):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self.json_decoder = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        if self.pos > 65536:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        for chunk in self.chunks:
+            decoded = self.decoder.decode(chunk)
+            if decoded:
+                self.text += decoded
+                return True
+        self.text += self.decoder.decode(b"", final=True)
+        self.eof = True
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError("Unexpected {!r} at {} while streaming JSON, expected {!r}".format(char, self.pos, chars))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number may go on in the next chunk
+            if end == len(self.text) and not self.eof:
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+
+def _walk_object(buffer, streamed_key):
+    """
+        Events of the object at the buffer position: (FIELD, key, value) for every key,
+        except streamed_key whose array items come as (ROW, None, item) one by one.
+    """
+    buffer.expect("{")
+    if buffer.peek() == "}":
+        buffer.pos += 1
+        return
+
+    while True:
+        key = buffer.value()
+        buffer.expect(":")
+        if key == streamed_key and buffer.peek() == "[":
+            buffer.pos += 1
+            if buffer.peek() == "]":
+                buffer.pos += 1
+            else:
+                while True:
+                    yield ROW, None, buffer.value()
+                    if buffer.expect(",]") == "]":
+                        break
+        else:
+            yield FIELD, key, buffer.value()
+
+        if buffer.expect(",}") == "}":
+            return
+
+
+def _walk_response(buffer):
+    buffer.expect("{")
+    if buffer.peek() == "}":
+        return
+
+    while True:
+        key = buffer.value()
+        buffer.expect(":")
+        if key == "response" and buffer.peek() == "{":
+            yield from _walk_object(buffer, "results")
+        else:
+            # envelope keys (reference...) or a non search response
+            yield FIELD, (key,), buffer.value()
+
+        if buffer.expect(",}") == "}":
+            return
+
+
+def parse_search_response(response, chunk_size=65536, on_close=None):
+    """
+        Incremental equivalent of response.json()["response"] for search endpoints.
+
+        Everything but the "results" rows is parsed as usual. The rows are yielded one at a time
+        as the bytes arrive, so a page is never fully held in memory. Brightpearl sends metaData
+        before results; if it ever comes after, the rows read until then are kept in memory.
+
+        :param response: requests response opened with stream=True
+        :param chunk_size: bytes read from the socket at a time
+        :param on_close: called once the response is read and closed
+        :return: (dict) - "results" is a generator, the other keys are plain values
+    """
+    buffer = _TextBuffer(response.iter_content(chunk_size=chunk_size), response.encoding or "utf-8")
+    events = _walk_response(buffer)
+    page = {}
+    pending = []
+
+    for kind, key, value in events:
+        if kind == ROW:
+            pending.append(value)
+            if "metaData" in page:
+                break
+        elif isinstance(key, tuple):
+            if key == ("response",):
+                # response is not an object, nothing to stream
+                response.close()
+                if on_close:
+                    on_close()
+                return value
+        else:
+            page[key] = value
+
+    def rows():
+        try:
+            for kind, key, value in chain(((ROW, None, row) for row in pending), events):
+                if kind == ROW:
+                    yield value
+                elif not isinstance(key, tuple):
+                    page[key] = value
+        finally:
+            response.close()
+            if on_close:
+                on_close()
+
+    page["results"] = rows()
+    return page
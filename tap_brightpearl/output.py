@@ -0,0 +1,163 @@
+import gzip
+import os
+import sys
+import uuid
+
+import pytz
+import simplejson
+import singer
+from singer import utils
+from singer.messages import SchemaMessage, StateMessage, format_message
+
+try:
+    import orjson
+except ImportError:  # optional, pip install tap-brightpearl[fast]
+    orjson = None
+
+LOGGER = singer.get_logger()
+
+
+def dumps(obj):
+    """
+        JSON bytes of a message, with orjson when installed. Anything orjson cannot encode
+        (Decimal...) goes through simplejson like singer does.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return simplejson.dumps(obj, use_decimal=True).encode("utf-8")
+
+
+def encode_record(stream_name, record, time_extracted=None):
+    """
+        Line of a RECORD message.
+    :param time_extracted: (str) - already formatted
+    """
+    message = {"type": "RECORD", "stream": stream_name, "record": record}
+    if time_extracted:
+        message["time_extracted"] = time_extracted
+    return dumps(message)
+
+
+class _BatchFile(object):
+    def __init__(self, directory, stream):
+        self.path = os.path.abspath(os.path.join(directory, "{}-{}.jsonl.gz".format(stream, uuid.uuid4().hex)))
+        self.file = gzip.open(self.path, "wb", compresslevel=1)
+        self.count = 0
+
+    def write(self, line):
+        self.file.write(line)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+class SingerWriter(object):
+    """
+        Buffered Singer output.
+
+        RECORD messages are encoded and kept in memory, then written with one write() and one
+        flush() every `buffer_records` records. Any other message (SCHEMA, STATE) flushes the
+        buffer first, so the order of the messages on stdout never changes.
+
+        With `batch_dir`, records are written instead to gzipped JSONL files (one per stream, up to
+        `batch_max_records` lines) announced with BATCH messages, for targets supporting them.
+        Open files are closed and announced before any STATE message.
+    """
+
+    def __init__(self, out=None, buffer_records=1000, batch_dir=None, batch_max_records=100000):
+        self.out = out or sys.stdout.buffer
+        self.buffer_records = max(1, buffer_records)
+        self.batch_dir = batch_dir
+        self.batch_max_records = batch_max_records
+
+        self._buffer = []
+        self._batch_files = {}
+        self._time_extracted = None
+        self._time_extracted_str = None
+
+        if self.batch_dir:
+            os.makedirs(self.batch_dir, exist_ok=True)
+
+    def format_time_extracted(self, time_extracted):
+        # the record pipeline hands the same datetime to many records in a row
+        if time_extracted is not self._time_extracted:
+            self._time_extracted = time_extracted
+            self._time_extracted_str = utils.strftime(time_extracted.astimezone(pytz.utc))
+        return self._time_extracted_str
+
+    def write_record(self, stream_name, record, time_extracted=None):
+        if self.batch_dir:
+            self._write_batch_record(stream_name, record)
+            return
+
+        self._buffer.append(encode_record(stream_name, record,
+                                          self.format_time_extracted(time_extracted) if time_extracted else None))
+        if len(self._buffer) >= self.buffer_records:
+            self.flush()
+
+    def write_encoded(self, stream_name, lines):
+        """
+            Records already encoded, by encode_record or with batch_dir as JSONL lines.
+        :param lines: list of bytes
+        """
+        if self.batch_dir:
+            for line in lines:
+                self._write_batch_line(stream_name, line)
+            return
+
+        self._buffer.extend(lines)
+        if len(self._buffer) >= self.buffer_records:
+            self.flush()
+
+    def _write_batch_record(self, stream_name, record):
+        self._write_batch_line(stream_name, dumps(record) + b"\n")
+
+    def _write_batch_line(self, stream_name, line):
+        batch_file = self._batch_files.get(stream_name)
+        if batch_file is None:
+            batch_file = self._batch_files[stream_name] = _BatchFile(self.batch_dir, stream_name)
+        batch_file.write(line)
+        if batch_file.count >= self.batch_max_records:
+            self._close_batch(stream_name)
+
+    def _close_batch(self, stream_name):
+        batch_file = self._batch_files.pop(stream_name)
+        batch_file.close()
+        self._buffer.append(dumps({
+            "type": "BATCH",
+            "stream": stream_name,
+            "encoding": {"format": "jsonl", "compression": "gzip"},
+            "manifest": ["file://" + batch_file.path],
+        }))
+
+    def write_message(self, message):
+        self.flush()
+        self.out.write(format_message(message).encode("utf-8") + b"\n")
+        self.out.flush()
+
+    def write_schema(self, stream_name, schema, key_properties, bookmark_properties=None):
+        if isinstance(key_properties, (str, bytes)):
+            key_properties = [key_properties]
+        self.write_message(SchemaMessage(stream=stream_name, schema=schema,
+                                         key_properties=key_properties,
+                                         bookmark_properties=bookmark_properties))
+
+    def write_state(self, value):
+        self.write_message(StateMessage(value=value))
+
+    def flush(self):
+        for stream_name in list(self._batch_files):
+            self._close_batch(stream_name)
+
+        if self._buffer:
+            self._buffer.append(b"")
+            self.out.write(b"\n".join(self._buffer))
+            self.out.flush()
+            self._buffer = []
+
+    def close(self):
+        self.flush()
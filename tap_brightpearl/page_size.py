@@ -0,0 +1,54 @@
+import threading
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# the search endpoints return up to 500 rows per page
+MAX_PAGE_SIZE = 500
+MIN_PAGE_SIZE = 50
+# first size of a stream without a learned one
+DEFAULT_PAGE_SIZE = 200
+
+
+class PageSizer(object):
+    """
+        Page size of a search stream, adjusted after every page.
+
+        It grows by half while pages come back faster than `target_latency` seconds, shrinks by
+        half when they are slower than twice the target and after a timeout or a server error.
+        Bigger pages cost the same single request of the throttle quota, so a low quota never
+        argues for smaller pages. Shared by the threads paging the same stream.
+    """
+
+    def __init__(self, size, min_size=MIN_PAGE_SIZE, max_size=MAX_PAGE_SIZE, target_latency=5.0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.size = max(min_size, min(max_size, size))
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """
+            Adjust to the latency of a page requested with the current size.
+        :return: (bool) - True when the size changed
+        """
+        with self._lock:
+            previous = self.size
+            if seconds > self.target_latency * 2:
+                self.size = max(self.min_size, self.size // 2)
+            elif seconds < self.target_latency:
+                self.size = min(self.max_size, self.size + max(1, self.size // 2))
+            return self.size != previous
+
+    def shrink(self):
+        """
+            After a timeout or a server error.
+        :return: (bool) - False when already at the minimum size, the error should be raised
+        """
+        with self._lock:
+            if self.size <= self.min_size:
+                return False
+            self.size = max(self.min_size, self.size // 2)
+            LOGGER.info("Page size down to %d", self.size)
+            return True
@@ -0,0 +1,143 @@
+import threading
+from collections import deque
+from itertools import islice
+
+import singer
+from singer import utils
+
+LOGGER = singer.get_logger()
+
+_END = object()
+# rows no longer kept for the stream
+_DROPPED = object()
+
+
+def _oldest(values):
+    """
+        Oldest of the state values, "" (no bookmark, full load) wins.
+    """
+    if not values or "" in values:
+        return ""
+    return min(values, key=utils.strptime_to_utc)
+
+
+class _Group(object):
+    def __init__(self, key, since, stream_names):
+        self.key = key
+        self.since = since
+        self.stream_names = set(stream_names)
+        # position of the next row of each stream reading, those not started are at 0
+        self.positions = {}
+        self.finished = set()
+        self.rows = deque()
+        # position of rows[0]
+        self.offset = 0
+        self.source = None
+        self.exhausted = False
+        # stream reading the source alone once the buffer is full, None while buffering
+        self.owner = None
+        self.lock = threading.Lock()
+
+    def trim(self):
+        """
+            Drop the rows every stream of the group already read.
+        """
+        if len(self.positions) < len(self.stream_names):
+            # someone has not started yet
+            return
+        reading = [position for stream_name, position in self.positions.items() if stream_name not in self.finished]
+        lowest = min(reading) if reading else self.offset + len(self.rows)
+        while self.offset < lowest and self.rows:
+            self.rows.popleft()
+            self.offset += 1
+
+
+class SharedParentIds(object):
+    """
+        Parent IDs shared by the selected dependent streams reading the same parent endpoint
+        (orders, goods_note_out and goods_note_in on order-search...).
+
+        The first stream of a group reading fetches the parent rows, page by page, from the
+        oldest bookmark of the group; the rows are kept until every stream of the group read
+        them, each stream only keeping the rows newer than its own bookmark. At most `max_rows`
+        rows are kept: past that, the stream ahead goes on reading the parent alone and the
+        others read it again themselves (a stream already reading skips the rows it got).
+        Streams alone on their parent are not concerned and read it themselves.
+    """
+
+    def __init__(self, groups, max_rows=100000):
+        """
+        :param groups: (dict) - parent key: {stream name: state value}, every selected dependent stream
+        :param max_rows: (int) - parent rows kept for the streams behind
+        """
+        self.max_rows = max_rows
+        self.groups = {}
+        self.stream_groups = {}
+        for key, bookmarks in groups.items():
+            if len(bookmarks) < 2:
+                continue
+            group = _Group(key, _oldest(list(bookmarks.values())), bookmarks)
+            self.groups[key] = group
+            for stream_name in bookmarks:
+                self.stream_groups[stream_name] = group
+            LOGGER.info("Parent %s read once for %s", key, ", ".join(sorted(bookmarks)))
+
+    def is_shared(self, stream_name):
+        return stream_name in self.stream_groups
+
+    def get(self, stream_name, fetch):
+        """
+            Parent rows of the stream's group, fetched as the streams read them.
+        :param fetch: (callable) - fetch(since) returns an iterable of the parent rows from the since bookmark
+        :return: (since, rows) - the bookmark the rows are fetched from and a generator of the rows
+        """
+        group = self.stream_groups[stream_name]
+        return group.since, self._rows(group, stream_name, fetch)
+
+    def _rows(self, group, stream_name, fetch):
+        position = 0
+        with group.lock:
+            group.positions[stream_name] = 0
+            if group.source is None:
+                group.source = iter(fetch(group.since))
+        try:
+            while True:
+                with group.lock:
+                    if group.owner == stream_name:
+                        # alone on the source
+                        row = next(group.source, _END)
+                    elif group.owner is not None or position < group.offset:
+                        row = _DROPPED
+                    elif position < group.offset + len(group.rows):
+                        row = group.rows[position - group.offset]
+                    elif group.exhausted:
+                        row = _END
+                    else:
+                        row = next(group.source, _END)
+                        if row is _END:
+                            group.exhausted = True
+                        elif len(group.rows) >= self.max_rows:
+                            LOGGER.info("More than %d rows of %s kept, the other streams read it again",
+                                        self.max_rows, group.key)
+                            group.owner = stream_name
+                            group.rows.clear()
+                            group.offset = position + 1
+                        else:
+                            group.rows.append(row)
+
+                    if row is not _END and row is not _DROPPED:
+                        position += 1
+                        group.positions[stream_name] = position
+                        group.trim()
+
+                if row is _END:
+                    return
+                if row is _DROPPED:
+                    # read the parent again, past the rows already read
+                    yield from islice(fetch(group.since), position, None)
+                    return
+                yield row
+        finally:
+            with group.lock:
+                group.finished.add(stream_name)
+                group.trim()
@@ -0,0 +1,88 @@
+import threading
+from collections import deque
+
+
+def _row_count(page):
+    return len(page.get("results", ())) if isinstance(page, dict) else 0
+
+
+class PagePrefetcher(object):
+    """
+        Pages of a search, fetched by a background thread ahead of the consumer so the API works
+        while the rows of the previous pages are transformed and written.
+
+        The next page starts after metaData.lastResult of the previous one, as long as
+        morePagesAvailable. At most `max_pages` pages wait for the consumer, and no page is
+        fetched while `max_rows` rows are waiting. An error is raised to the consumer once the
+        pages fetched before it were read.
+    """
+
+    def __init__(self, fetch, first_result, max_pages=1, max_rows=10000):
+        """
+        :param fetch: (callable) - fetch(first_result) returns the "response" of one page
+        :param max_pages: (int) - pages fetched ahead of the one being read
+        :param max_rows: (int) - rows held by the fetched pages, the memory ceiling
+        """
+        self.fetch = fetch
+        self.first_result = first_result
+        self.max_pages = max(1, max_pages)
+        self.max_rows = max_rows
+
+        self._pages = deque()
+        self._rows = 0
+        self._done = False
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    def _has_room(self):
+        return not self._pages or (len(self._pages) < self.max_pages and self._rows < self.max_rows)
+
+    def _run(self):
+        first_result = self.first_result
+        try:
+            while True:
+                with self._cond:
+                    while not self._closed and not self._has_room():
+                        self._cond.wait()
+                    if self._closed:
+                        return
+
+                page = self.fetch(first_result)
+                with self._cond:
+                    self._pages.append(page)
+                    self._rows += _row_count(page)
+                    self._cond.notify_all()
+
+                metadata = page.get("metaData") if isinstance(page, dict) else None
+                if not metadata or not metadata.get("morePagesAvailable"):
+                    return
+                first_result = metadata["lastResult"] + 1
+        except Exception as exc:  # pylint: disable=broad-except
+            with self._cond:
+                self._error = exc
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def __iter__(self):
+        threading.Thread(target=self._run, name="prefetch", daemon=True).start()
+        try:
+            while True:
+                with self._cond:
+                    while not self._pages and not self._done:
+                        self._cond.wait()
+                    if self._pages:
+                        page = self._pages.popleft()
+                        self._rows -= _row_count(page)
+                        self._cond.notify_all()
+                    elif self._error is not None:
+                        raise self._error
+                    else:
+                        return
+                yield page
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
@@ -0,0 +1,141 @@
+import threading
+from time import monotonic
+
+import singer
+
+LOGGER = singer.get_logger()
+
+
+class RateLimiter(object):
+    """
+        Token bucket fed by the Brightpearl throttle headers.
+
+        Every response tells how many requests are left (brightpearl-requests-remaining) and
+        when the window resets (brightpearl-next-throttle-period, in ms). The bucket spends the
+        tokens left above `min_requests_remaining` evenly over the rest of the window instead of
+        bursting and then stalling. The limiter is shared by all the threads of the client.
+    """
+
+    def __init__(self, min_requests_remaining=30, max_retries=5, max_backoff=60):
+        self.min_requests_remaining = min_requests_remaining
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+        self.tokens = None
+        self.reset_at = 0
+        self.in_flight = 0
+        self.last_grant = 0
+
+        # counters
+        self.throttled_seconds = 0.0
+        self.throttle_waits = 0
+        self.retries = 0
+        self.requests = 0
+
+        self._lock = threading.Condition()
+
+    def acquire(self):
+        """
+            Block until one request can be sent.
+        :return: (float) - seconds spent waiting
+        """
+        waited = 0.0
+        with self._lock:
+            while True:
+                now = monotonic()
+                wait = self._get_wait(now)
+                if wait <= 0:
+                    break
+
+                self._lock.wait(wait)
+                waited += monotonic() - now
+
+            self._grant(waited)
+        return waited
+
+    def try_acquire(self, waited=0.0):
+        """
+            Acquire without blocking, for the asyncio client.
+        :param waited: (float) - seconds already spent waiting for this request
+        :return: (float) - 0 when the request can be sent, else the seconds to wait before trying again
+        """
+        with self._lock:
+            wait = self._get_wait(monotonic())
+            if wait <= 0:
+                self._grant(waited)
+                return 0
+            return wait
+
+    def _get_wait(self, now):
+        if self.tokens is None:
+            return 0
+
+        if now >= self.reset_at:
+            # window is over, the next response tells the new budget
+            self.tokens = None
+            return 0
+
+        available = self.tokens - self.in_flight - self.min_requests_remaining
+        if available <= 0:
+            return self.reset_at - now
+
+        # pace the remaining tokens evenly until the window resets
+        return self.last_grant + (self.reset_at - now) / available - now
+
+    def _grant(self, waited):
+        self.last_grant = monotonic()
+        self.in_flight += 1
+        self.requests += 1
+        if waited:
+            self.throttled_seconds += waited
+            self.throttle_waits += 1
+
+    def release(self, headers=None):
+        """
+            Give back the in-flight slot and refresh the bucket from the response headers.
+        :param headers: (dict) - Response headers, None when the request failed.
+        :return:
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if headers and 'brightpearl-requests-remaining' in headers:
+                self.update(headers)
+            elif self.tokens is not None:
+                self.tokens -= 1
+            self._lock.notify_all()
+
+    def update(self, headers):
+        with self._lock:
+            self.tokens = int(headers['brightpearl-requests-remaining'])
+            if 'brightpearl-next-throttle-period' in headers:
+                self.reset_at = monotonic() + int(headers['brightpearl-next-throttle-period']) / 1000
+            self._lock.notify_all()
+
+    def backoff(self, headers, attempt):
+        """
+            Called on a 429: the bucket is empty until the throttle period ends. Without the header
+            fall back to an exponential backoff.
+        :param headers: (dict) - Response headers.
+        :param attempt: (int) - number of retries already made for this request.
+        :return:
+        """
+        if headers and 'brightpearl-next-throttle-period' in headers:
+            wait = int(headers['brightpearl-next-throttle-period']) / 1000
+        else:
+            wait = 2 ** attempt
+        wait = min(wait, self.max_backoff)
+
+        with self._lock:
+            self.retries += 1
+            self.tokens = 0
+            self.reset_at = max(self.reset_at, monotonic() + wait)
+            self._lock.notify_all()
+        LOGGER.info("Rate limit hit, retry %d in %.1fs", attempt + 1, wait)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttle_waits": self.throttle_waits,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+        }
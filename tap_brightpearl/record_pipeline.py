@@ -0,0 +1,126 @@
+from time import monotonic
+
+from singer import metadata, utils
+from singer.transform import SchemaMismatch
+
+
+_MISSING = object()
+
+
+def _fast_path(field_schema):
+    """
+        Coercion of the values already holding the schema type, None when every value
+        must go through the generic transformer (objects, arrays, dates, anyOf...).
+        It returns exactly what singer.Transformer would.
+    """
+    if "anyOf" in field_schema or "format" in field_schema or "type" not in field_schema:
+        return None
+
+    types = field_schema["type"]
+    if not isinstance(types, list):
+        types = [types]
+    nullable = "null" in types
+    types = [typ for typ in types if typ != "null"]
+    if len(types) != 1:
+        return None
+    typ = types[0]
+
+    # Transformer turns None into False for booleans, leave that to it
+    none_ok = nullable and typ in ("string", "integer", "number")
+
+    if typ == "string":
+        accepted = (str,)
+    elif typ == "integer":
+        accepted = (int,)
+    elif typ == "number":
+        accepted = (float,)
+    elif typ == "boolean":
+        accepted = (bool,)
+    else:
+        return None
+
+    def coerce(value):
+        if value is None:
+            return none_ok, None
+        value_type = type(value)
+        if value_type in accepted:
+            return True, value
+        if typ == "number" and value_type is int:
+            return True, float(value)
+        return False, None
+
+    return coerce
+
+
+class RecordPipeline(object):
+    """
+        Per stream record transformation, compiled once from the catalog entry.
+
+        The metadata map, the selected fields and a coercion plan per field are computed up front.
+        Values which already have their schema type are copied as they are; anything else (nested
+        objects, arrays, values needing a conversion) goes through the singer Transformer for that
+        field only, so the output is the same as Transformer.transform. Records can be any
+        mapping, like the search Rows, the result is always a new dict.
+    """
+
+    def __init__(self, catalog_entry, transformer, extraction_time_refresh=1.0):
+        self.stream = catalog_entry['tap_stream_id']
+        self.schema = catalog_entry['schema']
+        self.metadata = metadata.to_map(catalog_entry['metadata'])
+        self.transformer = transformer
+        self.extraction_time_refresh = extraction_time_refresh
+        self._extraction_time = None
+        self._extraction_checked_at = 0
+
+        self.plan = []
+        for field, field_schema in self.schema.get('properties', {}).items():
+            if not self.is_field_selected(field):
+                continue
+            self.plan.append((field, field_schema, _fast_path(field_schema)))
+
+    def is_field_selected(self, field):
+        """
+            Same rules as Transformer.filter_data_by_metadata.
+        """
+        breadcrumb = ('properties', field)
+        inclusion = metadata.get(self.metadata, breadcrumb, 'inclusion')
+        if inclusion == 'automatic':
+            return True
+        if inclusion == 'unsupported':
+            return False
+        return metadata.get(self.metadata, breadcrumb, 'selected') is not False
+
+    @property
+    def selected_fields(self):
+        return [field for field, _, _ in self.plan]
+
+    def extraction_time(self):
+        """
+            singer.utils.now(), refreshed at most once per extraction_time_refresh seconds.
+        """
+        now = monotonic()
+        if self._extraction_time is None or now - self._extraction_checked_at >= self.extraction_time_refresh:
+            self._extraction_time = utils.now()
+            self._extraction_checked_at = now
+        return self._extraction_time
+
+    def transform(self, rec):
+        result = {}
+        success = True
+        for field, field_schema, fast_path in self.plan:
+            value = rec.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+
+            if fast_path is not None:
+                done, coerced = fast_path(value)
+                if done:
+                    result[field] = coerced
+                    continue
+
+            field_success, result[field] = self.transformer.transform_recur(value, field_schema, [field])
+            success = success and field_success
+
+        if not success:
+            raise SchemaMismatch(self.transformer.errors)
+        return result
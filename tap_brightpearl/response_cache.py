@@ -0,0 +1,95 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import singer
+
+from tap_brightpearl.output import dumps
+
+LOGGER = singer.get_logger()
+
+
+class ResponseCache(object):
+    """
+        Local SQLite cache of dependent records, one row per stream and parent ID, stored with the
+        parent's state value (updatedOn) when they were fetched.
+
+        A record is served from the cache as long as the parent state value did not move, so it
+        only hits on the parents an incremental search returns again unchanged (full reloads,
+        incremental_back_days overlap, resumed runs), never on the ones that moved. Entries
+        unused for `max_age_days` are evicted on close(), then the least recently used ones above
+        `max_entries`.
+
+        Streams running in parallel share it, every access holds the lock.
+    """
+
+    def __init__(self, path, max_entries=1000000, max_age_days=30):
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                "stream TEXT NOT NULL, id INTEGER NOT NULL, parent_updated_at TEXT NOT NULL, "
+                                "record BLOB NOT NULL, used_at REAL NOT NULL, PRIMARY KEY (stream, id))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        self.connection.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self._used = []
+        self._lock = threading.Lock()
+
+    def get(self, stream_name, object_id, parent_updated_at):
+        """
+            Cached record of the parent, None when missing or fetched before the parent last changed.
+        """
+        with self._lock:
+            row = self.connection.execute("SELECT parent_updated_at, record FROM responses WHERE stream = ? AND id = ?",
+                                          (stream_name, object_id)).fetchone()
+            if row is None or not parent_updated_at or row[0] != parent_updated_at:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used.append((stream_name, object_id))
+        return json.loads(row[1])
+
+    def put_many(self, stream_name, entries):
+        """
+        :param entries: iterable of (parent ID, parent state value, record)
+        """
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO responses (stream, id, parent_updated_at, record, used_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((stream_name, object_id, parent_updated_at, dumps(record), now)
+                 for object_id, parent_updated_at, record in entries if parent_updated_at))
+            self._touch(now)
+
+    def _touch(self, now):
+        if self._used:
+            self.connection.executemany("UPDATE responses SET used_at = ? WHERE stream = ? AND id = ?",
+                                        ((now, stream_name, object_id) for stream_name, object_id in self._used))
+            self._used = []
+
+    def evict(self):
+        with self._lock, self.connection:
+            self._touch(time.time())
+            self.connection.execute("DELETE FROM responses WHERE used_at < ?",
+                                    (time.time() - self.max_age_days * 86400,))
+            count = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute("DELETE FROM responses WHERE rowid IN ("
+                                        "SELECT rowid FROM responses ORDER BY used_at LIMIT ?)",
+                                        (count - self.max_entries,))
+
+    def close(self):
+        self.evict()
+        LOGGER.info("Dependent cache: %d hits, %d misses", self.hits, self.misses)
+        self.connection.close()
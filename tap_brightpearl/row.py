@@ -0,0 +1,59 @@
+from collections.abc import Mapping
+
+
+def column_index(columns):
+    """
+        Position of every column of a search page, shared by all the rows of the page.
+        A column repeated keeps its last position, like dict(zip(columns, row)) does.
+    """
+    return {name: position for position, name in enumerate(columns)}
+
+
+class Row(Mapping):
+    """
+        Read-only mapping of a search result row: the values list of the API response and the
+        column index of its page, instead of a dict per row.
+
+        Reads like dict(zip(columns, values)): a row shorter than the columns has no key for
+        the missing ones. Use dict(row) for a mutable copy.
+    """
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index, values):
+        """
+        :param index: (dict) - column_index() of the page
+        :param values: (list) - the row as sent by the API
+        """
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        position = self._index[key]
+        if position >= len(self._values):
+            raise KeyError(key)
+        return self._values[position]
+
+    def get(self, key, default=None):
+        position = self._index.get(key)
+        if position is None or position >= len(self._values):
+            return default
+        return self._values[position]
+
+    def __contains__(self, key):
+        position = self._index.get(key)
+        return position is not None and position < len(self._values)
+
+    def __iter__(self):
+        size = len(self._values)
+        return (name for name, position in self._index.items() if position < size)
+
+    def __len__(self):
+        size = len(self._values)
+        return sum(1 for position in self._index.values() if position < size)
+
+    def __repr__(self):
+        return "Row({!r})".format(dict(self))
+
+    def __reduce__(self):
+        # pickled rows of a batch still share their index
+        return Row, (self._index, self._values)
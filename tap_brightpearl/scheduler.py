@@ -0,0 +1,168 @@
+import copy
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import singer
+from tap_brightpearl.context import Context
+from tap_brightpearl.stream import Stream, Checkpoint
+
+LOGGER = singer.get_logger()
+
+STARTED = "started"
+RECORD = "record"
+CHECKPOINT = "checkpoint"
+DONE = "done"
+_ERROR = "error"
+
+# lookup tables first, then incremental searches, then dependent streams
+LOOKUP, INCREMENTAL, DEPENDENT = range(3)
+
+
+def stream_cost(stream_id):
+    resource = Stream.resource.get(stream_id, {})
+    if "depending_on" in resource:
+        return DEPENDENT
+    if "state_filter" in resource:
+        return INCREMENTAL
+    return LOOKUP
+
+
+class StreamScheduler(object):
+    """
+        Runs the selected streams, up to max_streams of them at the same time.
+
+        Streams run in worker threads and only produce records; everything written to stdout
+        goes through run() on the calling thread, one event at a time:
+            (stream_id, STARTED, None), (stream_id, RECORD, record)..., (stream_id, DONE, None)
+        so each stream's RECORD messages always follow its SCHEMA and the output stays valid Singer.
+        (stream_id, CHECKPOINT, checkpoint) events come between the records of dependent streams
+        and partitioned backfills.
+
+        The bookmark of a stream is only part of safe_state() after its DONE event, i.e. once all
+        its records were written. Until then safe_state() holds the bookmark the stream started
+        with plus its last checkpoint handed to the caller.
+    """
+
+    def __init__(self, stream_ids, max_streams=1, priority=None, batch_size=100, queue_size=100):
+        self.max_streams = max(1, max_streams)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.stream_ids = self.order_streams(stream_ids, priority or [])
+
+        self.in_flight = []
+        self.start_bookmarks = {}
+        self.checkpoints = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @staticmethod
+    def order_streams(stream_ids, priority):
+        first = [stream_id for stream_id in priority if stream_id in stream_ids]
+        rest = sorted((stream_id for stream_id in stream_ids if stream_id not in first), key=stream_cost)
+        return first + rest
+
+    def start(self, stream_id):
+        # before the stream touches its bookmark
+        with self._lock, Context.state_lock:
+            self.start_bookmarks[stream_id] = copy.deepcopy(Context.state.get('bookmarks', {}).get(stream_id))
+            self.in_flight.append(stream_id)
+
+    def finish(self, stream_id):
+        # once every record of the stream was handed to the caller
+        with self._lock:
+            self.in_flight.remove(stream_id)
+            self.start_bookmarks.pop(stream_id, None)
+            self.checkpoints.pop(stream_id, None)
+
+    def checkpoint(self, stream_id, checkpoint):
+        with self._lock:
+            self.checkpoints[stream_id] = dict(checkpoint)
+
+    def safe_state(self):
+        """
+            Copy of Context.state where the streams still running keep the bookmark they started with.
+        :return: (dict)
+        """
+        with self._lock, Context.state_lock:
+            state = copy.deepcopy(Context.state)
+
+            bookmarks = state.setdefault('bookmarks', {})
+            bookmarks.pop('currently_sync_stream', None)
+            for stream_id in self.in_flight:
+                bookmark = copy.deepcopy(self.start_bookmarks.get(stream_id)) or {}
+                if stream_id in self.checkpoints:
+                    bookmark['checkpoint'] = dict(self.checkpoints[stream_id])
+                if bookmark:
+                    bookmarks[stream_id] = bookmark
+                else:
+                    bookmarks.pop(stream_id, None)
+            if self.in_flight:
+                bookmarks['currently_sync_stream'] = self.in_flight[0]
+        return state
+
+    def run(self):
+        if self.max_streams == 1:
+            return self._run_sequential()
+        return self._run_parallel()
+
+    def _run_sequential(self):
+        for stream_id in self.stream_ids:
+            self.start(stream_id)
+            yield stream_id, STARTED, None
+            for rec in Context.stream_objects[stream_id].sync():
+                yield stream_id, CHECKPOINT if isinstance(rec, Checkpoint) else RECORD, rec
+            self.finish(stream_id)
+            yield stream_id, DONE, None
+
+    def _put(self, events, item):
+        while not self._stop.is_set():
+            try:
+                events.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self, events, stream_id):
+        try:
+            self.start(stream_id)
+            if not self._put(events, (stream_id, STARTED, None)):
+                return
+            batch = []
+            for rec in Context.stream_objects[stream_id].sync():
+                batch.append(rec)
+                if len(batch) >= self.batch_size:
+                    if not self._put(events, (stream_id, RECORD, batch)):
+                        return
+                    batch = []
+            if batch and not self._put(events, (stream_id, RECORD, batch)):
+                return
+            self._put(events, (stream_id, DONE, None))
+        except Exception as exc:  # pylint: disable=broad-except
+            self._put(events, (stream_id, _ERROR, exc))
+
+    def _run_parallel(self):
+        events = queue.Queue(maxsize=self.queue_size)
+        remaining = len(self.stream_ids)
+        executor = ThreadPoolExecutor(max_workers=self.max_streams)
+        try:
+            for stream_id in self.stream_ids:
+                executor.submit(self._worker, events, stream_id)
+
+            while remaining:
+                stream_id, event, payload = events.get()
+                if event == _ERROR:
+                    raise payload
+                elif event == STARTED:
+                    yield stream_id, STARTED, None
+                elif event == RECORD:
+                    for rec in payload:
+                        yield stream_id, CHECKPOINT if isinstance(rec, Checkpoint) else RECORD, rec
+                else:
+                    remaining -= 1
+                    self.finish(stream_id)
+                    yield stream_id, DONE, None
+        finally:
+            self._stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,130 @@
+_KINDS = {
+    type(None): "null",
+    bool: "boolean",
+    int: "integer",
+    float: "number",
+    str: "string",
+    dict: "object",
+    list: "array",
+}
+
+_SCALARS = {"boolean", "integer", "number", "string"}
+
+
+class _Node(object):
+    """
+        Everything seen at one place of the sampled records.
+    """
+    __slots__ = ("kinds", "properties", "items")
+
+    def __init__(self):
+        self.kinds = set()
+        self.properties = None
+        self.items = None
+
+    def add(self, value):
+        kind = _KINDS.get(type(value), "string")
+        self.kinds.add(kind)
+        if kind == "object":
+            if self.properties is None:
+                self.properties = {}
+            for key, sub_value in value.items():
+                node = self.properties.get(key)
+                if node is None:
+                    node = self.properties[key] = _Node()
+                node.add(sub_value)
+        elif kind == "array":
+            if self.items is None:
+                self.items = _Node()
+            for sub_value in value:
+                self.items.add(sub_value)
+
+    def merge(self, other):
+        self.kinds |= other.kinds
+        if other.properties is not None:
+            if self.properties is None:
+                self.properties = {}
+            for key, node in other.properties.items():
+                if key in self.properties:
+                    self.properties[key].merge(node)
+                else:
+                    self.properties[key] = node
+        if other.items is not None:
+            if self.items is None:
+                self.items = _Node()
+            self.items.merge(other.items)
+
+
+class SchemaInference(object):
+    """
+        JSON schema of sampled records, merged over all of them.
+
+        Types are widened across the records: integer and number give number, booleans mixed
+        with integers give integer and with numbers give number, any other mix of scalars gives
+        string, and a mix of objects or arrays with anything else is left untyped.
+        Every property is nullable, a field missing from some records is fine. Nested objects
+        and arrays get their own schema; objects keyed by IDs ({"123": {...}, "124": {...}})
+        become one schema for all their values (patternProperties). Objects always accept
+        keys missing from the sample, so no data is dropped by the catalog.
+    """
+
+    def __init__(self, max_properties=200):
+        """
+        :param max_properties: objects with more distinct keys than this are maps, like ID keyed ones
+        """
+        self.max_properties = max_properties
+        self.root = _Node()
+        self.count = 0
+
+    def add(self, record):
+        self.root.add(record)
+        self.count += 1
+
+    def properties(self):
+        """
+            Schema of each top level field, like the "properties" of a catalog entry.
+        """
+        return {key: self._schema(node) for key, node in (self.root.properties or {}).items()}
+
+    def _is_map(self, properties):
+        if len(properties) > self.max_properties:
+            return True
+        return all(key.lstrip("-").isdigit() for key in properties)
+
+    def _schema(self, node):
+        kinds = node.kinds - {"null"}
+        if not kinds:
+            # only nulls seen
+            return {"type": ["null", "string"]}
+
+        if kinds & {"object", "array"}:
+            if len(kinds) > 1:
+                return {}
+            if "object" in kinds:
+                return self._object_schema(node)
+            items = self._schema(node.items) if node.items is not None and node.items.kinds else {}
+            return {"type": ["null", "array"], "items": items}
+
+        if kinds <= {"boolean", "integer", "number"} and kinds & {"integer", "number"}:
+            # flags sent as booleans by some records and 0/1 by others: true comes out as 1,
+            # integer unless a float was seen
+            typ = "number" if "number" in kinds else "integer"
+        elif len(kinds) == 1:
+            typ = next(iter(kinds))
+        else:
+            typ = "string"
+        return {"type": ["null", typ]}
+
+    def _object_schema(self, node):
+        properties = node.properties or {}
+        if properties and self._is_map(properties):
+            values = _Node()
+            for child in properties.values():
+                values.merge(child)
+            return {"type": ["null", "object"], "patternProperties": {".*": self._schema(values)}}
+
+        schema = {"type": ["null", "object"],
+                  "properties": {key: self._schema(child) for key, child in properties.items()},
+                  # keys missing from the sample pass untouched
+                  "patternProperties": {".*": {}}}
+        return schema
@@ -1,34 +1,58 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from time import monotonic
+import requests
 from singer import metrics, utils, log_info, logger
+from tap_brightpearl.brightpearl import ServerErrorException
 from tap_brightpearl.context import Context
+from tap_brightpearl.idset import pack_ids, parse_ranges, format_ranges
+from tap_brightpearl.page_size import PageSizer, DEFAULT_PAGE_SIZE
+from tap_brightpearl.prefetch import PagePrefetcher
+from tap_brightpearl.row import Row, column_index
+from tap_brightpearl.schema_inference import SchemaInference
+
+
+class Checkpoint(dict):
+    """
+    Mid-stream bookmark of a dependent stream or of a partitioned backfill. Stream.sync yields it
+    between the records, right after the last record of the batches (or time windows) it covers.
+    """
+
+
+class CachedBatch(list):
+    """
+    Dependent records served from the response cache, passed along the URIs to fetch.
+    """
 
 
 class Stream():
     resource = {
         ## attribute tables
-        "brand": {"url_path": "product-service/brand-search"},
-        "collection": {"url_path": "product-service/collection-search"},
-        "option": {"url_path": "product-service/option-search"},
-        "option_value": {"url_path": "product-service/option-value-search"},
-        "price_list": {"url_path": "product-service/price-list/"},
-        "product_type": {"url_path": "product-service/product-type-search"},
-        "channel_brand": {"url_path": "/product-service/channel-brand"},
-        "channel": {"url_path": "/product-service/channel"},
-
-        "order_type": {"url_path": "order-service/order-type"},
-        "order_status": {"url_path": "order-service/order-status"},
-        "order_stock_status": {"url_path": "order-service/order-stock-status"},
-        "order_shipping_status": {"url_path": "order-service/order-shipping-status"},
-
-        "company": {"url_path": "contact-service/company-search"},
-        "tax_code": {"url_path": "accounting-service/tax-code"},
-        "exchange_rate": {"url_path": "accounting-service/exchange-rate"},
-        "currency": {"url_path": "accounting-service/currency-search"},
-        "accounting_period": {"url_path": "accounting-service/accounting-period"},
-
-        "location": {"url_path": "warehouse-service/location-search"},
-        "zone": {"url_path": "warehouse-service/zone-search"},
-        "warehouse": {"url_path": "warehouse-service/warehouse-search"},
-        "shipping_method": {"url_path": "warehouse-service/shipping-method-search"},
+        "brand": {"url_path": "product-service/brand-search", "fingerprint": True},
+        "collection": {"url_path": "product-service/collection-search", "fingerprint": True},
+        "option": {"url_path": "product-service/option-search", "fingerprint": True},
+        "option_value": {"url_path": "product-service/option-value-search", "fingerprint": True},
+        "price_list": {"url_path": "product-service/price-list/", "fingerprint": True},
+        "product_type": {"url_path": "product-service/product-type-search", "fingerprint": True},
+        "channel_brand": {"url_path": "/product-service/channel-brand", "fingerprint": True},
+        "channel": {"url_path": "/product-service/channel", "fingerprint": True},
+
+        "order_type": {"url_path": "order-service/order-type", "fingerprint": True},
+        "order_status": {"url_path": "order-service/order-status", "fingerprint": True},
+        "order_stock_status": {"url_path": "order-service/order-stock-status", "fingerprint": True},
+        "order_shipping_status": {"url_path": "order-service/order-shipping-status", "fingerprint": True},
+
+        "company": {"url_path": "contact-service/company-search", "fingerprint": True},
+        "tax_code": {"url_path": "accounting-service/tax-code", "fingerprint": True},
+        "exchange_rate": {"url_path": "accounting-service/exchange-rate", "fingerprint": True},
+        "currency": {"url_path": "accounting-service/currency-search", "fingerprint": True},
+        "accounting_period": {"url_path": "accounting-service/accounting-period", "fingerprint": True},
+
+        "location": {"url_path": "warehouse-service/location-search", "fingerprint": True},
+        "zone": {"url_path": "warehouse-service/zone-search", "fingerprint": True},
+        "warehouse": {"url_path": "warehouse-service/warehouse-search", "fingerprint": True},
+        "shipping_method": {"url_path": "warehouse-service/shipping-method-search", "fingerprint": True},
 
         ## guide for data deletion
         "product_idset": {"url_path": "product-service/product", "method": "options"},
@@ -44,16 +68,16 @@ class Stream():
                     "state_filter":"updatedOn"},
 
         "goods_movement": {"url_path": "warehouse-service/goods-movement-search",
-                           "state_filter":"updatedOn"},
+                           "state_filter":"updatedOn", "backfill_partitions": True},
 
         "customer_payment": {"url_path": "accounting-service/customer-payment-search",
-                             "state_filter":"createdOn"},
+                             "state_filter":"createdOn", "backfill_partitions": True},
 
         "journal": {"url_path": "accounting-service/journal-search",
-                    "state_filter":"journalDateEntered"},
+                    "state_filter":"journalDateEntered", "backfill_partitions": True},
 
         "order_search": {"url_path": "order-service/order-search",
-                           "state_filter":"updatedOn"},
+                           "state_filter":"updatedOn", "backfill_partitions": True},
 
         "goods_out_search": {"url_path": "/warehouse-service/goods-note/goods-out-search",
                              "state_filter":"createdOn"},
@@ -64,6 +88,7 @@ class Stream():
         ## incremental dynamic
         "orders": {"url_path": "order-service/order", "depending_on": "order-service/order",
                    "depending_on_incremental": "order-service/order-search",
+                   "depending_on_incremental_id": "orderId",
                    "depending_on_incremental_state_filter": "updatedOn",
                    "search_param": {"includeOptional": "customFields,nullCustomFields"}},
 
@@ -71,6 +96,7 @@ class Stream():
                            "url_extension": "/goods-note/goods-out/",
                            "depending_on": "order-service/order",
                            "depending_on_incremental": "order-service/order-search",
+                           "depending_on_incremental_id": "orderId",
                            "depending_on_incremental_state_filter": "updatedOn",
                            "schema": {"goods_note_id": "integer", "goods_note": "object"},
                            },
@@ -78,6 +104,7 @@ class Stream():
                           "url_extension": "/goods-note/goods-in/",
                           "depending_on": "order-service/order",
                           "depending_on_incremental": "order-service/order-search",
+                          "depending_on_incremental_id": "orderId",
                           "depending_on_incremental_state_filter": "updatedOn",
                           "schema": {"goods_note_id": "integer", "goods_note": "object"},
                           },
@@ -86,29 +113,33 @@ class Stream():
         "product_with_custom": {"url_path": "product-service/product",
                                 "depending_on": "product-service/product",
                                 "depending_on_incremental":  "product-service/product-search",
+                                "depending_on_incremental_id": "productId",
                                 "depending_on_incremental_state_filter": "updatedOn",
+                                "cache_id": "id",
                                 "search_param": {"includeOptional":"customFields"}
                                 },
 
         "product_price": {"url_path": "/product-service/product-price/",
                           "depending_on": "product-service/product",
                           "depending_on_incremental":  "product-service/product-search",
-                          "depending_on_incremental_state_filter": "updatedOn"
+                          "depending_on_incremental_id": "productId",
+                          "depending_on_incremental_state_filter": "updatedOn",
+                          "cache_id": "productId",
                           },
 
         "purchase_order_landed_cost": {"url_path": "order-service/purchase-order-lc-search"},
 
 
         ####
-        "custom_field_meta_data": {"url_path": "product-service/product/custom-field-meta-data"},
+        "custom_field_meta_data": {"url_path": "product-service/product/custom-field-meta-data", "fingerprint": True},
 
 
         # those can be optional due to orders
         "sales_order": {"url_path": "order-service/sales-order", "depending_on": "order-service/sales-order"},
         "sales_credit": {"url_path": "order-service/sales-credit", "depending_on": "order-service/sales-credit"},
 
-        "order_custom_field_meta_data_purchase": {"url_path": "order-service/purchase/custom-field-meta-data"},
-        "order_custom_field_meta_data_sale": {"url_path": "order-service/sale/custom-field-meta-data"},
+        "order_custom_field_meta_data_purchase": {"url_path": "order-service/purchase/custom-field-meta-data", "fingerprint": True},
+        "order_custom_field_meta_data_sale": {"url_path": "order-service/sale/custom-field-meta-data", "fingerprint": True},
         "order_note": {"url_path": "order-service/order-note-search"},
 
         "product_availability": {"url_path": "/warehouse-service/product-availability/",
@@ -118,15 +149,16 @@ class Stream():
 
         "supplier_payment": {"url_path": "accounting-service/supplier-payment-search"},
 
-        "contact_group": {"url_path": "contact-service/contact-group-search"},
+        "contact_group": {"url_path": "contact-service/contact-group-search", "fingerprint": True},
         "contact_group_member": {"url_path": "contact-service/contact-group-member-search"},
-        "lead_source": {"url_path": "contact-service/lead-source"},
+        "lead_source": {"url_path": "contact-service/lead-source", "fingerprint": True},
     }
 
     def __init__(self, entity):
         self.entity = entity
+        self.page_sizer = None
 
-    def get_uris(self, first_result=1, lastResult=500, discovery=False):
+    def get_uris(self, first_result=1, lastResult=500, discovery=False, checkpoint=None):
         """
         Either get the URI list from a proper service on BP API or
         build a mimic one with incremental from the search emdpoints
@@ -134,119 +166,583 @@ class Stream():
         BP IDSET [OPTIONS} endpoint does not have a search capability to limit the size of records to fetch.
         This will might help to decrease the processing time using the Search endpoint and rebuild the list of uri.
 
+        URIs are generated lazily: the parent search is paged as the dependent batches are consumed.
+        Once they all were, "bookmark" holds the (state field, value) the stream can be bookmarked with.
+
         :param first_result:
         :param lastResult:
-        :return:
+        :param checkpoint: (dict) - resumed checkpoint, IDs already emitted are left out
+        :return: (dict) - "getUris" is a generator
         """
 
+        shared = not discovery and Context.parent_ids is not None and Context.parent_ids.is_shared(self.entity)
+
         if discovery or "depending_on_incremental" not in self.resource[self.entity]:
-            get_urls = Context.session.get_data(url_path=self.resource[self.entity]["depending_on"],
-                                                firstResult=first_result, lastResult=lastResult, method="OPTIONS")
+            def idset_uris(_since):
+                data = Context.session.get_data(url_path=self.resource[self.entity]["depending_on"],
+                                                firstResult=first_result, lastResult=lastResult,
+                                                method="OPTIONS")
+                # CMNC-404 comes back as an empty list
+                return data["getUris"] if isinstance(data, dict) else []
+
+            uris = Context.parent_ids.get(self.entity, idset_uris)[1] if shared else idset_uris("")
+            if checkpoint and checkpoint["last_id"]:
+                uris = self.skip_done_uris(uris, checkpoint["last_id"])
+            get_urls = {"getUris": uris}
         else:
-            counter = 0
-            max = 200
-            temp_urls = []
-            get_urls_array = []
-
-            state_filter = {}
-            state_filter_field = None
-            if "depending_on_incremental_state_filter" in self.resource[self.entity]:
-                state_filter_field = self.resource[self.entity]["depending_on_incremental_state_filter"]
-                state_last_updated_at = Context.get_state_value(self.entity, self.resource[self.entity]["depending_on_incremental_state_filter"])
-                last_updated_at = state_last_updated_at
-                if state_last_updated_at:
-                    state_filter[state_filter_field] = f"{state_last_updated_at}/"
-
-            while True:
-                data = Context.session.get_data(url_path=self.resource[self.entity]["depending_on_incremental"],
-                                                    firstResult=first_result, lastResult=lastResult,
-                                                    search_params=state_filter)
-
-                metadata = data["metaData"]
-                index_state_field = 0
-                for col in data["metaData"]["columns"]:
-                    if col["name"] == state_filter_field:
-                        break
-                    index_state_field += 1
+            state_filter_field = self.resource[self.entity].get("depending_on_incremental_state_filter")
+            state_last_updated_at = Context.get_state_value(self.entity, state_filter_field) if state_filter_field else ""
+            last_updated_at = state_last_updated_at
 
-                for d in data["results"]:
-                    counter += 1
-                    order_id = d[0]
-                    obj_date = d[index_state_field]
-                    temp_urls.append(str(order_id))
+            own_since = None
+            if shared:
+                since, rows = Context.parent_ids.get(
+                    self.entity, lambda since: self.search_parent_ids(since, first_result, lastResult))
+                if state_last_updated_at and state_last_updated_at != since:
+                    own_since = utils.strptime_to_utc(state_last_updated_at)
+            else:
+                rows = self.search_parent_ids(state_last_updated_at, first_result, lastResult)
 
-                    if obj_date > last_updated_at:
-                        last_updated_at = obj_date
+            resumed_until = None
+            if checkpoint and checkpoint["last_id"]:
+                resumed_until = utils.strptime_to_utc(checkpoint["since"])
 
-                    if counter == max:
-                        get_urls_array.append("/order/"+",".join(temp_urls))
-                        temp_urls = []
-                        counter = 0
+            found = 0
 
-                if metadata["morePagesAvailable"]:
-                    first_result = metadata["lastResult"] + 1
+            def parent_ids():
+                nonlocal last_updated_at, found
+                for object_id, obj_date in rows:
+                    if obj_date and obj_date > last_updated_at:
+                        last_updated_at = obj_date
+                    if own_since and (not obj_date or utils.strptime_to_utc(obj_date) < own_since):
+                        # read for another stream of the group with an older bookmark
+                        continue
+                    found += 1
+                    if resumed_until and object_id <= checkpoint["last_id"] and \
+                            obj_date and utils.strptime_to_utc(obj_date) <= resumed_until:
+                        # emitted by the interrupted run and not updated since
+                        continue
+                    yield object_id, obj_date
+
+            uri_prefix = "/" + self.resource[self.entity]["depending_on"].rstrip("/").rsplit("/", 1)[-1] + "/"
+            cached = Context.response_cache is not None and "cache_id" in self.resource[self.entity]
+
+            def uris():
+                if cached:
+                    yield from self.get_cached_uris(parent_ids(), uri_prefix, get_urls["parent_dates"])
                 else:
-                    break
+                    for ids in pack_ids((object_id for object_id, _ in parent_ids()),
+                                        Context.get_int_config("dependent_batch_size", 200),
+                                        Context.get_int_config("dependent_url_max_length", 2000)):
+                        yield uri_prefix + ids
 
-            if len(temp_urls) > 0:
-                get_urls_array.append("/order/"+",".join(temp_urls))
+                logger.log_info("Orders to be process:"+str(found))
+                if state_filter_field:
+                    get_urls["bookmark"] = (state_filter_field, last_updated_at)
 
-            if state_filter_field:
-                Context.set_state_value(self.entity, state_filter_field, last_updated_at)
-
-            logger.log_info("Orders to be process:"+str(metadata["resultsAvailable"]))
-            get_urls = {"getUris":get_urls_array}
+            get_urls = {"getUris": uris()}
+            if cached:
+                get_urls["parent_dates"] = {}
 
         return get_urls
 
 
-    def get_data(self, first_result=1, discovery=False, state_filter={}):
-        url_path = self.resource[self.entity]['url_path']
+    def get_page_sizer(self):
+        with Context.state_lock:
+            if self.page_sizer is None:
+                learned = Context.state.get("page_sizes", {}).get(self.entity)
+                self.page_sizer = PageSizer(learned or Context.get_results_per_page(DEFAULT_PAGE_SIZE),
+                                            target_latency=Context.get_int_config("page_latency_target", 5))
+            return self.page_sizer
 
-        lastResult = 500 if discovery else None
+    def fetch_search_page(self, url_path, first_result, search_params, stream=False, lastResult=None):
+        """
+        One page of a search endpoint, with the page size of the stream adjusted to the latency.
+        After a timeout or a server error the page is requested again with a smaller size.
+        The size is kept in state["page_sizes"] for the next run.
+        """
+        page_sizer = self.get_page_sizer()
+        while True:
+            page_size = page_sizer.size
+            started = monotonic()
+            try:
+                data = Context.session.get_data(url_path=url_path, firstResult=first_result, lastResult=lastResult,
+                                                search_params=search_params, stream=stream, page_size=page_size)
+            except (ServerErrorException, requests.exceptions.Timeout, requests.exceptions.ConnectionError) as exc:
+                if not page_sizer.shrink():
+                    raise
+                logger.log_info("{} on {} page size {}, retrying with {}".format(
+                    type(exc).__name__, self.entity, page_size, page_sizer.size))
+                continue
+
+            if page_sizer.observe(monotonic() - started):
+                with Context.state_lock:
+                    Context.state.setdefault("page_sizes", {})[self.entity] = page_sizer.size
+            return data
+
+    def get_cached_uris(self, parent_rows, uri_prefix, parent_dates):
+        """
+        URIs of the parent IDs missing from the response cache (or changed since cached), with
+        CachedBatch of the cached records in between. The cached records of the IDs up to a
+        batch always come before it, so the checkpoints stay valid.
 
-        search_param = {}
-        if "search_param" in self.resource[self.entity]:
-            search_param = self.resource[self.entity]["search_param"]
+        :param parent_rows: iterable of (ID, parent state value)
+        :param parent_dates: (dict) - filled with the parent state value of each ID to fetch
+        :return: generator of URIs and CachedBatch
+        """
+        batch_size = Context.get_int_config("dependent_batch_size", 200)
+        max_length = Context.get_int_config("dependent_url_max_length", 2000)
+
+        hits = CachedBatch()
+        misses = []
+        for object_id, obj_date in parent_rows:
+            record = Context.response_cache.get(self.entity, object_id, obj_date)
+            if record is not None:
+                hits.append(record)
+                if len(hits) >= batch_size:
+                    yield hits
+                    hits = CachedBatch()
+                continue
+
+            misses.append(object_id)
+            parent_dates[object_id] = obj_date
+            if len(misses) >= batch_size:
+                if hits:
+                    yield hits
+                    hits = CachedBatch()
+                for ids in pack_ids(misses, batch_size, max_length):
+                    yield uri_prefix + ids
+                misses = []
+
+        if hits:
+            yield hits
+        for ids in pack_ids(misses, batch_size, max_length):
+            yield uri_prefix + ids
+
+    def cache_records(self, url, data, parent_dates):
+        """
+        Store the records of a fetched batch in the response cache.
+        """
+        cache_id = self.resource[self.entity]["cache_id"]
+        if isinstance(data, list):
+            Context.response_cache.put_many(self.entity, (
+                (record[cache_id], parent_dates.get(record[cache_id]), record)
+                for record in data if isinstance(record, dict) and record.get(cache_id) is not None))
+        for first, last in parse_ranges(url):
+            for object_id in range(first, last + 1):
+                parent_dates.pop(object_id, None)
+
+    def search_parent_ids(self, since, first_result=1, lastResult=None):
+        """
+        (ID, state filter value) rows of the parent search endpoint, page by page.
 
-        if "depending_on" in self.resource[self.entity]:
-            get_urls = self.get_uris(first_result, lastResult, discovery)
-
-            for url in get_urls["getUris"]:
-                # getting values from url only
-                # /product/1,2,4-8
-                values = url.split("/")[2]
-                if "url_extension" in self.resource[self.entity]:
-                    build_url_path = url_path + values + self.resource[self.entity]["url_extension"]
-                else:
-                    build_url_path = url_path+"/"+values
+        :param since: state value to search from, "" for every row
+        :return: generator of tuples
+        """
+        resource = self.resource[self.entity]
+        state_filter_field = resource.get("depending_on_incremental_state_filter")
+        id_field = resource.get("depending_on_incremental_id")
+
+        search_params = {}
+        if state_filter_field and since:
+            search_params[state_filter_field] = f"{since}/"
+        if id_field and state_filter_field:
+            search_params["columns"] = f"{id_field},{state_filter_field}"
+        if id_field:
+            # the checkpoints of the dependent stream need the IDs in ascending order
+            search_params["sort"] = f"{id_field}|ASC"
+
+        while True:
+            data = self.fetch_search_page(resource["depending_on_incremental"], first_result, search_params,
+                                          stream=self.stream_results(resource["depending_on_incremental"]),
+                                          lastResult=lastResult)
+
+            metadata = data["metaData"]
+            col_names = [col["name"] for col in metadata["columns"]]
+            index_state_field = col_names.index(state_filter_field) if state_filter_field in col_names else None
+            index_id_field = col_names.index(id_field) if id_field in col_names else 0
+
+            for d in data["results"]:
+                yield d[index_id_field], d[index_state_field] if index_state_field is not None else None
+
+            if metadata["morePagesAvailable"]:
+                first_result = metadata["lastResult"] + 1
+            else:
+                break
+
+    @classmethod
+    def parent_groups(cls, stream_names):
+        """
+        Dependent streams by parent endpoint, with the bookmark each one would read it from.
+
+        :return: (dict) - parent key: {stream name: state value}
+        """
+        groups = {}
+        for stream_name in stream_names:
+            resource = cls.resource.get(stream_name, {})
+            if "depending_on" not in resource:
+                continue
+            if "depending_on_incremental" in resource:
+                state_filter_field = resource.get("depending_on_incremental_state_filter")
+                key = "{} ({}, {})".format(resource["depending_on_incremental"],
+                                           resource.get("depending_on_incremental_id"), state_filter_field)
+                since = Context.get_state_value(stream_name, state_filter_field) if state_filter_field else ""
+            else:
+                key = "OPTIONS " + resource["depending_on"]
+                since = ""
+            groups.setdefault(key, {})[stream_name] = since
+        return groups
+
+    @staticmethod
+    def skip_done_uris(uris, last_id):
+        """
+        Idset URIs without the IDs up to last_id.
+        """
+        for uri in uris:
+            ranges = [(max(first, last_id + 1), last) for first, last in parse_ranges(uri) if last > last_id]
+            if ranges:
+                yield uri.rstrip("/").rsplit("/", 1)[0] + "/" + format_ranges(ranges)
+
+    def get_checkpoint(self):
+        """
+        Checkpoint of an interrupted run of the stream, or a new one.
+
+        last_id: every ID up to it was emitted
+        since: when the run started; a record not updated after it does not need to be fetched again
+        """
+        checkpoint = Context.get_bookmark(self.entity).get("checkpoint")
+        if checkpoint:
+            logger.log_info("Resuming {} after ID {}".format(self.entity, checkpoint["last_id"]))
+            return dict(checkpoint)
+        return {"last_id": 0, "since": utils.strftime(utils.now())}
+
+    def is_partitioned_backfill(self):
+        """
+        Initial load of the stream split in time windows (config backfill_partition_days and start_date).
+        """
+        return bool(self.resource[self.entity].get("backfill_partitions")) and \
+            Context.get_int_config("backfill_partition_days", 0) > 0 and bool(Context.config.get("start_date"))
+
+    def get_backfill_checkpoint(self):
+        """
+        Checkpoint of an interrupted backfill of the stream, or a new one.
+
+        until: when the backfill started, the windows are cut up to it
+        done: start of the windows whose records were all emitted
+        last_updated_at: latest state filter value emitted so far
+        """
+        checkpoint = Context.get_bookmark(self.entity).get("checkpoint")
+        if checkpoint and "done" in checkpoint:
+            logger.log_info("Resuming backfill of {}, {} windows done".format(self.entity, len(checkpoint["done"])))
+            return {"until": checkpoint["until"], "done": list(checkpoint["done"]),
+                    "last_updated_at": checkpoint["last_updated_at"]}
+        return {"until": utils.strftime(utils.now()), "done": [], "last_updated_at": ""}
+
+    @staticmethod
+    def get_backfill_partitions(start_date, until, days):
+        """
+        (from, to) filter bounds of backfill_partition_days long windows between start_date and until.
+        The first window is open at the start and the last one at the end, so nothing older than
+        start_date or updated while the backfill runs is left out. Bounds are inclusive: a row right
+        on a bound can come twice.
+
+        :return: list of (from, to) strings
+        """
+        def bound(value):
+            return value.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+        start = utils.strptime_to_utc(start_date)
+        until = utils.strptime_to_utc(until)
+        bounds = [""]
+        while start < until:
+            bounds.append(bound(start))
+            start += timedelta(days=days)
+        bounds.append("")
+        return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+    def fetch_partitions(self, partitions, max_concurrency):
+        """
+        Search pages of the time windows, max_concurrency windows fetched at the same time.
+        The next page of a window is requested once its previous page was yielded, so the pages
+        of each window come in order. All the workers share the session request budget.
+
+        :param partitions: list of (from, to) filter bounds
+        :return: generator of (partition, page), and (partition, None) once the last page of
+                 the window was yielded
+        """
+        state_filter_field = self.resource[self.entity]["state_filter"]
+
+        def fetch(partition, first_result):
+            log_info("Processing {} window {}/{} from {}".format(self.entity, partition[0], partition[1], first_result))
+            # one page only, the windows are the read ahead
+            return next(self.get_data(first_result=first_result,
+                                      state_filter={state_filter_field: "{}/{}".format(*partition)},
+                                      prefetch=False))
+
+        pending = deque(partitions)
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            try:
+                while pending or in_flight:
+                    while pending and len(in_flight) < max_concurrency:
+                        partition = pending.popleft()
+                        in_flight.append((partition, executor.submit(fetch, partition, 1)))
+
+                    partition, future = in_flight.popleft()
+                    data = future.result()
+                    yield partition, data
+
+                    metadata = data["metaData"]
+                    if metadata["morePagesAvailable"]:
+                        in_flight.append((partition, executor.submit(fetch, partition, metadata["lastResult"] + 1)))
+                    else:
+                        yield partition, None
+            finally:
+                for _, future in in_flight:
+                    future.cancel()
+
+    def sync_partitions(self, state_filter_field):
+        """
+        Initial load of an incremental search stream, one bounded filter per time window.
+        Windows are fetched in parallel (config max_concurrency) and each one completed is recorded
+        in a Checkpoint, so an interrupted backfill only fetches the windows left.
+        """
+        checkpoint = self.get_backfill_checkpoint()
+        last_updated_at = checkpoint["last_updated_at"]
+        partitions = [partition for partition in self.get_backfill_partitions(
+                          Context.config["start_date"], checkpoint["until"],
+                          Context.get_int_config("backfill_partition_days", 0))
+                      if partition[0] not in checkpoint["done"]]
+        logger.log_info("Backfilling {} in {} windows".format(self.entity, len(partitions)))
+
+        with metrics.http_request_timer(self.entity):
+            for partition, data in self.fetch_partitions(partitions, Context.get_max_concurrency()):
+                if data is None:
+                    checkpoint["done"].append(partition[0])
+                    checkpoint["last_updated_at"] = last_updated_at
+                    yield Checkpoint(checkpoint, done=list(checkpoint["done"]))
+                    continue
+
+                index = column_index(col["name"] for col in data["metaData"]["columns"])
+                for obj in data["results"]:
+                    obj_data = Row(index, obj)
+                    obj_date = obj_data.get(state_filter_field)
+                    if obj_date and obj_date > last_updated_at:
+                        last_updated_at = obj_date
+                    yield obj_data
+
+        Context.set_state_value(self.entity, state_filter_field, last_updated_at)
+
+    @staticmethod
+    def stream_results(url_path):
+        """
+        Search pages can be parsed row by row as they arrive (config stream_search_results),
+        keeping memory flat whatever the page size.
+        """
+        return bool(Context.config.get("stream_search_results")) and url_path.endswith("-search")
 
-                log_info("Processing dependent URL:" + build_url_path)
-                data = Context.session.get_data(url_path=build_url_path,
+    def get_prefetch_pages(self, url_path):
+        """
+        Search pages fetched ahead of the rows being written (config search_prefetch_pages, a
+        number or {stream: number}). Default 1, 0 when the pages are streamed: read ahead pages
+        are held in memory.
+        """
+        pages = Context.config.get("search_prefetch_pages")
+        if isinstance(pages, dict):
+            pages = pages.get(self.entity)
+        if pages is None:
+            return 0 if self.stream_results(url_path) else 1
+        return max(0, int(pages))
+
+    def get_search_columns(self):
+        """
+        Columns to request from a search endpoint: the fields selected in the catalog plus the
+        key properties and the state filter. None when every field is selected.
+        """
+        selected_fields = Context.get_selected_fields(self.entity)
+        if selected_fields is None:
+            return None
+
+        catalog_entry = Context.get_catalog_entry(self.entity)
+        columns = list(selected_fields)
+        for column in catalog_entry.get("key_properties", []) + [self.resource[self.entity].get("state_filter")]:
+            if column and column not in columns:
+                columns.append(column)
+        return columns
+
+    def get_dependent_url_path(self, url):
+        url_path = self.resource[self.entity]['url_path']
+        # getting values from url only
+        # /product/1,2,4-8
+        values = url.split("/")[2]
+        if "url_extension" in self.resource[self.entity]:
+            return url_path + values + self.resource[self.entity]["url_extension"]
+        return url_path + "/" + values
+
+    def fetch_dependent(self, uris, max_concurrency, first_result, lastResult, search_param):
+        """
+        Fetch the dependent batches, up to max_concurrency of them in flight.
+        Results are yielded in the same order as the URIs, whatever order they complete in.
+        URIs are only read a bounded window ahead of the consumer. All the workers share the
+        session request budget. With the asyncio engine the batches are requests of its event
+        loop instead of threads, max_concurrency can then be in the hundreds.
+
+        :param uris: iterable of parent idset URIs, CachedBatch are passed through without request
+        :param max_concurrency: number of batches fetched in parallel
+        :return: generator of (URI, response)
+        """
+        def fetch(url):
+            if isinstance(url, CachedBatch):
+                return list(url)
+            build_url_path = self.get_dependent_url_path(url)
+            log_info("Processing dependent URL:" + build_url_path)
+            return Context.session.get_data(url_path=build_url_path,
+                                            firstResult=first_result,
+                                            lastResult=lastResult,
+                                            search_params=search_param)
+
+        def fetch_async(url):
+            if isinstance(url, CachedBatch):
+                future = Future()
+                future.set_result(list(url))
+                return future
+            build_url_path = self.get_dependent_url_path(url)
+            log_info("Processing dependent URL:" + build_url_path)
+            return Context.async_session.submit(url_path=build_url_path,
                                                 firstResult=first_result,
                                                 lastResult=lastResult,
                                                 search_params=search_param)
+
+        if Context.async_session is not None:
+            yield from self.fetch_in_order(uris, fetch_async, max_concurrency)
+            return
+
+        if max_concurrency <= 1:
+            for url in uris:
+                yield url, fetch(url)
+            return
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            yield from self.fetch_in_order(uris, lambda url: executor.submit(fetch, url), max_concurrency)
+
+    @staticmethod
+    def fetch_in_order(uris, submit, max_concurrency):
+        """
+        :param submit: (callable) - submit(url) returns the Future of the response
+        :return: generator of (URI, response)
+        """
+        pending = deque()
+        try:
+            for url in uris:
+                pending.append((url, submit(url)))
+                # keep a bounded window of batches ahead of the consumer
+                if len(pending) >= max_concurrency * 2:
+                    url, future = pending.popleft()
+                    yield url, future.result()
+
+            while pending:
+                url, future = pending.popleft()
+                yield url, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def get_data(self, first_result=1, discovery=False, state_filter={}, prefetch=True):
+        url_path = self.resource[self.entity]['url_path']
+
+        lastResult = 500 if discovery else None
+
+        search_param = dict(self.resource[self.entity].get("search_param", {}))
+
+        if "depending_on" in self.resource[self.entity]:
+            checkpoint = None if discovery else self.get_checkpoint()
+            get_urls = self.get_uris(first_result, lastResult, discovery, checkpoint)
+
+            max_concurrency = 1 if discovery else Context.get_max_concurrency()
+
+            previous_last_id = None
+            sampled = 0
+            for url, data in self.fetch_dependent(get_urls["getUris"], max_concurrency,
+                                                  first_result, lastResult, search_param):
+                if isinstance(url, CachedBatch):
+                    yield data
+                    continue
+
+                if "parent_dates" in get_urls:
+                    self.cache_records(url, data, get_urls["parent_dates"])
                 if data:
                     yield data
 
-                # run just for one batch to get the schema
+                # sample just enough records to get the schema
                 if discovery:
-                    break
+                    sampled += len(data) if isinstance(data, list) else 1
+                    if sampled >= Context.get_int_config("discovery_sample_records", 1000):
+                        break
+                    continue
+
+                # all the IDs up to the batch were emitted only while batches come in ID order
+                ranges = parse_ranges(url)
+                if checkpoint and ranges:
+                    if previous_last_id is None or ranges[0][0] > previous_last_id:
+                        previous_last_id = ranges[-1][1]
+                        checkpoint["last_id"] = max(checkpoint["last_id"], previous_last_id)
+                        yield Checkpoint(checkpoint)
+                    else:
+                        logger.log_info("IDs of {} are not sorted, no more checkpoints".format(self.entity))
+                        checkpoint = None
+
+            if not discovery:
+                # every batch was emitted
+                if "bookmark" in get_urls:
+                    Context.set_state_value(self.entity, *get_urls["bookmark"])
+                Context.clear_checkpoint(self.entity)
 
         else:
             if state_filter:
                 search_param.update(state_filter)
 
-            data = Context.session.get_data(url_path=url_path,
-                                            firstResult=first_result,
-                                            lastResult=lastResult,
-                                            search_params=search_param,
-                                            method=self.resource[self.entity].get("method","GET")
-                                            )
+            if not discovery and url_path.endswith("-search"):
+                columns = self.get_search_columns()
+                if columns:
+                    search_param["columns"] = ",".join(columns)
+
+            if not discovery and url_path.endswith("-search"):
+                prefetch_pages = self.get_prefetch_pages(url_path) if prefetch else 0
+                if prefetch_pages:
+                    # every page from first_result, the next ones fetched while this one is read
+                    yield from PagePrefetcher(lambda first: self.fetch_search_page(url_path, first, search_param),
+                                              first_result, max_pages=prefetch_pages,
+                                              max_rows=Context.get_int_config("search_prefetch_max_rows", 10000))
+                    return
+                data = self.fetch_search_page(url_path, first_result, search_param,
+                                              stream=self.stream_results(url_path))
+            else:
+                data = Context.session.get_data(url_path=url_path,
+                                                firstResult=first_result,
+                                                lastResult=lastResult,
+                                                search_params=search_param,
+                                                method=self.resource[self.entity].get("method","GET"),
+                                                stream=not discovery and self.stream_results(url_path)
+                                                )
             yield data
 
+    def get_idset_changes(self, uris):
+        """
+            The ranges of IDs added and deleted since the previous run, one URI per range.
+        :param uris: getUris of the OPTIONS response
+        :return: list of {"getUris": "/order/5-9", "change": "added"}
+        """
+        added, deleted = Context.idset_index.diff(self.entity, uris)
+        log_info("%s: %d ranges added, %d deleted since the previous run", self.entity, len(added), len(deleted))
+
+        prefix = "/{}/".format(self.resource[self.entity]["url_path"].rsplit("/", 1)[-1])
+        return [{"getUris": prefix + format_ranges([first_last]), "change": change}
+                for change, ranges in (("added", added), ("deleted", deleted))
+                for first_last in ranges]
+
     def get_schema(self):
         cols = {}
+        inference = SchemaInference()
         with metrics.http_request_timer(self.entity):
             # schema pre-defined
             if "schema" in self.resource[self.entity]:
@@ -271,25 +767,10 @@ class Stream():
                             cols[col["name"]] = {"type": ["null", data_type]}
                     else:
                         for d in data:
-                            for key in d:
-                                value = d[key]
-                                type = None
-
-                                if isinstance(value, str):
-                                    type = 'string'
-                                if isinstance(value, list):
-                                    type = 'string'
-                                if isinstance(value, dict):
-                                    type = 'object'
-                                if isinstance(value, int):
-                                    type = 'integer'
-                                if isinstance(value, bool):
-                                    type = 'boolean'
-
-                                if type is None:
-                                    type = 'string'
-
-                                cols[key] = {"type": ["null", type]}
+                            if isinstance(d, dict):
+                                inference.add(d)
+
+            cols.update(inference.properties())
 
         return cols
 
@@ -297,6 +778,8 @@ class Stream():
         firstResult = 1
         keep_going = True
         merge_col_names = False
+        # column index of the current search page
+        index = None
 
         state_filter={}
         state_filter_field=None
@@ -306,10 +789,17 @@ class Stream():
             last_updated_at = state_last_updated_at
             if state_last_updated_at:
                 state_filter[state_filter_field] = f"{state_last_updated_at}/"
+            elif self.is_partitioned_backfill():
+                yield from self.sync_partitions(state_filter_field)
+                return
 
         while True:
             with metrics.http_request_timer(self.entity):
                 for data in self.get_data(first_result=firstResult, state_filter=state_filter):
+                    if isinstance(data, Checkpoint):
+                        yield data
+                        continue
+
                     if "results" in data:
                         merge_col_names = True
                         objects = data["results"]
@@ -318,6 +808,8 @@ class Stream():
                         cols = []
                         for col in metadata["columns"]:
                             cols.append(col["name"])
+                        # shared by the rows of the page
+                        index = column_index(cols)
 
                         if metadata["morePagesAvailable"]:
                             firstResult = metadata["lastResult"] + 1
@@ -336,9 +828,12 @@ class Stream():
 
                     elif "getUris" in data:
                         merge_col_names = False
-                        objects = []
-                        for x in data["getUris"]:
-                            objects.append({"getUris": x})
+                        if Context.idset_index is not None:
+                            objects = self.get_idset_changes(data["getUris"])
+                        else:
+                            objects = []
+                            for x in data["getUris"]:
+                                objects.append({"getUris": x})
                         keep_going = False
 
                     else:
@@ -346,7 +841,7 @@ class Stream():
                         keep_going = False
 
                     for obj in objects:
-                        obj_data = dict(zip(cols, obj)) if merge_col_names else obj
+                        obj_data = Row(index, obj) if merge_col_names else obj
 
                         if state_filter_field:
                             obj_date = obj_data[state_filter_field] if obj_data[state_filter_field] else obj_data.get("createdOn", state_filter_field)
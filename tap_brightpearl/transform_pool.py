@@ -0,0 +1,117 @@
+import multiprocessing
+from collections import deque
+from time import perf_counter
+
+from singer import Transformer
+
+from tap_brightpearl.instrumentation import TRANSFORM, WRITE
+from tap_brightpearl.output import dumps, encode_record
+from tap_brightpearl.record_pipeline import RecordPipeline
+
+# RecordPipeline of every stream, in each worker process
+_pipelines = {}
+
+
+class TransformError(Exception):
+    """
+        Failure of a worker, raised again in the sync process. Exceptions like singer's
+        SchemaMismatch cannot be unpickled there, they would stop the pool from returning results.
+    """
+
+
+def _init_worker(catalog_entries):
+    transformer = Transformer()
+    for stream_id, catalog_entry in catalog_entries.items():
+        _pipelines[stream_id] = RecordPipeline(catalog_entry, transformer)
+
+
+def _encode_batch(stream_id, records, time_extracted, jsonl):
+    started = perf_counter()
+    pipeline = _pipelines[stream_id]
+    try:
+        if jsonl:
+            lines = [dumps(pipeline.transform(record)) + b"\n" for record in records]
+        else:
+            lines = [encode_record(stream_id, pipeline.transform(record), time_extracted)
+                     for record in records]
+    except Exception as exc:  # pylint: disable=broad-except
+        raise TransformError("{} on {}: {}".format(type(exc).__name__, stream_id, exc)) from None
+    return lines, perf_counter() - started
+
+
+class TransformPool(object):
+    """
+        Transformation and JSON encoding of the records in worker processes.
+
+        Records are sent in batches of `batch_records` per stream, each worker transforms a batch
+        with the stream's RecordPipeline and returns the encoded lines, written in the order the
+        batches were sent. Up to two batches per process are in the works, the next one waits for
+        the oldest to be written. flush() writes everything received so far, it must come before
+        any STATE message.
+
+        A record failing in a worker fails the sync with a TransformError, like it would in the
+        main process; a batch not back after `batch_timeout` seconds fails it too.
+    """
+
+    def __init__(self, writer, catalog_entries, processes, batch_records=500, stage_seconds=None,
+                 batch_timeout=600):
+        """
+        :param writer: (SingerWriter)
+        :param catalog_entries: (dict) - stream ID: catalog entry, of every stream sent to the pool
+        :param stage_seconds: (dict) - stream ID: {TRANSFORM: seconds, WRITE: seconds}, added to
+        :param batch_timeout: (int) - seconds a batch may take, a lost worker never answers
+        """
+        self.writer = writer
+        self.batch_records = max(1, batch_records)
+        self.batch_timeout = batch_timeout
+        self.max_pending = processes * 2
+        self.stage_seconds = stage_seconds if stage_seconds is not None else {}
+
+        self._batches = {}
+        self._pending = deque()
+        # spawned: the sync threads are running, forking them is not safe
+        self._pool = multiprocessing.get_context("spawn").Pool(processes, initializer=_init_worker,
+                                                               initargs=(catalog_entries,))
+
+    def add(self, stream_id, record, time_extracted):
+        """
+        :param time_extracted: (datetime) - the time of the first record is kept for the batch
+        """
+        batch = self._batches.get(stream_id)
+        if batch is None:
+            batch = self._batches[stream_id] = (self.writer.format_time_extracted(time_extracted), [])
+        batch[1].append(record)
+        if len(batch[1]) >= self.batch_records:
+            self._submit(stream_id)
+
+    def _submit(self, stream_id):
+        time_extracted, records = self._batches.pop(stream_id)
+        result = self._pool.apply_async(_encode_batch,
+                                        (stream_id, records, time_extracted, bool(self.writer.batch_dir)))
+        self._pending.append((stream_id, result))
+        while len(self._pending) > self.max_pending:
+            self._write_next()
+
+    def _write_next(self):
+        stream_id, result = self._pending.popleft()
+        try:
+            lines, transform_seconds = result.get(self.batch_timeout)
+        except multiprocessing.TimeoutError:
+            raise TransformError("Batch of {} not transformed after {}s".format(
+                stream_id, self.batch_timeout)) from None
+        started = perf_counter()
+        self.writer.write_encoded(stream_id, lines)
+        seconds = self.stage_seconds.get(stream_id)
+        if seconds is not None:
+            seconds[TRANSFORM] += transform_seconds
+            seconds[WRITE] += perf_counter() - started
+
+    def flush(self):
+        for stream_id in list(self._batches):
+            self._submit(stream_id)
+        while self._pending:
+            self._write_next()
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
@@ -0,0 +1,127 @@
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from tap_brightpearl.context import Context
+from tap_brightpearl.stream import Checkpoint, Stream
+
+
+class Interrupted(Exception):
+    pass
+
+
+def updated_on(object_id):
+    # half a day apart, never on a window bound
+    return (datetime(2020, 1, 1, 6) + timedelta(hours=12 * object_id)).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+class FakeSession(object):
+    """
+        goods-movement-search rows filtered on updatedOn "from/to", in pages of 7 rows whatever
+        the page size asked, failing after `fail_after` pages.
+    """
+
+    def __init__(self, rows=300, fail_after=None):
+        self.rows = [[object_id, updated_on(object_id)] for object_id in range(1, rows + 1)]
+        self.fail_after = fail_after
+        self.filters = []
+        self._lock = threading.Lock()
+
+    def get_data(self, url_path, firstResult=1, lastResult=None, method="GET", search_params={}, stream=False,
+                 page_size=None):
+        with self._lock:
+            if self.fail_after is not None and len(self.filters) >= self.fail_after:
+                raise Interrupted()
+            self.filters.append(search_params.get("updatedOn"))
+        low, _, high = search_params.get("updatedOn", "/").partition("/")
+        rows = [row for row in self.rows if (not low or row[1] >= low) and (not high or row[1] <= high)]
+        page = rows[firstResult - 1:firstResult - 1 + 7]
+        last_result = firstResult + len(page) - 1
+        return {"metaData": {"columns": [{"name": "goodsMovementId"}, {"name": "updatedOn"}],
+                             "lastResult": last_result, "morePagesAvailable": last_result < len(rows)},
+                "results": page}
+
+
+class TestBackfillPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = Context.config, Context.state, Context.session, Context.catalog, Context.stream_map
+        Context.config = {"start_date": "2020-01-01T00:00:00Z", "backfill_partition_days": 30,
+                          "max_concurrency": 3}
+        Context.state = {}
+        Context.catalog = {"streams": [{"tap_stream_id": "goods_movement", "schema": {"properties": {}},
+                                        "metadata": [{"breadcrumb": [], "metadata": {"selected": True}}]}]}
+        Context.stream_map = {}
+
+    def tearDown(self):
+        Context.config, Context.state, Context.session, Context.catalog, Context.stream_map = self.saved
+
+    def run_stream(self, session):
+        """
+            Rows emitted, bookmarking the checkpoints the way the sync does.
+        """
+        Context.session = session
+        emitted = []
+        try:
+            for data in Stream("goods_movement").sync():
+                if isinstance(data, Checkpoint):
+                    bookmark = Context.state.setdefault("bookmarks", {}).setdefault("goods_movement", {})
+                    bookmark["checkpoint"] = dict(data)
+                else:
+                    emitted.append((data["goodsMovementId"], data["updatedOn"]))
+        except Interrupted:
+            pass
+        return emitted
+
+    def test_partitions(self):
+        partitions = Stream.get_backfill_partitions("2020-01-01T00:00:00Z", "2020-03-15T00:00:00Z", 30)
+        self.assertEqual(partitions, [
+            ("", "2020-01-01T00:00:00+00:00"),
+            ("2020-01-01T00:00:00+00:00", "2020-01-31T00:00:00+00:00"),
+            ("2020-01-31T00:00:00+00:00", "2020-03-01T00:00:00+00:00"),
+            ("2020-03-01T00:00:00+00:00", ""),
+        ])
+
+    def test_every_row_once(self):
+        session = FakeSession()
+        emitted = self.run_stream(session)
+        self.assertEqual(sorted(emitted), [tuple(row) for row in session.rows])
+        self.assertEqual(len(emitted), len(set(emitted)))
+        # windows not the whole table
+        self.assertNotIn(None, session.filters)
+        self.assertEqual(Context.get_bookmark("goods_movement"), {"updatedOn": updated_on(300)})
+
+    def test_pages_of_a_window_in_order(self):
+        emitted = self.run_stream(FakeSession())
+        bounds = [low for low, _ in Stream.get_backfill_partitions(
+            Context.config["start_date"], "2021-01-01T00:00:00Z", 30)]
+        windows = {}
+        for object_id, value in emitted:
+            window = max(position for position, low in enumerate(bounds) if value >= low)
+            windows.setdefault(window, []).append(object_id)
+        self.assertGreater(len(windows), 3)
+        self.assertTrue(all(ids == sorted(ids) for ids in windows.values()))
+
+    def test_resume(self):
+        emitted = self.run_stream(FakeSession(fail_after=12))
+        done = Context.get_bookmark("goods_movement")["checkpoint"]["done"]
+        self.assertTrue(done)
+
+        session = FakeSession()
+        emitted += self.run_stream(session)
+        self.assertEqual(sorted(set(emitted)), [tuple(row) for row in session.rows])
+        # the windows done are not fetched again
+        for filter_value in session.filters:
+            self.assertNotIn(filter_value.partition("/")[0], done)
+        self.assertEqual(Context.get_bookmark("goods_movement"), {"updatedOn": updated_on(300)})
+
+    def test_incremental_run_not_partitioned(self):
+        Context.state = {"bookmarks": {"goods_movement": {"updatedOn": "2020-05-25T06:00:00.000000+0000"}}}
+        session = FakeSession()
+        emitted = self.run_stream(session)
+        self.assertEqual([object_id for object_id, _ in emitted], list(range(291, 301)))
+        self.assertEqual(set(session.filters), {"2020-05-25T06:00:00.000000+0000/"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+from tap_brightpearl.context import Context
+from tap_brightpearl.idset import IdSet
+from tap_brightpearl.stream import Checkpoint, Stream
+
+UPDATED_ON = "2021-01-01T00:00:00.000000+0000"
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeSession(object):
+    """
+        order-search rows and dependent order batches, failing after `fail_after` batches.
+    """
+
+    def __init__(self, order_ids, fail_after=None):
+        self.order_ids = order_ids
+        self.fail_after = fail_after
+        self.batches = []
+        self.searches = []
+
+    def get_data(self, url_path, firstResult=1, lastResult=None, method="GET", search_params={}, stream=False,
+                 page_size=None):
+        if url_path.endswith("-search"):
+            self.searches.append(dict(search_params))
+            ids = self.order_ids
+            if search_params.get("sort") == "orderId|ASC":
+                ids = sorted(ids)
+            page = ids[firstResult - 1:firstResult - 1 + (page_size or 500)]
+            last_result = firstResult + len(page) - 1
+            return {"metaData": {"columns": [{"name": "orderId"}, {"name": "updatedOn"}],
+                                 "lastResult": last_result, "morePagesAvailable": last_result < len(ids)},
+                    "results": [[object_id, UPDATED_ON] for object_id in page]}
+
+        if self.fail_after is not None and len(self.batches) >= self.fail_after:
+            raise Interrupted()
+        ids = list(IdSet.parse(url_path.split("?")[0]))
+        self.batches.append(ids)
+        return [{"id": object_id} for object_id in ids]
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = Context.config, Context.state, Context.session
+        Context.config = {"dependent_batch_size": 10, "results_per_page": 25}
+        Context.state = {}
+
+    def tearDown(self):
+        Context.config, Context.state, Context.session = self.saved
+
+    def run_stream(self, session):
+        """
+            IDs emitted, bookmarking the checkpoints the way the sync does.
+        """
+        Context.session = session
+        emitted = []
+        try:
+            for data in Stream("orders").get_data():
+                if isinstance(data, Checkpoint):
+                    bookmark = Context.state.setdefault("bookmarks", {}).setdefault("orders", {})
+                    bookmark["checkpoint"] = dict(data)
+                else:
+                    emitted.extend(record["id"] for record in data)
+        except Interrupted:
+            pass
+        return emitted
+
+    def test_parent_sorted_on_id(self):
+        session = FakeSession(list(range(1, 31)))
+        self.run_stream(session)
+        self.assertTrue(all(search["sort"] == "orderId|ASC" for search in session.searches))
+
+    def test_checkpoint_every_batch(self):
+        emitted = self.run_stream(FakeSession(list(range(1, 101)), fail_after=3))
+        self.assertEqual(emitted, list(range(1, 31)))
+        self.assertEqual(Context.get_bookmark("orders")["checkpoint"]["last_id"], 30)
+
+    def test_resume(self):
+        # the API hands the orders out of order, the search asks for them sorted
+        order_ids = list(range(100, 0, -1))
+        emitted = self.run_stream(FakeSession(order_ids, fail_after=4))
+        checkpoint = Context.get_bookmark("orders")["checkpoint"]
+        self.assertEqual(checkpoint["last_id"], 40)
+
+        session = FakeSession(order_ids)
+        emitted += self.run_stream(session)
+        self.assertEqual(sorted(emitted), list(range(1, 101)))
+        # nothing emitted by the interrupted run is fetched again
+        self.assertEqual(min(object_id for batch in session.batches for object_id in batch), 41)
+        # done, checkpoint dropped and bookmark moved
+        self.assertEqual(Context.get_bookmark("orders"), {"updatedOn": UPDATED_ON})
+
+    def test_resume_refetches_updated_ids(self):
+        self.run_stream(FakeSession(list(range(1, 101)), fail_after=2))
+        Context.state["bookmarks"]["orders"]["checkpoint"]["since"] = "2020-01-01T00:00:00.000000Z"
+        session = FakeSession(list(range(1, 101)))
+        emitted = self.run_stream(session)
+        # updated after the interrupted run started
+        self.assertEqual(emitted, list(range(1, 101)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tap_brightpearl import get_fingerprint_streams, write_deletes
+from tap_brightpearl.context import Context
+from tap_brightpearl.fingerprint_store import FingerprintStore
+from tap_brightpearl.output import SingerWriter
+
+ROWS = [{"id": 1, "name": "red"}, {"id": 2, "name": "green"}, {"id": 3, "name": "blue"}]
+
+
+class TestFingerprintStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "state", "fingerprints.db")
+        self.store = FingerprintStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def sync(self, rows, commit=True):
+        self.store.begin("brand")
+        changed = [row for row in rows if self.store.is_changed("brand", [row["id"]], row)]
+        deleted = [json.loads(key) for key in self.store.deleted_keys("brand")]
+        if commit:
+            self.store.commit("brand")
+        return changed, deleted
+
+    def test_first_run_emits_everything(self):
+        self.assertEqual(self.sync(ROWS), (ROWS, []))
+
+    def test_unchanged_rows_skipped(self):
+        self.sync(ROWS)
+        self.assertEqual(self.sync([dict(row) for row in ROWS]), ([], []))
+
+    def test_changes(self):
+        self.sync(ROWS)
+        rows = [{"id": 1, "name": "red"}, {"id": 2, "name": "lime"}, {"id": 4, "name": "black"}]
+        self.assertEqual(self.sync(rows), (rows[1:], [[3]]))
+        self.assertEqual(self.sync(rows), ([], []))
+
+    def test_kept_between_runs(self):
+        self.sync(ROWS)
+        self.store.close()
+        self.store = FingerprintStore(self.path)
+        self.assertEqual(self.sync(ROWS[:2]), ([], [[3]]))
+
+    def test_not_committed(self):
+        self.sync(ROWS)
+        changed = [{"id": 1, "name": "pink"}] + ROWS[1:2]
+        self.sync(changed, commit=False)
+        # a failed run emits the same rows again
+        self.assertEqual(self.sync(changed), (changed[:1], [[3]]))
+
+    def test_streams_apart(self):
+        self.sync(ROWS)
+        self.store.begin("collection")
+        self.assertTrue(self.store.is_changed("collection", [1], ROWS[0]))
+        self.assertEqual(self.store.deleted_keys("collection"), [])
+
+    def test_write_deletes(self):
+        saved = Context.counts
+        Context.counts = {"brand": 0}
+        try:
+            self.sync(ROWS)
+            self.store.begin("brand")
+            self.store.is_changed("brand", [1], ROWS[0])
+            out = io.BytesIO()
+            writer = SingerWriter(out)
+            write_deletes(writer, self.store, "brand", ["id"])
+            writer.close()
+        finally:
+            counts, Context.counts = Context.counts, saved
+        records = sorted((json.loads(line)["record"] for line in out.getvalue().splitlines()),
+                         key=lambda record: record["id"])
+        self.assertEqual([record["id"] for record in records], [2, 3])
+        self.assertTrue(all(set(record) == {"id", "_sdc_deleted_at"} for record in records))
+        self.assertEqual(counts["brand"], 2)
+
+
+class TestFingerprintStreams(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Context.config
+
+    def tearDown(self):
+        Context.config = self.config
+
+    def test_default_reference_streams(self):
+        Context.config = {}
+        streams = get_fingerprint_streams()
+        self.assertIn("warehouse", streams)
+        self.assertNotIn("order_note", streams)
+        self.assertNotIn("orders", streams)
+
+    def test_configured(self):
+        Context.config = {"fingerprint_streams": "order_note, brand"}
+        self.assertEqual(set(get_fingerprint_streams()), {"order_note", "brand"})
+        Context.config = {"fingerprint_streams": ["order_note"]}
+        self.assertEqual(set(get_fingerprint_streams()), {"order_note"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from tap_brightpearl.context import Context
+from tap_brightpearl.stream import Stream
+
+UPDATED_ON = "2021-01-01T00:00:00.000000+0000"
+
+
+class FakeSession(object):
+    """
+        order-search in pages of 10 rows whatever the page size asked.
+    """
+
+    def __init__(self, rows=1000):
+        self.rows = rows
+        self.pages = []
+
+    def get_data(self, url_path, firstResult=1, lastResult=None, method="GET", search_params={}, stream=False,
+                 page_size=None):
+        self.pages.append(firstResult)
+        last_result = min(self.rows, firstResult + 9)
+        return {"metaData": {"columns": [{"name": "orderId"}, {"name": "updatedOn"}],
+                             "lastResult": last_result, "morePagesAvailable": last_result < self.rows},
+                "results": [[object_id, UPDATED_ON] for object_id in range(firstResult, last_result + 1)]}
+
+
+class TestGetUris(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = Context.config, Context.state, Context.session
+        Context.config = {"dependent_batch_size": 25}
+        Context.state = {}
+        Context.session = FakeSession()
+
+    def tearDown(self):
+        Context.config, Context.state, Context.session = self.saved
+
+    def test_parent_paged_as_uris_are_read(self):
+        get_urls = Stream("orders").get_uris()
+        self.assertEqual(Context.session.pages, [])
+        uris = get_urls["getUris"]
+        self.assertEqual(next(uris), "/order/1-25")
+        self.assertEqual(Context.session.pages, [1, 11, 21])
+        self.assertNotIn("bookmark", get_urls)
+
+        remaining = list(uris)
+        self.assertEqual(len(remaining), 39)
+        self.assertEqual(remaining[-1], "/order/976-1000")
+        self.assertEqual(len(Context.session.pages), 100)
+        # known once every URI was read
+        self.assertEqual(get_urls["bookmark"], ("updatedOn", UPDATED_ON))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from tap_brightpearl.idset import IdSet, format_ranges, pack_ids, parse_ranges
+
+
+class TestRanges(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(parse_ranges("1,3,5-9"), [(1, 1), (3, 3), (5, 9)])
+        self.assertEqual(parse_ranges("/order/1-200"), [(1, 200)])
+        self.assertEqual(parse_ranges("/order/7/"), [(7, 7)])
+
+    def test_parse_empty(self):
+        self.assertEqual(parse_ranges(""), [])
+        self.assertEqual(parse_ranges("1,,2"), [(1, 1), (2, 2)])
+
+    def test_format(self):
+        self.assertEqual(format_ranges([(1, 1), (3, 3), (5, 9)]), "1,3,5-9")
+        self.assertEqual(format_ranges([]), "")
+
+    def test_round_trip(self):
+        for value in ("1", "1-2", "1,3,5-9,11,13-15", "100-100000"):
+            self.assertEqual(format_ranges(parse_ranges(value)), value)
+
+
+class TestIdSet(unittest.TestCase):
+
+    def test_single_and_adjacent(self):
+        self.assertEqual(IdSet([5]).format(), "5")
+        self.assertEqual(IdSet([5, 6]).format(), "5-6")
+        # adjacent ranges merge, duplicates and order do not matter
+        self.assertEqual(IdSet([9, 1, 2, 3, 3, 4, 5, 8, 7, 6]).format(), "1-9")
+        self.assertEqual(IdSet([1, 3, 5, 6, 7]).format(), "1,3,5-7")
+
+    def test_empty(self):
+        self.assertEqual(len(IdSet()), 0)
+        self.assertEqual(IdSet().format(), "")
+
+    def test_parse(self):
+        id_set = IdSet.parse("/order/1,3,5-9")
+        self.assertEqual(list(id_set), [1, 3, 5, 6, 7, 8, 9])
+        self.assertIn("7", id_set)
+
+
+class TestPackIds(unittest.TestCase):
+
+    def test_max_objects(self):
+        chunks = list(pack_ids(range(1, 451), max_objects=200))
+        self.assertEqual(chunks, ["1-200", "201-400", "401-450"])
+
+    def test_duplicates_and_order(self):
+        self.assertEqual(list(pack_ids([3, 1, 2, 2, "3", 10])), ["1-3,10"])
+
+    def test_empty(self):
+        self.assertEqual(list(pack_ids([])), [])
+
+    def test_max_length(self):
+        ids = range(1000000, 1000400, 2)
+        chunks = list(pack_ids(ids, max_objects=1000, max_length=100))
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        self.assertEqual([object_id for chunk in chunks for object_id in IdSet.parse(chunk)], list(ids))
+
+    def test_dense_ids_fit_past_raw_length(self):
+        # 300 consecutive IDs are far over 100 characters raw, but one range once compressed
+        self.assertEqual(list(pack_ids(range(1000, 1300), max_objects=1000, max_length=100)), ["1000-1299"])
+
+
+if __name__ == "__main__":
+    unittest.main()
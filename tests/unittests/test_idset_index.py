@@ -0,0 +1,88 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tap_brightpearl.idset import IdSet, pack_ids
+from tap_brightpearl.idset_index import IdSetIndex, merge_ranges, pairs, subtract
+
+
+def ids_of(ranges):
+    return {object_id for first, last in ranges for object_id in range(first, last + 1)}
+
+
+def uris_of(ids):
+    return ["/order/" + chunk for chunk in pack_ids(sorted(ids), max_objects=50)]
+
+
+class TestRanges(unittest.TestCase):
+
+    def test_merge(self):
+        merged = merge_ranges([(5, 9), (1, 1), (2, 3), (10, 10), (20, 30), (25, 26)])
+        self.assertEqual(list(pairs(merged)), [(1, 3), (5, 10), (20, 30)])
+        self.assertEqual(list(pairs(merge_ranges([]))), [])
+
+    def test_subtract(self):
+        self.assertEqual(list(subtract([(1, 10)], [(3, 4), (6, 6)])), [(1, 2), (5, 5), (7, 10)])
+        self.assertEqual(list(subtract([(1, 3), (5, 7)], [(2, 6)])), [(1, 1), (7, 7)])
+        self.assertEqual(list(subtract([(1, 3)], [])), [(1, 3)])
+        self.assertEqual(list(subtract([], [(1, 3)])), [])
+        self.assertEqual(list(subtract([(1, 3)], [(0, 5)])), [])
+
+
+class TestIdSetIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = IdSetIndex(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def sync(self, uris):
+        added, deleted = self.index.diff("order_idset", uris)
+        self.index.commit("order_idset")
+        return added, deleted
+
+    def test_first_run_adds_everything(self):
+        added, deleted = self.sync(["/order/1-200", "/order/201-400", "/order/405"])
+        self.assertEqual(added, [(1, 400), (405, 405)])
+        self.assertEqual(deleted, [])
+
+    def test_no_change(self):
+        self.sync(["/order/1-200", "/order/301"])
+        self.assertEqual(self.sync(["/order/1-200", "/order/301"]), ([], []))
+
+    def test_single_ids_and_adjacent_ranges(self):
+        self.sync(["/order/1-10"])
+        added, deleted = self.sync(["/order/1-4,6-10,11", "/order/13"])
+        self.assertEqual(added, [(11, 11), (13, 13)])
+        self.assertEqual(deleted, [(5, 5)])
+
+    def test_empty_sets(self):
+        self.assertEqual(self.sync([]), ([], []))
+        self.assertEqual(self.sync(["/order/3-5"]), ([(3, 5)], []))
+        self.assertEqual(self.sync([]), ([], [(3, 5)]))
+
+    def test_not_committed(self):
+        self.sync(["/order/1-10"])
+        self.index.diff("order_idset", ["/order/1-5"])
+        # an interrupted run: same changes the next time
+        self.assertEqual(self.sync(["/order/1-5"]), ([], [(6, 10)]))
+        self.assertFalse(os.path.exists(self.index.get_file("order_idset") + ".new"))
+
+    def test_random_sets(self):
+        generator = random.Random(0)
+        previous = set()
+        for _ in range(50):
+            current = set(generator.sample(range(1, 500), generator.randint(0, 300)))
+            added, deleted = self.sync(uris_of(current))
+            self.assertEqual(ids_of(added), current - previous)
+            self.assertEqual(ids_of(deleted), previous - current)
+            self.assertEqual(ids_of(added) | set(IdSet(previous)) - ids_of(deleted), current)
+            previous = current
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import unittest
+
+from tap_brightpearl.json_stream import parse_search_response
+
+
+class FakeResponse(object):
+    def __init__(self, chunks, encoding="utf-8"):
+        self.chunks = chunks
+        self.encoding = encoding
+        self.closed = 0
+
+    def iter_content(self, chunk_size=1):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed += 1
+
+
+def split(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+PAGE = {
+    "response": {
+        "metaData": {"morePagesAvailable": True, "lastResult": 3,
+                     "columns": [{"name": "id"}, {"name": "name"}, {"name": "price"}]},
+        "results": [[1, "Café \"crème\"", 1.5], [2, "naïve, [x]", -20], [3, None, 12345678901234]],
+    },
+    "reference": {"1": "x"},
+}
+
+
+class TestParseSearchResponse(unittest.TestCase):
+
+    def parse(self, page, size):
+        body = json.dumps(page, ensure_ascii=False).encode("utf-8")
+        closed = []
+        response = FakeResponse(split(body, size))
+        data = parse_search_response(response, on_close=lambda: closed.append(True))
+        return response, data, closed
+
+    def test_chunks_split_anywhere(self):
+        # every chunk size, so numbers, strings, escapes and multi byte characters get cut
+        for size in range(1, 40):
+            response, data, closed = self.parse(PAGE, size)
+            self.assertEqual(data["metaData"], PAGE["response"]["metaData"])
+            self.assertEqual(list(data["results"]), PAGE["response"]["results"])
+            self.assertEqual(response.closed, 1)
+            self.assertEqual(closed, [True])
+
+    def test_rows_are_lazy(self):
+        response, data, closed = self.parse(PAGE, 1)
+        rows = data["results"]
+        self.assertEqual(next(rows), [1, "Café \"crème\"", 1.5])
+        self.assertEqual(response.closed, 0)
+        self.assertEqual(closed, [])
+        list(rows)
+        self.assertEqual(response.closed, 1)
+
+    def test_metadata_after_results(self):
+        page = {"response": {"results": PAGE["response"]["results"], "metaData": PAGE["response"]["metaData"]}}
+        for size in (1, 7, 1000):
+            _, data, _ = self.parse(page, size)
+            rows = list(data["results"])
+            self.assertEqual(rows, page["response"]["results"])
+            self.assertEqual(data["metaData"], page["response"]["metaData"])
+
+    def test_empty_results(self):
+        page = {"response": {"metaData": {"morePagesAvailable": False}, "results": []}}
+        _, data, closed = self.parse(page, 3)
+        self.assertEqual(list(data["results"]), [])
+        self.assertEqual(closed, [True])
+
+    def test_response_not_an_object(self):
+        # CMNC-404 and the like
+        response, data, closed = self.parse({"response": []}, 2)
+        self.assertEqual(data, [])
+        self.assertEqual(response.closed, 1)
+        self.assertEqual(closed, [True])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import datetime
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import unittest
+
+import pytz
+
+from tap_brightpearl.output import SingerWriter, encode_record
+
+
+class CountingBuffer(io.BytesIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return super().write(data)
+
+
+def messages(out):
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+class TestSingerWriter(unittest.TestCase):
+
+    def test_records_buffered(self):
+        out = CountingBuffer()
+        writer = SingerWriter(out, buffer_records=10)
+        for object_id in range(25):
+            writer.write_record("orders", {"id": object_id})
+        self.assertEqual(out.writes, 2)
+        writer.close()
+        self.assertEqual(out.writes, 3)
+        self.assertEqual([message["record"]["id"] for message in messages(out)], list(range(25)))
+
+    def test_order_kept(self):
+        out = io.BytesIO()
+        writer = SingerWriter(out, buffer_records=100)
+        writer.write_schema("orders", {"type": "object"}, "id")
+        writer.write_record("orders", {"id": 1})
+        writer.write_state({"bookmarks": {"orders": 1}})
+        writer.write_record("orders", {"id": 2})
+        writer.close()
+        self.assertEqual([message["type"] for message in messages(out)], ["SCHEMA", "RECORD", "STATE", "RECORD"])
+        self.assertEqual(messages(out)[0]["key_properties"], ["id"])
+
+    def test_same_as_singer(self):
+        time_extracted = datetime.datetime(2021, 1, 2, 3, 4, 5, tzinfo=pytz.utc)
+        out = io.BytesIO()
+        writer = SingerWriter(out)
+        writer.write_record("orders", {"id": 1, "name": "é"}, time_extracted=time_extracted)
+        writer.close()
+        self.assertEqual(messages(out), [{"type": "RECORD", "stream": "orders",
+                                          "record": {"id": 1, "name": "é"},
+                                          "time_extracted": "2021-01-02T03:04:05.000000Z"}])
+
+    def test_write_encoded(self):
+        out = io.BytesIO()
+        writer = SingerWriter(out)
+        writer.write_encoded("orders", [encode_record("orders", {"id": 1}), encode_record("orders", {"id": 2})])
+        writer.close()
+        self.assertEqual([message["record"] for message in messages(out)], [{"id": 1}, {"id": 2}])
+
+
+class TestBatchOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_batch(self, message):
+        path = message["manifest"][0][len("file://"):]
+        with gzip.open(path, "rb") as batch_file:
+            return [json.loads(line) for line in batch_file]
+
+    def test_batch_files(self):
+        out = io.BytesIO()
+        writer = SingerWriter(out, batch_dir=self.directory, batch_max_records=10)
+        for object_id in range(25):
+            writer.write_record("orders", {"id": object_id})
+        writer.write_record("products", {"id": 1})
+        writer.write_state({"bookmarks": {}})
+        writer.close()
+
+        written = messages(out)
+        self.assertEqual([message["type"] for message in written], ["BATCH"] * 4 + ["STATE"])
+        batches = {}
+        for message in written[:-1]:
+            self.assertEqual(message["encoding"], {"format": "jsonl", "compression": "gzip"})
+            batches.setdefault(message["stream"], []).extend(self.read_batch(message))
+        self.assertEqual(batches, {"orders": [{"id": object_id} for object_id in range(25)],
+                                   "products": [{"id": 1}]})
+
+    def test_batch_closed_before_state(self):
+        out = io.BytesIO()
+        writer = SingerWriter(out, batch_dir=self.directory)
+        writer.write_record("orders", {"id": 1})
+        writer.write_state({"bookmarks": {}})
+        writer.write_record("orders", {"id": 2})
+        writer.close()
+        written = messages(out)
+        self.assertEqual([message["type"] for message in written], ["BATCH", "STATE", "BATCH"])
+        self.assertEqual(self.read_batch(written[0]), [{"id": 1}])
+        self.assertEqual(self.read_batch(written[2]), [{"id": 2}])
+
+
+if __name__ == "__main__":
+    unittest.main()
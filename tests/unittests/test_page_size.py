@@ -0,0 +1,97 @@
+import unittest
+
+import requests
+
+from tap_brightpearl.brightpearl import ServerErrorException
+from tap_brightpearl.context import Context
+from tap_brightpearl.page_size import MAX_PAGE_SIZE, MIN_PAGE_SIZE, PageSizer
+from tap_brightpearl.stream import Stream
+
+
+class TestPageSizer(unittest.TestCase):
+
+    def test_bounds(self):
+        self.assertEqual(PageSizer(10).size, MIN_PAGE_SIZE)
+        self.assertEqual(PageSizer(10000).size, MAX_PAGE_SIZE)
+        self.assertEqual(PageSizer(200).size, 200)
+
+    def test_grows_while_fast(self):
+        page_sizer = PageSizer(200, target_latency=5)
+        self.assertTrue(page_sizer.observe(1))
+        self.assertEqual(page_sizer.size, 300)
+        self.assertTrue(page_sizer.observe(1))
+        self.assertEqual(page_sizer.size, 450)
+        self.assertTrue(page_sizer.observe(1))
+        self.assertEqual(page_sizer.size, MAX_PAGE_SIZE)
+        self.assertFalse(page_sizer.observe(1))
+
+    def test_kept_in_the_target(self):
+        page_sizer = PageSizer(200, target_latency=5)
+        self.assertFalse(page_sizer.observe(5))
+        self.assertFalse(page_sizer.observe(10))
+        self.assertEqual(page_sizer.size, 200)
+
+    def test_shrinks_when_slow(self):
+        page_sizer = PageSizer(400, target_latency=5)
+        self.assertTrue(page_sizer.observe(11))
+        self.assertEqual(page_sizer.size, 200)
+        for _ in range(5):
+            page_sizer.observe(60)
+        self.assertEqual(page_sizer.size, MIN_PAGE_SIZE)
+
+    def test_shrink_after_error(self):
+        page_sizer = PageSizer(200)
+        self.assertTrue(page_sizer.shrink())
+        self.assertEqual(page_sizer.size, 100)
+        self.assertTrue(page_sizer.shrink())
+        self.assertEqual(page_sizer.size, MIN_PAGE_SIZE)
+        self.assertFalse(page_sizer.shrink())
+
+
+class FakeSession(object):
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.page_sizes = []
+
+    def get_data(self, url_path, firstResult=1, lastResult=None, method="GET", search_params={}, stream=False,
+                 page_size=None):
+        self.page_sizes.append(page_size)
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"metaData": {}, "results": []}
+
+
+class TestSearchPageSize(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = Context.config, Context.state, Context.session
+        Context.config = {}
+        Context.state = {}
+
+    def tearDown(self):
+        Context.config, Context.state, Context.session = self.saved
+
+    def test_retried_smaller(self):
+        Context.session = FakeSession([requests.exceptions.Timeout(), ServerErrorException("503")])
+        Stream("contact").fetch_search_page("contact-service/contact-search", 1, {})
+        self.assertEqual(Context.session.page_sizes, [200, 100, 50])
+
+    def test_raised_at_the_minimum(self):
+        Context.state = {"page_sizes": {"contact": MIN_PAGE_SIZE}}
+        Context.session = FakeSession([requests.exceptions.Timeout()])
+        with self.assertRaises(requests.exceptions.Timeout):
+            Stream("contact").fetch_search_page("contact-service/contact-search", 1, {})
+
+    def test_learned_size_kept_in_state(self):
+        Context.session = FakeSession([])
+        stream = Stream("contact")
+        stream.fetch_search_page("contact-service/contact-search", 1, {})
+        self.assertEqual(Context.state["page_sizes"], {"contact": 300})
+        # the next run starts from it
+        Context.session = FakeSession([])
+        Stream("contact").fetch_search_page("contact-service/contact-search", 1, {})
+        self.assertEqual(Context.session.page_sizes, [300])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import random
+import threading
+import unittest
+
+from tap_brightpearl.parent_ids import SharedParentIds
+
+
+class TestSharedParentIds(unittest.TestCase):
+
+    def setUp(self):
+        self.fetched = []
+
+    def fetch(self, since):
+        self.fetched.append(since)
+        for object_id in range(1, 1001):
+            yield object_id, since
+
+    def test_alone_on_parent_not_shared(self):
+        parent_ids = SharedParentIds({"order-search": {"orders": ""}, "product-search": {"a": "", "b": ""}})
+        self.assertFalse(parent_ids.is_shared("orders"))
+        self.assertTrue(parent_ids.is_shared("a"))
+
+    def test_oldest_bookmark(self):
+        parent_ids = SharedParentIds({"k": {"a": "2021-06-01T00:00:00Z", "b": "2021-01-01T00:00:00Z"}})
+        self.assertEqual(parent_ids.get("a", self.fetch)[0], "2021-01-01T00:00:00Z")
+        parent_ids = SharedParentIds({"k": {"a": "2021-06-01T00:00:00Z", "b": ""}})
+        self.assertEqual(parent_ids.get("a", self.fetch)[0], "")
+
+    def test_sequential_read_once(self):
+        parent_ids = SharedParentIds({"k": {"a": "", "b": "", "c": ""}})
+        rows = [list(parent_ids.get(stream_name, self.fetch)[1]) for stream_name in "abc"]
+        self.assertEqual(len(rows[0]), 1000)
+        self.assertEqual(rows[0], rows[1])
+        self.assertEqual(rows[0], rows[2])
+        self.assertEqual(self.fetched, [""])
+        # nothing kept once every stream read it
+        self.assertEqual(len(parent_ids.groups["k"].rows), 0)
+
+    def test_rows_kept_until_every_stream_read_them(self):
+        parent_ids = SharedParentIds({"k": {"a": "", "b": ""}})
+        group = parent_ids.groups["k"]
+        a_rows = parent_ids.get("a", self.fetch)[1]
+        b_rows = parent_ids.get("b", self.fetch)[1]
+        for _ in range(10):
+            next(a_rows)
+        self.assertEqual(len(group.rows), 10)
+        for _ in range(4):
+            next(b_rows)
+        self.assertEqual(len(group.rows), 6)
+        self.assertEqual(group.rows[0], (5, ""))
+
+    def test_past_max_rows_streams_behind_read_again(self):
+        parent_ids = SharedParentIds({"k": {"a": "", "b": "", "c": ""}}, max_rows=100)
+        rows = [list(parent_ids.get(stream_name, self.fetch)[1]) for stream_name in "abc"]
+        self.assertTrue(all(len(stream_rows) == 1000 for stream_rows in rows))
+        self.assertEqual(rows[0], rows[2])
+        self.assertEqual(len(self.fetched), 3)
+
+    def test_stream_behind_skips_rows_already_read(self):
+        parent_ids = SharedParentIds({"k": {"a": "", "b": ""}}, max_rows=100)
+        a_rows = parent_ids.get("a", self.fetch)[1]
+        b_rows = parent_ids.get("b", self.fetch)[1]
+        b_read = [next(b_rows) for _ in range(30)]
+        a_read = list(a_rows)
+        b_read += list(b_rows)
+        self.assertEqual(a_read, b_read)
+        self.assertEqual(len(b_read), 1000)
+
+    def test_concurrent_streams(self):
+        generator = random.Random(0)
+        for max_rows in (10, 50, 5000):
+            parent_ids = SharedParentIds({"k": {"a": "", "b": "", "c": ""}}, max_rows=max_rows)
+            group = parent_ids.groups["k"]
+            results = {}
+            peak = [0]
+
+            def read(stream_name):
+                stream_rows = []
+                for row in parent_ids.get(stream_name, self.fetch)[1]:
+                    stream_rows.append(row)
+                    peak[0] = max(peak[0], len(group.rows))
+                    if generator.random() < 0.01:
+                        threading.Event().wait(0.001)
+                results[stream_name] = stream_rows
+
+            threads = [threading.Thread(target=read, args=(stream_name,)) for stream_name in "abc"]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertTrue(all(len(results[stream_name]) == 1000 for stream_name in "abc"))
+            self.assertEqual(results["a"], results["b"])
+            self.assertEqual(results["a"], results["c"])
+            self.assertLessEqual(peak[0], max_rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import threading
+import unittest
+
+from tap_brightpearl.prefetch import PagePrefetcher
+
+
+class FakeSearch(object):
+    """
+        Pages of `page_size` rows of a `rows` long search, failing at `fail_at` first result.
+    """
+
+    def __init__(self, rows=95, page_size=10, fail_at=None):
+        self.rows = rows
+        self.page_size = page_size
+        self.fail_at = fail_at
+        self.requested = []
+        self.fetched = threading.Condition()
+
+    def __call__(self, first_result):
+        with self.fetched:
+            self.requested.append(first_result)
+            self.fetched.notify_all()
+        if first_result == self.fail_at:
+            raise RuntimeError("page {} failed".format(first_result))
+        last_result = min(self.rows, first_result + self.page_size - 1)
+        return {"metaData": {"lastResult": last_result, "morePagesAvailable": last_result < self.rows},
+                "results": [[object_id] for object_id in range(first_result, last_result + 1)]}
+
+    def wait_requests(self, count):
+        with self.fetched:
+            return self.fetched.wait_for(lambda: len(self.requested) >= count, timeout=5)
+
+
+class TestPagePrefetcher(unittest.TestCase):
+
+    def test_every_page_in_order(self):
+        search = FakeSearch()
+        pages = list(PagePrefetcher(search, 1, max_pages=3))
+        self.assertEqual([row[0] for page in pages for row in page["results"]], list(range(1, 96)))
+        self.assertEqual(search.requested, list(range(1, 96, 10)))
+
+    def test_from_first_result(self):
+        search = FakeSearch()
+        pages = list(PagePrefetcher(search, 51))
+        self.assertEqual(pages[0]["results"][0], [51])
+        self.assertEqual(search.requested, [51, 61, 71, 81, 91])
+
+    def test_fetched_ahead_up_to_max_pages(self):
+        search = FakeSearch()
+        pages = iter(PagePrefetcher(search, 1, max_pages=2))
+        next(pages)
+        # the page being read and 2 ahead
+        self.assertTrue(search.wait_requests(3))
+        threading.Event().wait(0.1)
+        self.assertEqual(len(search.requested), 3)
+        next(pages)
+        self.assertTrue(search.wait_requests(4))
+        pages.close()
+
+    def test_max_rows(self):
+        search = FakeSearch()
+        pages = iter(PagePrefetcher(search, 1, max_pages=5, max_rows=15))
+        next(pages)
+        self.assertTrue(search.wait_requests(3))
+        threading.Event().wait(0.1)
+        # 20 rows waiting is above the ceiling, one page waiting is always allowed
+        self.assertEqual(len(search.requested), 3)
+        pages.close()
+
+    def test_single_page(self):
+        search = FakeSearch(rows=5)
+        self.assertEqual(len(list(PagePrefetcher(search, 1))), 1)
+        self.assertEqual(search.requested, [1])
+
+    def test_error_after_the_pages_before_it(self):
+        search = FakeSearch(fail_at=31)
+        read = []
+        with self.assertRaises(RuntimeError):
+            for page in PagePrefetcher(search, 1, max_pages=5):
+                read.append(page["metaData"]["lastResult"])
+        self.assertEqual(read, [10, 20, 30])
+
+    def test_close_stops_fetching(self):
+        search = FakeSearch(rows=10000)
+        pages = iter(PagePrefetcher(search, 1, max_pages=1))
+        next(pages)
+        pages.close()
+        threading.Event().wait(0.1)
+        count = len(search.requested)
+        threading.Event().wait(0.1)
+        self.assertEqual(len(search.requested), count)
+        self.assertLessEqual(count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
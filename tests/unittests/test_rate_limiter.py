@@ -0,0 +1,118 @@
+import threading
+import unittest
+from time import monotonic
+
+from tap_brightpearl.rate_limiter import RateLimiter
+
+
+def headers(remaining, period_ms):
+    return {"brightpearl-requests-remaining": str(remaining), "brightpearl-next-throttle-period": str(period_ms)}
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter(min_requests_remaining=5)
+
+    def test_no_wait_before_any_response(self):
+        for _ in range(10):
+            self.assertEqual(self.limiter.acquire(), 0)
+        self.assertEqual(self.limiter.in_flight, 10)
+        self.assertEqual(self.limiter.stats()["requests"], 10)
+
+    def test_release(self):
+        self.limiter.acquire()
+        self.limiter.release(headers(100, 60000))
+        self.assertEqual(self.limiter.in_flight, 0)
+        self.assertEqual(self.limiter.tokens, 100)
+
+        # no header, count the request ourselves
+        self.limiter.acquire()
+        self.limiter.release()
+        self.assertEqual(self.limiter.tokens, 99)
+
+    def test_waits_until_reset_when_out_of_tokens(self):
+        self.limiter.acquire()
+        self.limiter.release(headers(5, 200))
+        started = monotonic()
+        waited = self.limiter.acquire()
+        self.assertGreaterEqual(monotonic() - started, 0.15)
+        self.assertGreater(waited, 0)
+        stats = self.limiter.stats()
+        self.assertEqual(stats["throttle_waits"], 1)
+        self.assertGreater(stats["throttled_seconds"], 0)
+
+    def test_wakes_up_when_refreshed(self):
+        self.limiter.acquire()
+        self.limiter.release(headers(5, 60000))
+        timer = threading.Timer(0.1, self.limiter.update, args=(headers(200, 60000),))
+        timer.start()
+        started = monotonic()
+        self.limiter.acquire()
+        timer.join()
+        self.assertLess(monotonic() - started, 5)
+
+    def test_in_flight_requests_count(self):
+        self.limiter.acquire()
+        self.limiter.release(headers(8, 60000))
+        # 3 tokens above the floor, then only the window reset lets a request through
+        self.limiter.last_grant = 0
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        self.limiter.last_grant = 0
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        self.limiter.last_grant = 0
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        self.limiter.last_grant = 0
+        self.assertGreater(self.limiter.try_acquire(), 50)
+
+    def test_pacing(self):
+        self.limiter.acquire()
+        self.limiter.release(headers(15, 1000))
+        # 10 tokens above the floor over one second, 1 of them in flight: about 0.11s apart
+        self.limiter.last_grant = 0
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        wait = self.limiter.try_acquire()
+        self.assertGreater(wait, 0.08)
+        self.assertLessEqual(wait, 1 / 9)
+
+    def test_try_acquire(self):
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        self.limiter.release(headers(5, 60000))
+        wait = self.limiter.try_acquire()
+        self.assertGreater(wait, 50)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+        self.limiter.update(headers(100, 60000))
+        self.limiter.last_grant = 0
+        self.assertEqual(self.limiter.try_acquire(wait), 0)
+        self.assertEqual(self.limiter.in_flight, 1)
+        self.assertEqual(self.limiter.stats()["throttle_waits"], 1)
+
+    def test_window_over(self):
+        self.limiter.acquire()
+        self.limiter.release(headers(0, 1))
+        threading.Event().wait(0.01)
+        self.assertEqual(self.limiter.try_acquire(), 0)
+        self.assertIsNone(self.limiter.tokens)
+
+    def test_backoff(self):
+        self.limiter.backoff(headers(0, 300), 0)
+        self.assertEqual(self.limiter.tokens, 0)
+        self.assertEqual(self.limiter.stats()["retries"], 1)
+        wait = self.limiter.try_acquire()
+        self.assertGreater(wait, 0.2)
+        self.assertLessEqual(wait, 0.3)
+        started = monotonic()
+        self.limiter.acquire()
+        self.assertGreaterEqual(monotonic() - started, 0.2)
+
+    def test_backoff_without_header(self):
+        self.limiter.max_backoff = 3
+        self.limiter.backoff(None, 1)
+        self.assertGreater(self.limiter.try_acquire(), 1.5)
+        self.limiter.backoff(None, 10)
+        self.assertLessEqual(self.limiter.try_acquire(), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
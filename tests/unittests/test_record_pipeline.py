@@ -0,0 +1,100 @@
+import unittest
+
+from singer import metadata
+from singer.transform import SchemaMismatch, Transformer
+
+from tap_brightpearl.record_pipeline import RecordPipeline
+from tap_brightpearl.row import Row, column_index
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": ["integer"]},
+        "name": {"type": ["null", "string"]},
+        "price": {"type": ["null", "number"]},
+        "quantity": {"type": ["null", "integer"]},
+        "active": {"type": ["null", "boolean"]},
+        "updatedOn": {"type": ["null", "string"], "format": "date-time"},
+        "tags": {"type": ["null", "array"], "items": {"type": ["null", "string"]}},
+        "address": {"type": ["null", "object"], "properties": {"city": {"type": ["null", "string"]}}},
+        "code": {"anyOf": [{"type": "integer"}, {"type": "string"}]},
+        "hidden": {"type": ["null", "string"]},
+    },
+}
+
+RECORDS = [
+    {"id": 1, "name": "a", "price": 1.5, "quantity": 3, "active": True, "updatedOn": "2021-01-01T10:00:00+10:00",
+     "tags": ["x", "y"], "address": {"city": "Sydney", "extra": 1}, "code": 7, "hidden": "h"},
+    # values needing a conversion
+    {"id": "2", "name": 12, "price": 3, "quantity": "4", "active": "true", "updatedOn": "2021-02-01",
+     "tags": [], "address": {}, "code": "A1"},
+    # nulls and missing fields
+    {"id": 3, "name": None, "price": None, "quantity": None, "active": None, "updatedOn": None,
+     "tags": None, "address": None},
+    {"id": 4, "unknown": "dropped"},
+    {"id": 5, "price": 1e20, "quantity": 0, "active": False, "name": ""},
+]
+
+
+def catalog_entry(deselected=("hidden",)):
+    mdata = metadata.write({}, (), "selected", True)
+    for field in SCHEMA["properties"]:
+        inclusion = "automatic" if field == "id" else "available"
+        mdata = metadata.write(mdata, ("properties", field), "inclusion", inclusion)
+    for field in deselected:
+        mdata = metadata.write(mdata, ("properties", field), "selected", False)
+    return {"tap_stream_id": "products", "schema": SCHEMA, "metadata": metadata.to_list(mdata)}
+
+
+class TestRecordPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.entry = catalog_entry()
+        self.transformer = Transformer()
+        self.pipeline = RecordPipeline(self.entry, self.transformer)
+
+    def expected(self, record):
+        return Transformer().transform(dict(record), self.entry["schema"], metadata.to_map(self.entry["metadata"]))
+
+    def test_same_as_transformer(self):
+        for record in RECORDS:
+            self.assertEqual(self.pipeline.transform(record), self.expected(record))
+
+    def test_same_types_as_transformer(self):
+        for record in RECORDS:
+            expected = self.expected(record)
+            result = self.pipeline.transform(record)
+            self.assertEqual({field: type(value) for field, value in result.items()},
+                             {field: type(value) for field, value in expected.items()})
+
+    def test_unselected_fields(self):
+        self.assertNotIn("hidden", self.pipeline.selected_fields)
+        self.assertIn("id", self.pipeline.selected_fields)
+        self.assertNotIn("hidden", self.pipeline.transform(RECORDS[0]))
+
+    def test_rows(self):
+        for record in RECORDS:
+            columns = list(record) + ["trailing"]
+            # rows may be shorter than the columns of their page
+            row = Row(column_index(columns), list(record.values()))
+            self.assertEqual(self.pipeline.transform(row), self.expected(record))
+
+    def test_record_not_changed(self):
+        record = dict(RECORDS[1])
+        self.pipeline.transform(record)
+        self.assertEqual(record, RECORDS[1])
+
+    def test_schema_mismatch(self):
+        with self.assertRaises(SchemaMismatch):
+            self.pipeline.transform({"id": "not a number"})
+
+    def test_extraction_time_refreshed(self):
+        pipeline = RecordPipeline(self.entry, self.transformer, extraction_time_refresh=3600)
+        self.assertIs(pipeline.extraction_time(), pipeline.extraction_time())
+        pipeline = RecordPipeline(self.entry, self.transformer, extraction_time_refresh=0)
+        first = pipeline.extraction_time()
+        self.assertIsNot(first, pipeline.extraction_time())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from tap_brightpearl.context import Context
+from tap_brightpearl.idset import IdSet
+from tap_brightpearl.response_cache import ResponseCache
+from tap_brightpearl.stream import Checkpoint, Stream
+
+UPDATED_ON = "2021-01-01T00:00:00.000000+0000"
+LATER = "2021-02-01T00:00:00.000000+0000"
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cache", "responses.db")
+        self.cache = ResponseCache(self.path)
+
+    def tearDown(self):
+        self.cache.connection.close()
+        shutil.rmtree(self.directory)
+
+    def test_hit(self):
+        self.cache.put_many("product_price", [(1, UPDATED_ON, {"productId": 1, "price": 2.5})])
+        self.assertEqual(self.cache.get("product_price", 1, UPDATED_ON), {"productId": 1, "price": 2.5})
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 0))
+
+    def test_miss(self):
+        self.cache.put_many("product_price", [(1, UPDATED_ON, {"productId": 1})])
+        # unknown, parent changed since, no parent state value, other stream
+        self.assertIsNone(self.cache.get("product_price", 2, UPDATED_ON))
+        self.assertIsNone(self.cache.get("product_price", 1, LATER))
+        self.assertIsNone(self.cache.get("product_price", 1, None))
+        self.assertIsNone(self.cache.get("product_with_custom", 1, UPDATED_ON))
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 4))
+
+    def test_refreshed(self):
+        self.cache.put_many("product_price", [(1, UPDATED_ON, {"price": 1})])
+        self.cache.put_many("product_price", [(1, LATER, {"price": 2})])
+        self.assertIsNone(self.cache.get("product_price", 1, UPDATED_ON))
+        self.assertEqual(self.cache.get("product_price", 1, LATER), {"price": 2})
+
+    def test_without_parent_state_not_cached(self):
+        self.cache.put_many("product_price", [(1, None, {"price": 1})])
+        self.assertEqual(self.cache.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0], 0)
+
+    def test_kept_between_runs(self):
+        self.cache.put_many("product_price", [(1, UPDATED_ON, {"price": 1})])
+        self.cache.close()
+        self.cache = ResponseCache(self.path)
+        self.assertEqual(self.cache.get("product_price", 1, UPDATED_ON), {"price": 1})
+
+    def test_evict_old(self):
+        self.cache.put_many("product_price", [(1, UPDATED_ON, {}), (2, UPDATED_ON, {})])
+        self.cache.connection.execute("UPDATE responses SET used_at = ? WHERE id = 1", (time.time() - 40 * 86400,))
+        self.cache.evict()
+        self.assertIsNone(self.cache.get("product_price", 1, UPDATED_ON))
+        self.assertEqual(self.cache.get("product_price", 2, UPDATED_ON), {})
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_entries = 2
+        self.cache.put_many("product_price", [(object_id, UPDATED_ON, {}) for object_id in (1, 2, 3)])
+        self.cache.connection.execute("UPDATE responses SET used_at = used_at - 10")
+        # used since, kept
+        self.cache.get("product_price", 1, UPDATED_ON)
+        self.cache.connection.execute("UPDATE responses SET used_at = used_at - 1 WHERE id = 2")
+        self.cache.evict()
+        ids = [row[0] for row in self.cache.connection.execute("SELECT id FROM responses ORDER BY id")]
+        self.assertEqual(ids, [1, 3])
+
+
+class FakeSession(object):
+    """
+        product-search rows and product-price batches.
+    """
+
+    def __init__(self, products):
+        self.products = products
+        self.fetched = []
+
+    def get_data(self, url_path, firstResult=1, lastResult=None, method="GET", search_params={}, stream=False,
+                 page_size=None):
+        if url_path.endswith("-search"):
+            since = search_params.get("updatedOn", "/").rstrip("/")
+            rows = [[object_id, updated_on] for object_id, updated_on in sorted(self.products.items())
+                    if updated_on >= since]
+            return {"metaData": {"columns": [{"name": "productId"}, {"name": "updatedOn"}],
+                                 "lastResult": len(rows), "morePagesAvailable": False},
+                    "results": rows}
+        ids = list(IdSet.parse(url_path.rstrip("/")))
+        self.fetched.extend(ids)
+        return [{"productId": object_id, "updatedOn": self.products[object_id]} for object_id in ids]
+
+
+class TestDependentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = Context.config, Context.state, Context.session, Context.response_cache
+        self.directory = tempfile.mkdtemp()
+        Context.config = {"dependent_batch_size": 10}
+        Context.response_cache = ResponseCache(os.path.join(self.directory, "responses.db"))
+        self.products = {object_id: UPDATED_ON for object_id in range(1, 51)}
+
+    def tearDown(self):
+        Context.response_cache.close()
+        Context.config, Context.state, Context.session, Context.response_cache = self.saved
+        shutil.rmtree(self.directory)
+
+    def run_stream(self, state):
+        Context.state = state
+        Context.session = FakeSession(self.products)
+        records = [record for data in Stream("product_price").get_data() if not isinstance(data, Checkpoint)
+                   for record in data]
+        return records, Context.session.fetched
+
+    def test_full_reload_served_from_cache(self):
+        self.run_stream({})
+        self.products[7] = LATER
+        records, fetched = self.run_stream({})
+        self.assertEqual(sorted(record["productId"] for record in records), list(range(1, 51)))
+        self.assertEqual(fetched, [7])
+        self.assertEqual(Context.response_cache.hits, 49)
+
+    def test_incremental_run_misses(self):
+        # the search only returns the products that moved: nothing to serve from the cache
+        records, _ = self.run_stream({})
+        for object_id in (3, 4, 5):
+            self.products[object_id] = LATER
+        records, fetched = self.run_stream({"bookmarks": {"product_price": {"updatedOn": LATER}}})
+        self.assertEqual(fetched, [3, 4, 5])
+        self.assertEqual(len(records), 3)
+        self.assertEqual(Context.response_cache.hits, 0)
+
+    def test_overlap_served_from_cache(self):
+        self.run_stream({})
+        self.products[3] = LATER
+        Context.config["incremental_back_days"] = 60
+        _, fetched = self.run_stream({"bookmarks": {"product_price": {"updatedOn": LATER}}})
+        self.assertEqual(fetched, [3])
+        self.assertEqual(Context.response_cache.hits, 49)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+
+from tap_brightpearl.context import Context
+from tap_brightpearl.scheduler import StreamScheduler
+
+
+class TestSafeState(unittest.TestCase):
+
+    def setUp(self):
+        self.state = Context.state
+        Context.state = {"bookmarks": {
+            "orders": {"updatedOn": "2021-01-01T00:00:00Z"},
+            "products": {"updatedOn": "2021-02-01T00:00:00Z"},
+        }}
+        self.scheduler = StreamScheduler(["orders", "products", "customers"], max_streams=3)
+
+    def tearDown(self):
+        Context.state = self.state
+
+    def sync(self, stream_id, value):
+        # what a stream does to its bookmark while running
+        Context.state["bookmarks"][stream_id] = {"updatedOn": value}
+
+    def test_running_streams_keep_their_start_bookmark(self):
+        self.scheduler.start("orders")
+        self.sync("orders", "2021-06-01T00:00:00Z")
+        bookmarks = self.scheduler.safe_state()["bookmarks"]
+        self.assertEqual(bookmarks["orders"], {"updatedOn": "2021-01-01T00:00:00Z"})
+        self.assertEqual(bookmarks["currently_sync_stream"], "orders")
+
+        self.scheduler.finish("orders")
+        bookmarks = self.scheduler.safe_state()["bookmarks"]
+        self.assertEqual(bookmarks["orders"], {"updatedOn": "2021-06-01T00:00:00Z"})
+        self.assertNotIn("currently_sync_stream", bookmarks)
+
+    def test_streams_finishing_out_of_order(self):
+        for stream_id in ("orders", "products", "customers"):
+            self.scheduler.start(stream_id)
+        self.sync("orders", "2021-06-01T00:00:00Z")
+        self.sync("products", "2021-07-01T00:00:00Z")
+        self.sync("customers", "2021-08-01T00:00:00Z")
+
+        # the last one started finishes first
+        self.scheduler.finish("customers")
+        bookmarks = self.scheduler.safe_state()["bookmarks"]
+        self.assertEqual(bookmarks["customers"], {"updatedOn": "2021-08-01T00:00:00Z"})
+        self.assertEqual(bookmarks["orders"], {"updatedOn": "2021-01-01T00:00:00Z"})
+        self.assertEqual(bookmarks["products"], {"updatedOn": "2021-02-01T00:00:00Z"})
+        self.assertEqual(bookmarks["currently_sync_stream"], "orders")
+
+        self.scheduler.finish("orders")
+        bookmarks = self.scheduler.safe_state()["bookmarks"]
+        self.assertEqual(bookmarks["orders"], {"updatedOn": "2021-06-01T00:00:00Z"})
+        self.assertEqual(bookmarks["products"], {"updatedOn": "2021-02-01T00:00:00Z"})
+        self.assertEqual(bookmarks["currently_sync_stream"], "products")
+
+        self.scheduler.finish("products")
+        self.assertEqual(self.scheduler.safe_state(), Context.state)
+
+    def test_stream_without_bookmark(self):
+        self.scheduler.start("customers")
+        self.sync("customers", "2021-08-01T00:00:00Z")
+        bookmarks = self.scheduler.safe_state()["bookmarks"]
+        self.assertNotIn("customers", bookmarks)
+
+    def test_checkpoint(self):
+        self.scheduler.start("customers")
+        self.scheduler.checkpoint("customers", {"parent": "2021-03-01T00:00:00Z"})
+        bookmarks = self.scheduler.safe_state()["bookmarks"]
+        self.assertEqual(bookmarks["customers"], {"checkpoint": {"parent": "2021-03-01T00:00:00Z"}})
+
+        self.scheduler.start("orders")
+        self.scheduler.checkpoint("orders", {"parent": "2021-04-01T00:00:00Z"})
+        bookmarks = self.scheduler.safe_state()["bookmarks"]
+        self.assertEqual(bookmarks["orders"], {"updatedOn": "2021-01-01T00:00:00Z",
+                                               "checkpoint": {"parent": "2021-04-01T00:00:00Z"}})
+
+        self.scheduler.finish("orders")
+        self.assertNotIn("checkpoint", self.scheduler.safe_state()["bookmarks"]["orders"])
+
+    def test_state_not_shared(self):
+        self.scheduler.start("orders")
+        self.scheduler.safe_state()["bookmarks"]["orders"]["updatedOn"] = "changed"
+        self.assertEqual(Context.state["bookmarks"]["orders"], {"updatedOn": "2021-01-01T00:00:00Z"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+from singer.transform import Transformer
+
+from tap_brightpearl.schema_inference import SchemaInference
+
+
+def infer(*records, **kwargs):
+    inference = SchemaInference(**kwargs)
+    for record in records:
+        inference.add(record)
+    return inference.properties()
+
+
+class TestSchemaInference(unittest.TestCase):
+
+    def test_scalars(self):
+        properties = infer({"id": 1, "price": 1.5, "name": "a", "active": True, "note": None})
+        self.assertEqual(properties, {
+            "id": {"type": ["null", "integer"]},
+            "price": {"type": ["null", "number"]},
+            "name": {"type": ["null", "string"]},
+            "active": {"type": ["null", "boolean"]},
+            "note": {"type": ["null", "string"]},
+        })
+
+    def test_merged_over_records(self):
+        # a field missing or null in the first records still gets its type
+        properties = infer({"id": 1}, {"id": 2, "code": None}, {"id": 3, "code": "A", "price": 2})
+        self.assertEqual(properties["code"], {"type": ["null", "string"]})
+        self.assertEqual(properties["price"], {"type": ["null", "integer"]})
+
+    def test_widening(self):
+        self.assertEqual(infer({"v": 1}, {"v": 1.5})["v"], {"type": ["null", "number"]})
+        self.assertEqual(infer({"v": 1}, {"v": "1"})["v"], {"type": ["null", "string"]})
+        self.assertEqual(infer({"v": True}, {"v": "yes"})["v"], {"type": ["null", "string"]})
+        self.assertEqual(infer({"v": {"a": 1}}, {"v": 1})["v"], {})
+
+    def test_booleans_with_numbers(self):
+        self.assertEqual(infer({"v": True}, {"v": 0})["v"], {"type": ["null", "integer"]})
+        self.assertEqual(infer({"v": True}, {"v": 0}, {"v": 0.5})["v"], {"type": ["null", "number"]})
+        # true comes out as 1, not "True"
+        schema = {"type": "object", "properties": infer({"v": True}, {"v": 0})}
+        self.assertEqual(Transformer().transform({"v": True}, schema), {"v": 1})
+
+    def test_nested(self):
+        properties = infer({"address": {"city": "a"}, "tags": ["x"]},
+                           {"address": {"city": None, "zip": 1}, "tags": []})
+        self.assertEqual(properties["address"], {
+            "type": ["null", "object"],
+            "properties": {"city": {"type": ["null", "string"]}, "zip": {"type": ["null", "integer"]}},
+            "patternProperties": {".*": {}},
+        })
+        self.assertEqual(properties["tags"], {"type": ["null", "array"], "items": {"type": ["null", "string"]}})
+        self.assertEqual(infer({"tags": []})["tags"], {"type": ["null", "array"], "items": {}})
+
+    def test_id_keyed_objects(self):
+        properties = infer({"rows": {"12": {"qty": 1}, "13": {"qty": 2.5, "sku": "a"}}},
+                           {"rows": {"14": {"qty": 3}}})
+        self.assertEqual(properties["rows"], {
+            "type": ["null", "object"],
+            "patternProperties": {".*": {
+                "type": ["null", "object"],
+                "properties": {"qty": {"type": ["null", "number"]}, "sku": {"type": ["null", "string"]}},
+                "patternProperties": {".*": {}},
+            }},
+        })
+
+    def test_too_many_keys_is_a_map(self):
+        record = {"values": {"key{}".format(number): number for number in range(5)}}
+        self.assertEqual(infer(record, max_properties=3)["values"],
+                         {"type": ["null", "object"], "patternProperties": {".*": {"type": ["null", "integer"]}}})
+
+    def test_no_record(self):
+        self.assertEqual(infer(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import datetime
+import io
+import json
+import threading
+import unittest
+
+import pytz
+from singer import metadata
+from singer.transform import Transformer
+
+from tap_brightpearl.output import SingerWriter
+from tap_brightpearl.record_pipeline import RecordPipeline
+from tap_brightpearl.row import Row, column_index
+from tap_brightpearl.transform_pool import TransformError, TransformPool
+
+SCHEMA = {"type": "object", "properties": {
+    "id": {"type": ["integer"]},
+    "name": {"type": ["null", "string"]},
+    "price": {"type": ["null", "number"]},
+    "lines": {"type": ["null", "array"], "items": {"type": "object", "properties": {"qty": {"type": "integer"}}}},
+}}
+TIME_EXTRACTED = datetime.datetime(2021, 1, 2, 3, 4, 5, tzinfo=pytz.utc)
+
+
+def catalog_entry(stream_id):
+    mdata = metadata.write({}, (), "selected", True)
+    return {"tap_stream_id": stream_id, "schema": SCHEMA, "metadata": metadata.to_list(mdata)}
+
+
+def records(count, start=0):
+    index = column_index(["id", "name", "price", "lines"])
+    return [Row(index, [object_id, "n{}".format(object_id), object_id, [{"qty": str(object_id)}]])
+            for object_id in range(start, start + count)]
+
+
+class TestTransformPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.entries = {stream_id: catalog_entry(stream_id) for stream_id in ("orders", "products")}
+
+    def run_pool(self, events, **kwargs):
+        out = io.BytesIO()
+        writer = SingerWriter(out)
+        pool = TransformPool(writer, self.entries, 2, batch_records=7, **kwargs)
+        try:
+            for stream_id, record in events:
+                pool.add(stream_id, record, TIME_EXTRACTED)
+            pool.flush()
+        finally:
+            pool.close()
+            writer.close()
+        return out.getvalue()
+
+    def run_inline(self, events):
+        out = io.BytesIO()
+        writer = SingerWriter(out)
+        pipelines = {stream_id: RecordPipeline(entry, Transformer()) for stream_id, entry in self.entries.items()}
+        for stream_id, record in events:
+            writer.write_record(stream_id, pipelines[stream_id].transform(record), time_extracted=TIME_EXTRACTED)
+        writer.close()
+        return out.getvalue()
+
+    def test_same_output_as_inline(self):
+        events = [("orders", record) for record in records(50)]
+        self.assertEqual(self.run_pool(events), self.run_inline(events))
+
+    def test_order_kept_per_stream(self):
+        events = [("orders", record) for record in records(20)] + \
+                 [("products", record) for record in records(20, 100)]
+
+        def by_stream(output):
+            lines = {}
+            for line in output.splitlines():
+                lines.setdefault(json.loads(line)["stream"], []).append(line)
+            return lines
+
+        self.assertEqual(by_stream(self.run_pool(events)), by_stream(self.run_inline(events)))
+
+    def test_bad_record_fails_the_sync(self):
+        events = [("orders", record) for record in records(10)]
+        events.insert(3, ("orders", {"id": "not a number"}))
+        errors = []
+
+        def run():
+            try:
+                self.run_pool(events)
+            except TransformError as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(60)
+        self.assertFalse(thread.is_alive(), "the pool blocked on a failed batch")
+        self.assertEqual(len(errors), 1)
+        self.assertIn("SchemaMismatch on orders", str(errors[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()